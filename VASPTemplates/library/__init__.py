@@ -1 +1 @@
-__all__=["pharser","settings"]
\ No newline at end of file
+__all__=["pharser","settings","generator","potcar","potindex","sinks","api"]
\ No newline at end of file
@@ -0,0 +1,183 @@
+import os
+import json
+import itertools
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from . import pharser
+from . import generator
+from . import sinks
+
+#在进程内生成VASP输入文件的入口，供其他Python代码直接调用，不必再通过vt.py和临时的.vt文件
+
+@lru_cache(maxsize=256)
+def compilevt(text):
+    #同一段模板文本只编译一次
+    Lines=text.splitlines(keepends=True)
+    if Lines and not Lines[-1].endswith('\n'):
+        Lines[-1]+='\n'
+    return tuple(pharser.CompileVTLines(Lines))
+
+def expandvt(text,*args):
+    #展开模板文本中的%INCLUDE，返回VTLines
+    return pharser.ExecuteVTOps([],compilevt(text),args)
+
+def applyoverrides(VTLines,incar=None,params=None,kpoints=None):
+    #在展开后的VTLines末尾追加覆盖项，后出现的INCAR参数和%参数会覆盖前面的
+    Lines=list(VTLines)
+    if kpoints is not None:
+        #整体替换%START ... %END之间的KPOINTS块
+        Kept=[]
+        KPTAG=False
+        for Line in Lines:
+            ROBOOTLine=Line.strip()
+            if ROBOOTLine[0:6]=='%START':
+                KPTAG=True
+                continue
+            if ROBOOTLine[0:4]=='%END':
+                KPTAG=False
+                continue
+            if not KPTAG:
+                Kept.append(Line)
+        Lines=Kept
+        Block=kpoints if isinstance(kpoints,str) else "\n".join(kpoints)
+        Lines.append("%START KPOINTS\n")
+        Lines.extend(Line+'\n' for Line in Block.strip('\n').split('\n'))
+        Lines.append("%END KPOINTS\n")
+    for Name,Value in (params or {}).items():
+        Lines.append("%%%s=%s\n"%(Name.lstrip('%'),Value))
+    for Name,Value in (incar or {}).items():
+        Lines.append("%s = %s\n"%(Name,Value))
+    return Lines
+
+def render(template,calcdir=".",incar=None,params=None,kpoints=None,poscar=None,args=()):
+    """
+    由模板文本生成INCAR/KPOINTS/POSCAR/POTCAR，不写文件
+
+    Args:
+        template (str): .vt模板的文本内容
+        calcdir (str): 计算目录，模板中定义了%CALCDIR时以模板为准
+        incar (dict): 覆盖或追加的INCAR参数，例如{"ENCUT": 520}
+        params (dict): 覆盖或追加的%参数，例如{"PSEUDO_DIR": "/path/to/potpaw"}
+        kpoints (str): 替换模板中的KPOINTS块
+        poscar (str): POSCAR文本，给出时不再读取%POSCAR指向的文件
+        args (tuple): 模板中%{1}..%{n}的取值
+
+    Returns:
+        tuple: (计算目录, {文件名: 文件内容})
+    """
+    VTLines=applyoverrides(expandvt(template,*args),incar,params,kpoints)
+    INPUTLINES=pharser.pharseVTLines(VTLines)
+    return generator.renderinputfile(INPUTLINES,calcdir,poscar)
+
+def generate(template,calcdir,incar=None,params=None,kpoints=None,poscar=None,args=(),incremental=False,
+             sink=None):
+    #生成并写入计算目录，返回计算目录；incremental为True时内容没有变化的文件不会被改写
+    #sink是sinks中的输出目标(MemorySink/TarSink等)，默认写到目录
+    CALCDIR,FILES=render(template,calcdir,incar,params,kpoints,poscar,args)
+    (sink or sinks.DirectorySink(incremental)).write(CALCDIR,FILES)
+    return CALCDIR
+
+def sync(template,calcdir,**kwargs):
+    #增量生成，返回(计算目录, {文件名: created/changed/unchanged})
+    CALCDIR,FILES=render(template,calcdir,**kwargs)
+    return CALCDIR,generator.writefiles(CALCDIR,FILES,incremental=True)
+
+def generatefromfile(filename,calcdir,**kwargs):
+    fp=open(filename,'r')
+    template=fp.read()
+    fp.close()
+    return generate(template,calcdir,**kwargs)
+
+def expandgrid(grid):
+    #参数网格的笛卡尔积，每个点是一个{名字: 取值}
+    Names=list(grid)
+    for Values in itertools.product(*(grid[Name] for Name in Names)):
+        yield dict(zip(Names,Values))
+
+def _pointoptions(point,poscars):
+    #网格的键: "KPOINTS"替换KPOINTS块，"POSCAR"给出结构(文本或文件路径)，
+    #以%开头的是%参数，其余的都是INCAR参数
+    incar={}
+    params={}
+    kpoints=None
+    poscar=None
+    for Name,Value in point.items():
+        if Name.upper()=="KPOINTS":
+            kpoints=Value
+        elif Name.upper()=="POSCAR":
+            poscar=poscars.get(Value,Value)
+        elif Name.startswith('%'):
+            params[Name[1:]]=Value
+        else:
+            incar[Name]=Value
+    return dict(incar=incar,params=params,kpoints=kpoints,poscar=poscar)
+
+def _pointlabel(Index,point,grid):
+    #计算目录名：序号加上各个取值，多行文本(KPOINTS块、POSCAR内容)用它在网格中的序号代替
+    Parts=["%04d"%Index]
+    for Name,Value in point.items():
+        Text=str(Value)
+        if '\n' in Text:
+            Text=str(list(grid[Name]).index(Value))
+        elif Name.upper()=="POSCAR":
+            Text=os.path.basename(Text)
+        Text="".join(c if c.isalnum() or c in ".-" else "-" for c in Text)
+        Parts.append("%s-%s"%(Name.lstrip('%'),Text))
+    return "_".join(Parts)
+
+def sweep(template,grid,basedir,workers=None,manifest="manifest.json",args=(),incremental=False,sink=None):
+    """
+    对同一个模板按参数网格批量生成计算目录
+
+    Args:
+        template (str): .vt模板的文本内容
+        grid (dict): {名字: 取值列表}，例如
+                     {"ENCUT": [400, 500, 600], "KPOINTS": [块1, 块2], "POSCAR": ["a/POSCAR", "b/POSCAR"],
+                      "%POT-Fe": ["Fe", "Fe_pv"]}
+        basedir (str): 所有计算目录的上级目录
+        workers (int): 并行生成的线程数，默认由ThreadPoolExecutor决定
+        manifest (str): 写在basedir下的清单文件名，None表示不写
+        incremental (bool): 只改写内容有变化的文件
+        sink: sinks中的输出目标，例如TarSink("batch.tar.gz")把所有计算目录和清单写进一个包；
+              默认写到basedir下的目录。sink由调用者负责close
+
+    Returns:
+        dict: {"basedir": ..., "points": [{"calcdir", "point", "files"} 或 {"calcdir", "point", "error"}]}，
+              files是{文件名: created/changed/unchanged/written}
+    """
+    points=list(expandgrid(grid))
+    #同一个POSCAR文件只读一次，读不到的文件记下错误，只让用到它的点失败
+    poscars={}
+    for Value in grid.get("POSCAR",grid.get("poscar",())):
+        if '\n' not in Value:
+            try:
+                fp=open(Value,'r')
+                poscars[Value]=fp.read()
+                fp.close()
+            except OSError as e:
+                poscars[Value]=e
+
+    sink=sink or sinks.DirectorySink(incremental)
+
+    def run(Index):
+        point=points[Index]
+        calcdir=os.path.join(basedir,_pointlabel(Index,point,grid))
+        options=_pointoptions(point,poscars)
+        #模板中的%CALCDIR会让所有点写到同一个目录，这里强制使用各自的目录
+        options["params"]["CALCDIR"]=calcdir
+        entry={"calcdir":calcdir,"point":{Name:str(Value) for Name,Value in point.items()}}
+        try:
+            if isinstance(options["poscar"],OSError):
+                raise options["poscar"]
+            CALCDIR,FILES=render(template,calcdir,args=args,**options)
+            entry["files"]=sink.write(CALCDIR,FILES)
+        except Exception as e:
+            entry["error"]=str(e)
+        return entry
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries=list(pool.map(run,range(len(points))))
+    result={"basedir":basedir,"points":entries}
+    if manifest:
+        sink.write(basedir,{manifest:json.dumps(result,indent=1)})
+    return result
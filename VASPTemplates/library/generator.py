@@ -1,9 +1,68 @@
 import os
 import re
+import math
+import hashlib
 import datetime
-from . import settings
+from . import potcar
+from . import potindex
 
-def writeinputfile(VTLines,calcdir):
+def writeinputfile(VTLines,calcdir,incremental=False):
+    CALCDIR,FILES=renderinputfile(VTLines,calcdir)
+    writefiles(CALCDIR,FILES,incremental)
+    return CALCDIR
+
+#比较文件内容时忽略INCAR头部的生成时间
+_VOLATILE=re.compile(rb'^#Generated date:[^\n]*\n?',re.M)
+
+def contentdigest(Content):
+    if isinstance(Content,str):
+        Content=Content.encode()
+    return hashlib.sha256(_VOLATILE.sub(b'',Content)).hexdigest()
+
+def filestatus(Filename,Content):
+    #与磁盘上已有的文件比较：created/changed/unchanged
+    if not os.path.exists(Filename):
+        return "created"
+    with open(Filename,'rb') as fp:
+        Existing=fp.read()
+    return "unchanged" if contentdigest(Existing)==contentdigest(Content) else "changed"
+
+def writefiles(CALCDIR,FILES,incremental=False):
+    #incremental为True时只写内容有变化的文件，没有变化的文件保持原样(mtime不变)
+    #返回{文件名: created/changed/unchanged/written}
+    os.makedirs(CALCDIR,exist_ok=True)
+    Status={}
+    for Name,Content in FILES.items():
+        Filename=os.path.join(CALCDIR,Name)
+        if incremental:
+            Status[Name]=filestatus(Filename,Content)
+            if Status[Name]=="unchanged":
+                continue
+        else:
+            Status[Name]="written"
+        if Name=="POTCAR":
+            potcar.writepotcar(Filename,Content)
+            continue
+        fp=open(Filename,'w')
+        fp.write(Content)
+        fp.close()
+    return Status
+
+def renderinputfile(VTLines,calcdir,POSCAR=None):
+    #在内存中生成四个输入文件，返回(计算目录, {文件名: 内容})
+    INCAR,KPOINTS,VTValues=splitinputlines(VTLines)
+    CALCDIR=VTValues.get("CALCDIR",calcdir)
+    POSCARLINES,POTCAR,POTCARINFO=RenderPOTCAR(VTValues,POSCAR)
+    INCAR=AutoINCARTags(INCAR,VTValues,POSCARLINES,POTCARINFO)
+    FILES={
+        "KPOINTS":"".join(KPOINTS),
+        "POSCAR":"".join(POSCARLINES),
+        "POTCAR":POTCAR,
+        "INCAR":RenderINCAR(INCAR,POTCARINFO),
+    }
+    return CALCDIR,FILES
+
+def splitinputlines(VTLines):
     INCAR=[]
     KPOINTS=[]
     VTValues={}
@@ -17,7 +76,7 @@ def writeinputfile(VTLines,calcdir):
         #如果定义的是KPOINTS的结尾，则标记TAG：
         if ROBOOTLine[0:4]=="%END":
             KPTAG=False
-            continue        
+            continue
         #如果是KPOINTS行内的东西，则放到KPOINTS列表里
         if KPTAG:
             KPOINTS.append(Line)
@@ -26,7 +85,7 @@ def writeinputfile(VTLines,calcdir):
         if ROBOOTLine[0]=='#':
             INCAR.append(Line)
             continue
-        UNOTELine=ROBOOTLine.split('#')[0]        
+        UNOTELine=ROBOOTLine.split('#')[0]
         #如果是定义VT参数的值，则记录该值
         if '=' in UNOTELine and UNOTELine[0]=='%':
             VTName=UNOTELine.split('=')[0].strip().split('%')[1].strip()
@@ -35,43 +94,28 @@ def writeinputfile(VTLines,calcdir):
             continue
         #其他东西也不管了，一股脑塞INCAR里
         INCAR.append(Line)
-    CALCDIR=WriteKPOINTS(KPOINTS,VTValues,calcdir)
-    POTCARINFO=WritePOTCAR(VTValues,CALCDIR)
-    WriteINCAR(INCAR,VTValues,POTCARINFO,CALCDIR)
-
-def WriteKPOINTS(KPOINTS,VTValues,calcdir):
-    #先建个文件夹
-    if "CALCDIR" in VTValues:
-        DIR=VTValues["CALCDIR"]
-    else:
-        DIR=calcdir
-    os.makedirs(DIR,exist_ok=True)
-    fp=open(os.path.join(DIR,"KPOINTS"),'w')
-    fp.writelines(KPOINTS)
-    fp.close()
-    return DIR
+    return INCAR,KPOINTS,VTValues
 
-def WritePOTCAR(VTValues,CALCDIR):
+def RenderPOTCAR(VTValues,POSCAR=None):
     #先判断赝势文件目录规定了没
     if not "PSEUDO_DIR" in VTValues:
         raise Exception("You need %PSEUDO_DIR to tell us the root dir of your pseudopotential files")
     else:
         PSEUDO_DIR=VTValues["PSEUDO_DIR"]
-    #再瞅瞅有没有指定POSCAR文件
-    if "POSCAR" in VTValues:
-        PSFile=VTValues["POSCAR"]
-    else:
-        PSFile="POSCAR"
-    #判断POSCAR文件是否可以访问
-    if not os.access(PSFile,os.R_OK):
-        raise Exception("POSCAR file can not read")
-    POSfp=open(PSFile,"r")
-    POSCAR=POSfp.readlines()
-    POSfp.close()
-    POSfp=open(os.path.join(CALCDIR,"POSCAR"),'w')
-    POSfp.writelines(POSCAR)
-    POSfp.close()
-    open(os.path.join(CALCDIR,"POTCAR"),'w').close()
+    if POSCAR is None:
+        #再瞅瞅有没有指定POSCAR文件
+        if "POSCAR" in VTValues:
+            PSFile=VTValues["POSCAR"]
+        else:
+            PSFile="POSCAR"
+        #判断POSCAR文件是否可以访问
+        if not os.access(PSFile,os.R_OK):
+            raise Exception("POSCAR file can not read")
+        POSfp=open(PSFile,"r")
+        POSCAR=POSfp.readlines()
+        POSfp.close()
+    elif isinstance(POSCAR,str):
+        POSCAR=POSCAR.splitlines(keepends=True)
     Atoms=POSCAR[5].split()
     POTCARS=[]
     for Atom in Atoms:
@@ -79,31 +123,56 @@ def WritePOTCAR(VTValues,CALCDIR):
             PTFile=VTValues["POT-"+Atom]
         else:
             PTFile=Atom
+        #赝势库有索引(potindex.json)时直接查表，不再逐个探测文件
+        PTPath,Entry=potindex.lookup(PSEUDO_DIR,PTFile)
+        if PTPath:
+            POTCARS.append((Atom,PTPath))
+            continue
         if not os.access(os.path.join(PSEUDO_DIR,PTFile),os.R_OK):
             raise Exception("POSCAR file can not read:"+os.path.join(PSEUDO_DIR,PTFile))
         else:
             AtomDir=os.path.join(PSEUDO_DIR,PTFile)
-        if os.access(os.path.join(AtomDir,"POTCAR"),os.R_OK):
-            os.system("cat %s >> %s"%(os.path.join(AtomDir,"POTCAR"),os.path.join(CALCDIR,"POTCAR")))
-            POTCARS.append((Atom,os.path.join(AtomDir,"POTCAR")))
-        elif os.access(os.path.join(AtomDir,"POTCAR.Z"),os.R_OK):
-            os.system("zcat %s >> %s"%(os.path.join(AtomDir,"POTCAR.Z"),os.path.join(CALCDIR,"POTCAR")))
-            POTCARS.append((Atom,os.path.join(AtomDir,"POTCAR.Z")))
-        elif os.access(os.path.join(AtomDir,"POTCAR.gz"),os.R_OK):
-            os.system("zcat %s >> %s"%(os.path.join(AtomDir,"POTCAR.gz"),os.path.join(CALCDIR,"POTCAR")))
-            POTCARS.append((Atom,os.path.join(AtomDir,"POTCAR.gz")))
+        for Name in ("POTCAR","POTCAR.Z","POTCAR.gz"):
+            PTPath=os.path.join(AtomDir,Name)
+            if os.access(PTPath,os.R_OK):
+                POTCARS.append((Atom,PTPath))
+                break
         else:
             raise Exception("POSCAR file \"POTCAR\" or \"POTCAR.Z\" or \"POTCAR.gz\" can not read")
-    return POTCARS
+    #在进程内解压和拼接，结果按元素列表缓存(bytes)
+    return POSCAR,potcar.assemblepotcar([PTPath for Atom,PTPath in POTCARS]),POTCARS
+
+def AutoINCARTags(INCAR,VTValues,POSCAR,POTCARINFO):
+    #%AUTO_ENCUT=系数：ENCUT取各元素ENMAX最大值乘以系数(默认1.3)后向上取整
+    #%AUTO_NELECT=附加电子数：NELECT取各元素ZVAL乘以原子数之和再加上附加电子数(默认0)
+    #INCAR中已经写了ENCUT/NELECT时不覆盖；参数来自赝势库索引，没有索引时从POTCAR文件头读取
+    Tags=set()
+    for Line in INCAR:
+        UNOTELine=Line.split('#')[0]
+        if '=' in UNOTELine:
+            Tags.add(UNOTELine.split('=')[0].strip().upper())
+    Lines=[]
+    if "AUTO_ENCUT" in VTValues and "ENCUT" not in Tags:
+        Factor=float(VTValues["AUTO_ENCUT"] or 1.3)
+        ENMAX=max(potindex.info(PTPath)["enmax"] for Atom,PTPath in POTCARINFO)
+        Lines.append("ENCUT = %d #%s*max(ENMAX)\n"%(math.ceil(Factor*ENMAX),Factor))
+    if "AUTO_NELECT" in VTValues and "NELECT" not in Tags:
+        Extra=float(VTValues["AUTO_NELECT"] or 0)
+        Counts=[int(Count) for Count in POSCAR[6].split()]
+        NELECT=sum(potindex.info(PTPath)["zval"]*Count for (Atom,PTPath),Count in zip(POTCARINFO,Counts))+Extra
+        Lines.append("NELECT = %g #sum(ZVAL)%+g\n"%(NELECT,Extra))
+    if Lines and INCAR and not INCAR[-1].endswith('\n'):
+        INCAR=INCAR[:-1]+[INCAR[-1]+'\n']
+    return INCAR+Lines
 
-def WriteINCAR(INCAR,VTValues,POTCARINFO,CALCDIR):
-    fp=open(os.path.join(CALCDIR,"INCAR"),'w')
-    fp.write("#This INCAR file was generated by VASPTEMPLATES Code provided by Zicong\n")
-    fp.write("#https://gitee.com/xczics/vasptemplate#\n")
-    fp.write("#The POTCAR used in this calculation are:\n")
+def RenderINCAR(INCAR,POTCARINFO):
+    Lines=[]
+    Lines.append("#This INCAR file was generated by VASPTEMPLATES Code provided by Zicong\n")
+    Lines.append("#https://gitee.com/xczics/vasptemplate#\n")
+    Lines.append("#The POTCAR used in this calculation are:\n")
     for Atom in POTCARINFO:
-        fp.write("#\t%s\t%s\n"%(Atom[0],Atom[1]))
-    fp.write("#Generated date:%s\n"%(datetime.datetime.now().strftime('%Y/%m/%d-%X')))
-    fp.write("#---------------------------------------#\n\n")
-    fp.writelines(INCAR)
-    fp.close()
\ No newline at end of file
+        Lines.append("#\t%s\t%s\n"%(Atom[0],Atom[1]))
+    Lines.append("#Generated date:%s\n"%(datetime.datetime.now().strftime('%Y/%m/%d-%X')))
+    Lines.append("#---------------------------------------#\n\n")
+    Lines.extend(INCAR)
+    return "".join(Lines)
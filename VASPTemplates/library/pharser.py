@@ -1,34 +1,61 @@
 import os
 import re
 from . import settings
-def PushVTLines(VTLines,Line,*args):
-    #print(Line)
+#模板编译缓存：
+#  _COMPILED  文件名 -> ((mtime_ns, size), 编译后的指令列表)
+#  _EXPANDED  (文件名, 参数, 搜索路径, 当前目录) -> (依赖, 展开后的VTLines)
+#             依赖包括用到的文件及其(mtime_ns, size)，以及每个%INCLUDE当时找到的文件
+#模板文件的查找结果不缓存：之后在当前目录或VTPATH中新建的同名模板会覆盖库中的模板
+_COMPILED={}
+_EXPANDED={}
+
+def ClearVTCache():
+    _COMPILED.clear()
+    _EXPANDED.clear()
+
+_PLACEHOLDER=re.compile(r'%\{([^{}]+)\}')
+
+def TokenizeVTLine(Line):
+    #把一行切分为[文本, 参数名, 文本, 参数名, ..., 文本]，奇数位置是%{...}中的名字
+    if '%{' not in Line:
+        return [Line]
+    return _PLACEHOLDER.split(Line)
+
+def SubstituteVTTokens(Tokens,values=None,args=None):
+    #一次遍历完成替换：%{n}取args中的第n个，%{NAME}取values中的值，没有定义的保持原样
+    if len(Tokens)==1:
+        return Tokens[0]
+    Parts=[]
+    for Index,Token in enumerate(Tokens):
+        if not Index%2:
+            Parts.append(Token)
+        elif args is not None and Token.isascii() and Token.isdigit():
+            Parts.append(args[int(Token)-1])
+        elif values and Token in values:
+            Parts.append(values[Token])
+        else:
+            Parts.append('%{'+Token+'}')
+    return ''.join(Parts)
+
+def CompileVTLine(Line):
+    #把一行模板编译为一条指令，返回None表示该行被忽略
     ROBOOTLine=Line.strip()
     if not len(ROBOOTLine):
-        return 1
+        return None
     #如果是VT注释，则直接忽略
     if ROBOOTLine[0:2]=='##':
-        return 1
+        return None
     #如果是命令行注释，则直接忽略
     if ROBOOTLine[0:2]=='#!':
-        return 1    
+        return None
     #如果是写在INCAR里的注释，则原样放上去
     if ROBOOTLine[0]=='#':
-        VTLines.append(Line)
-        return 1
-    #如果式中含有%{1}-%{n}，则进行初步的替换
-    FileParameters=re.findall(r'%{[0-9]+}',Line)
-    if len(FileParameters):
-        replaced=[]
-        for FileParameter in FileParameters:
-            if FileParameter in replaced:
-                continue
-            FileParameter_Index=int(FileParameter[2:-1])
-            Line=Line.replace(FileParameter,args[FileParameter_Index-1])
-            replaced.append(FileParameter)
-        VTLines.append(Line)
-        return 1
-    #如果是%INCLUDE开头，就进行递归
+        return ('LINE',Line)
+    #如果式中含有%{1}-%{n}，则先切分好，展开时再替换
+    Tokens=TokenizeVTLine(Line)
+    if any(Token.isascii() and Token.isdigit() for Token in Tokens[1::2]):
+        return ('ARGS',Tokens)
+    #如果是%INCLUDE开头，就记下要展开的文件
     if ROBOOTLine[0:8]=="%INCLUDE":
         parameterlist=[]
         INCLUDENAME=ROBOOTLine.split('=')[1].split('#')[0].strip()
@@ -36,32 +63,111 @@ def PushVTLines(VTLines,Line,*args):
         if Parameters:
             parameterlist=Parameters.group()[1:-1].split(',')
             INCLUDENAME=INCLUDENAME.split(Parameters.group())[0]
-        filename=findvtfile(INCLUDENAME)
-        if filename:
-            fp=open(filename,'r')
-            FileLines=fp.readlines()
-            FileLines[-1]+='\n'
-            fp.close()
-            for FileLine in FileLines:
-                PushVTLines(VTLines,FileLine,*parameterlist)
-            return  1
+        return ('INCLUDE',INCLUDENAME,tuple(parameterlist))
+    return ('LINE',Line)
+
+def CompileVTLines(Lines):
+    return [Op for Op in map(CompileVTLine,Lines) if Op is not None]
+
+def ExecuteVTOps(VTLines,Ops,args=(),deps=None):
+    #执行编译后的指令，把结果追加到VTLines；deps记录用到的文件，找不到文件时记为None
+    for Op in Ops:
+        if Op[0]=='LINE':
+            VTLines.append(Op[1])
+        elif Op[0]=='ARGS':
+            VTLines.append(SubstituteVTTokens(Op[1],args=args))
         else:
-            print("Did not find file" + INCLUDENAME)
-            return 1
-    VTLines.append(Line)
+            IncludeVTFile(VTLines,Op[1],Op[2],deps)
+    return VTLines
+
+def PushVTLines(VTLines,Line,*args):
+    #print(Line)
+    Op=CompileVTLine(Line)
+    if Op is not None:
+        ExecuteVTOps(VTLines,[Op],args)
     return 1
 
+def IncludeVTFile(VTLines,INCLUDENAME,parameterlist=(),deps=None):
+    filename=findvtfile(INCLUDENAME)
+    if filename:
+        if deps is not None:
+            #记下这次找到的文件，查找结果变了(例如新建了优先级更高的模板)时缓存失效
+            deps.append(('%INCLUDE',INCLUDENAME,filename))
+        VTLines.extend(ExpandVTFile(filename,parameterlist,deps))
+        return 1
+    print("Did not find file" + INCLUDENAME)
+    if deps is not None:
+        deps.append((INCLUDENAME,None))
+    return 1
 
-def findvtfile(fname):
-    if os.access(fname,os.R_OK):
-        return fname
+def _stamp(filename):
+    st=os.stat(filename)
+    return (st.st_mtime_ns,st.st_size)
+
+def _depsvalid(deps):
+    for dep in deps:
+        if len(dep)==3:
+            if findvtfile(dep[1])!=dep[2]:
+                return False
+            continue
+        filename,stamp=dep
+        if stamp is None:
+            return False
+        try:
+            if _stamp(filename)!=stamp:
+                return False
+        except OSError:
+            return False
+    return True
+
+def CompiledVTFile(filename):
+    #读取并编译模板文件，文件的mtime和大小不变时直接使用缓存
+    stamp=_stamp(filename)
+    cached=_COMPILED.get(filename)
+    if cached and cached[0]==stamp:
+        return stamp,cached[1]
+    fp=open(filename,'r')
+    FileLines=fp.readlines()
+    fp.close()
+    if FileLines:
+        FileLines[-1]+='\n'
+    Ops=CompileVTLines(FileLines)
+    _COMPILED[filename]=(stamp,Ops)
+    return stamp,Ops
+
+def ExpandVTFile(filename,args=(),deps=None):
+    #展开模板文件(包括其中嵌套的%INCLUDE)，依赖的文件都没有变化时直接返回缓存的结果
+    key=(filename,tuple(args))+_searchcontext()
+    cached=_EXPANDED.get(key)
+    if cached and _depsvalid(cached[0]):
+        if deps is not None:
+            deps.extend(cached[0])
+        return cached[1]
+    stamp,Ops=CompiledVTFile(filename)
+    mydeps=[(filename,stamp)]
+    Lines=ExecuteVTOps([],Ops,args,mydeps)
+    _EXPANDED[key]=(mydeps,Lines)
+    if deps is not None:
+        deps.extend(mydeps)
+    return Lines
+
+
+def _searchpaths():
     EnviromentPathList=[]
     if os.getenv('VTPATH'):
         EnviromentPathList=os.getenv('VTPATH').split(':')
     SettingPathList=settings.vtlist
     librarypath=os.path.dirname(__file__)
-    Paths=EnviromentPathList+SettingPathList+[librarypath]
-    for Path in Paths:
+    return EnviromentPathList+SettingPathList+[librarypath]
+
+def _searchcontext():
+    #相对路径的模板名和文件名依赖于搜索路径和当前目录
+    return (tuple(_searchpaths()),os.getcwd())
+
+def findvtfile(fname):
+    if os.access(fname,os.R_OK):
+        return fname
+    for Path in _searchpaths():
         if os.access(os.path.join(Path,fname),os.R_OK):
             return os.path.join(Path,fname)
         if os.access(os.path.join(Path,fname+'.vt'),os.R_OK):
@@ -69,27 +175,16 @@ def findvtfile(fname):
     return ""
 
 def pharseVTLines(VTLines):
+    #每行只切分一次，INCAR参数后出现的覆盖先出现的，最后一次性把%{NAME}替换为定义的值
     ResultLines=[]
-    ParaRefDict={}
     TAGRefDict={}
     PARAVALUE={}
     PARALINES={}
-    def CiteParaDict(RBLine,CiteIndex):
-        #如果式中含有%{PARANAME}，则进行标记
-        VTParameters=re.findall(r'%{.+}',RBLine)
-        if len(VTParameters):
-            cited=[]
-            for VTParameter in VTParameters:
-                if VTParameter in cited:
-                    continue
-                VTName=VTParameter[2:-1]
-                try:
-                    ParaRefDict[VTName].append(CiteIndex)
-                except:
-                    ParaRefDict[VTName]=[CiteIndex]
-                cited.append(VTName)
-    def CiteTagDict(TagName,CiteIndex):
-        TAGRefDict[TagName]=CiteIndex
+    Cited=set()
+    def Tokenize(Line):
+        Tokens=TokenizeVTLine(Line)
+        Cited.update(Tokens[1::2])
+        return Tokens
     for Line in VTLines:
         ROBOOTLine=Line.strip()
         if not len(ROBOOTLine):
@@ -97,40 +192,28 @@ def pharseVTLines(VTLines):
         #如果是VT注释，则直接忽略
         if ROBOOTLine[0:2]=='##':
             continue
-        UNOTELine=ROBOOTLine.split('#')[0]
-        #如果是INCARTAG的内容，则进行标记
-        if '=' in UNOTELine and UNOTELine[0]!='%':
-            TagName=UNOTELine.split('=')[0].strip()
+        UNOTELine=ROBOOTLine.partition('#')[0]
+        if '=' in UNOTELine:
+            Fields=UNOTELine.split('=')
+            #如果是定义VT参数的值，则记录该值
+            if UNOTELine[0]=='%':
+                VTName=Fields[0].strip().split('%')[1].strip()
+                PARAVALUE[VTName]=Fields[1].strip()
+                PARALINES[VTName]=Line
+                continue
+            #如果是INCARTAG的内容，则进行标记
+            TagName=Fields[0].strip()
             if TagName in TAGRefDict:
-                ResultLines[TAGRefDict[TagName]]=Line
-                CiteParaDict(ROBOOTLine,TAGRefDict[TagName])
+                ResultLines[TAGRefDict[TagName]]=Tokenize(Line)
             else:
-                ResultLines.append(Line)
-                CiteTagDict(TagName,len(ResultLines)-1)
-                CiteParaDict(ROBOOTLine,len(ResultLines)-1)
-            continue
-        #如果是定义VT参数的值，则记录该值
-        if '=' in UNOTELine and UNOTELine[0]=='%':
-            VTName=UNOTELine.split('=')[0].strip().split('%')[1].strip()
-            VTValue=UNOTELine.split('=')[1].strip()
-            PARAVALUE[VTName]=VTValue
-            PARALINES[VTName]=Line
+                TAGRefDict[TagName]=len(ResultLines)
+                ResultLines.append(Tokenize(Line))
             continue
         #其他东西也不管了，一股脑塞进去
-        ResultLines.append(Line)
-        CiteParaDict(ROBOOTLine,len(ResultLines)-1)
-    #对设定好的值进行替换
+        ResultLines.append(Tokenize(Line))
+    #对设定好的值进行替换，没有被引用的定义原样放在最后
+    Lines=[SubstituteVTTokens(Tokens,PARAVALUE) for Tokens in ResultLines]
     for VTName in PARAVALUE:
-        if VTName in ParaRefDict:
-            CHLines=ParaRefDict[VTName]
-            for CHLIndex in CHLines:
-                ResultLines[CHLIndex]=ResultLines[CHLIndex].replace('%{'+VTName+'}',PARAVALUE[VTName])
-        else:
-            ResultLines.append(PARALINES[VTName])
-    return ResultLines
-
-
-
-
-
-        
\ No newline at end of file
+        if VTName not in Cited:
+            Lines.append(PARALINES[VTName])
+    return Lines
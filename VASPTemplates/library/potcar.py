@@ -0,0 +1,153 @@
+import os
+import gzip
+import hashlib
+import threading
+from . import settings
+
+#在进程内读取和拼接POTCAR，不再调用cat/zcat：
+#  _DIGESTS    (路径, mtime_ns, 大小) -> 解压后内容的摘要
+#  _BLOBS      摘要 -> 解压后的单个元素POTCAR
+#  _ASSEMBLED  路径列表 -> (各文件的(mtime_ns, 大小), 拼接后的POTCAR)
+_DIGESTS={}
+_BLOBS={}
+_ASSEMBLED={}
+_LOCK=threading.Lock()
+
+def ClearPOTCARCache():
+    with _LOCK:
+        _DIGESTS.clear()
+        _BLOBS.clear()
+        _ASSEMBLED.clear()
+
+def _align(posbits,segstart,nbits):
+    #跳到下一组码的边界，每组是nbits个字节(8个码)
+    group=nbits<<3
+    offset=posbits-segstart-1
+    return segstart+offset+(group-(offset+group)%group)
+
+def unlzw(data,limit=None):
+    #解压compress(1)格式(.Z)的数据，与gzip的unlzw.c行为一致；给出limit时解压出至少limit字节后就停止
+    if data[:2]!=b'\x1f\x9d':
+        raise ValueError("Not a compress (.Z) file")
+    flags=data[2]
+    maxbits=flags&0x1f
+    blockmode=flags&0x80
+    if maxbits>16:
+        raise ValueError("Unsupported .Z file: %d bits"%maxbits)
+    maxmaxcode=1<<maxbits
+    buf=bytes(data)+b'\x00\x00\x00'
+    inbits=len(data)*8
+    posbits=3*8
+    #每组码从文件头之后开始计数，码长变化或清表后重新计数
+    segstart=posbits
+    nbits=9
+    maxcode=(1<<nbits)-1
+    bitmask=(1<<nbits)-1
+    base=[bytes([i]) for i in range(256)]
+    table=base+[b''] if blockmode else list(base)
+    out=[]
+    size=0
+    prev=None
+    while posbits+nbits<=inbits:
+        if limit is not None and size>=limit:
+            break
+        if len(table)>maxcode:
+            #码长变化时，编码器会把当前这组码补齐到nbits个字节
+            posbits=segstart=_align(posbits,segstart,nbits)
+            nbits+=1
+            maxcode=maxmaxcode if nbits==maxbits else (1<<nbits)-1
+            bitmask=(1<<nbits)-1
+            continue
+        p=posbits>>3
+        code=((buf[p]|buf[p+1]<<8|buf[p+2]<<16)>>(posbits&7))&bitmask
+        posbits+=nbits
+        if prev is None:
+            prev=table[code]
+            out.append(prev)
+            size+=len(prev)
+            continue
+        if code==256 and blockmode:
+            posbits=segstart=_align(posbits,segstart,nbits)
+            table=list(base)
+            nbits=9
+            maxcode=(1<<nbits)-1
+            bitmask=(1<<nbits)-1
+            continue
+        if code<len(table):
+            entry=table[code]
+        elif code==len(table):
+            entry=prev+prev[:1]
+        else:
+            raise ValueError("Corrupt .Z data")
+        out.append(entry)
+        size+=len(entry)
+        if len(table)<maxmaxcode:
+            table.append(prev+entry[:1])
+        prev=entry
+    return b''.join(out)
+
+def _stamp(path):
+    st=os.stat(path)
+    return (st.st_mtime_ns,st.st_size)
+
+def readpotcar(path):
+    #读取单个元素的POTCAR(可以是.Z或.gz)，解压结果按内容摘要缓存；相对路径在这里才转成绝对路径
+    path=os.path.abspath(path)
+    key=(path,)+_stamp(path)
+    digest=_DIGESTS.get(key)
+    if digest is not None and digest in _BLOBS:
+        return _BLOBS[digest]
+    with open(path,'rb') as fp:
+        raw=fp.read()
+    if path.endswith(".Z"):
+        data=unlzw(raw)
+    elif path.endswith(".gz"):
+        data=gzip.decompress(raw)
+    else:
+        data=raw
+    digest=hashlib.sha256(data).hexdigest()
+    with _LOCK:
+        #内容相同的文件共用同一份bytes
+        data=_BLOBS.setdefault(digest,data)
+        _DIGESTS[key]=digest
+    return data
+
+def assemblepotcar(paths):
+    #按顺序拼接多个元素的POTCAR，同一组文件没有变化时直接返回缓存
+    paths=tuple(os.path.abspath(path) for path in paths)
+    stamps=tuple(_stamp(path) for path in paths)
+    cached=_ASSEMBLED.get(paths)
+    if cached and cached[0]==stamps:
+        return cached[1]
+    data=b''.join(readpotcar(path) for path in paths)
+    with _LOCK:
+        _ASSEMBLED[paths]=(stamps,data)
+    return data
+
+def _storeblob(blob,data):
+    tmp="%s.%d.tmp"%(blob,os.getpid())
+    with open(tmp,'wb') as fp:
+        fp.write(data)
+    #只读，避免通过某个计算目录里的链接改写所有共享的POTCAR
+    os.chmod(tmp,0o444)
+    os.replace(tmp,blob)
+
+def writepotcar(filename,data):
+    #settings.potcarhardlink为True时，内容相同的POTCAR只在settings.potcarcache中存一份，计算目录里放硬链接
+    if settings.potcarhardlink and settings.potcarcache:
+        os.makedirs(settings.potcarcache,exist_ok=True)
+        blob=os.path.join(settings.potcarcache,hashlib.sha256(data).hexdigest())
+        with _LOCK:
+            if not os.path.exists(blob):
+                _storeblob(blob,data)
+        if os.path.lexists(filename):
+            os.remove(filename)
+        try:
+            os.link(blob,filename)
+            return filename
+        except OSError:
+            #跨文件系统等情况下无法建立硬链接，退回到直接写文件
+            pass
+    with open(filename,'wb') as fp:
+        fp.write(data)
+    return filename
@@ -0,0 +1,153 @@
+import os
+import re
+import sys
+import json
+import gzip
+from . import potcar
+
+#赝势库索引：扫描一次赝势库，把每个赝势的TITEL/ENMAX/ENMIN/ZVAL/POMASS/VRHFIN和文件位置
+#记录在库根目录下的potindex.json里，之后查找赝势和读取这些参数都不需要再打开POTCAR
+INDEXNAME="potindex.json"
+INDEXVERSION=1
+#读取文件头时最多解压的字节数，PSCTR参数都在最前面
+HEADERBYTES=16384
+
+_INDEXES={}   #索引文件 -> ((mtime_ns, 大小), 索引内容, {绝对路径: 条目})
+_ROOTS={}     #PSEUDO_DIR -> 索引文件(没有时为"")
+_HEADERS={}   #POTCAR路径 -> 从文件头解析出的参数
+
+_FIELDS={
+    "titel":(re.compile(r'TITEL\s*=\s*(.*)'),str),
+    "vrhfin":(re.compile(r'VRHFIN\s*=\s*(.*)'),str),
+    "pomass":(re.compile(r'POMASS\s*=\s*([-+.\dEe]+)'),float),
+    "zval":(re.compile(r'ZVAL\s*=\s*([-+.\dEe]+)'),float),
+    "enmax":(re.compile(r'ENMAX\s*=\s*([-+.\dEe]+)'),float),
+    "enmin":(re.compile(r'ENMIN\s*=\s*([-+.\dEe]+)'),float),
+}
+
+def parseheader(text):
+    #从POTCAR开头的PSCTR参数中取出索引需要的字段
+    info={}
+    for Name,(Pattern,Type) in _FIELDS.items():
+        Match=Pattern.search(text)
+        if Match:
+            info[Name]=Type(Match.group(1).strip().rstrip(';').strip())
+    return info
+
+def readheader(path):
+    if path.endswith(".Z"):
+        with open(path,'rb') as fp:
+            data=potcar.unlzw(fp.read(),limit=HEADERBYTES)
+    elif path.endswith(".gz"):
+        with gzip.open(path,'rb') as fp:
+            data=fp.read(HEADERBYTES)
+    else:
+        with open(path,'rb') as fp:
+            data=fp.read(HEADERBYTES)
+    return parseheader(data.decode('latin-1'))
+
+def buildindex(root,output=None):
+    """
+    扫描赝势库root，写出索引文件(默认root/potindex.json)
+
+    Returns:
+        dict: 索引内容，datasets的键是相对root的赝势目录，例如"potpaw_PBE/PAW_GGA_PBE/Fe_pv"
+    """
+    datasets={}
+    for dirpath,dirnames,filenames in os.walk(root):
+        dirnames.sort()
+        files={}
+        for Name in ("POTCAR","POTCAR.Z","POTCAR.gz"):
+            if Name in filenames:
+                files[Name]=True
+        if not files:
+            continue
+        plain="POTCAR" if "POTCAR" in files else None
+        packed=next((Name for Name in ("POTCAR.Z","POTCAR.gz") if Name in files),None)
+        entry=readheader(os.path.join(dirpath,plain or packed))
+        entry["potcar"]=plain
+        entry["compressed"]=packed
+        datasets[os.path.relpath(dirpath,root).replace(os.sep,'/')]=entry
+    index={"version":INDEXVERSION,"datasets":datasets}
+    output=output or os.path.join(root,INDEXNAME)
+    with open(output,'w') as fp:
+        json.dump(index,fp,separators=(',',':'),sort_keys=True)
+    _INDEXES.pop(os.path.abspath(output),None)
+    _ROOTS.clear()
+    return index
+
+def loadindex(indexfile):
+    #读取索引文件，文件不变时直接使用内存中的结果
+    indexfile=os.path.abspath(indexfile)
+    st=os.stat(indexfile)
+    stamp=(st.st_mtime_ns,st.st_size)
+    cached=_INDEXES.get(indexfile)
+    if cached and cached[0]==stamp:
+        return cached[1],cached[2]
+    with open(indexfile,'r') as fp:
+        index=json.load(fp)
+    root=os.path.dirname(indexfile)
+    bypath={}
+    for Key,Entry in index.get("datasets",{}).items():
+        for Name in (Entry.get("potcar"),Entry.get("compressed")):
+            if Name:
+                bypath[os.path.join(root,*Key.split('/'),Name)]=Entry
+    _INDEXES[indexfile]=(stamp,index,bypath)
+    return index,bypath
+
+def findindex(PSEUDO_DIR):
+    #从PSEUDO_DIR向上查找索引文件
+    if PSEUDO_DIR in _ROOTS:
+        return _ROOTS[PSEUDO_DIR]
+    Dir=os.path.abspath(PSEUDO_DIR)
+    found=""
+    while True:
+        if os.path.isfile(os.path.join(Dir,INDEXNAME)):
+            found=os.path.join(Dir,INDEXNAME)
+            break
+        Parent=os.path.dirname(Dir)
+        if Parent==Dir:
+            break
+        Dir=Parent
+    _ROOTS[PSEUDO_DIR]=found
+    return found
+
+def lookup(PSEUDO_DIR,PTFile):
+    """
+    在索引中查找PSEUDO_DIR/PTFile对应的赝势
+
+    Returns:
+        tuple: (POTCAR文件的路径(优先未压缩的)，与PSEUDO_DIR的写法一致(相对路径仍为相对路径), 条目)，
+               没有索引或索引中没有该赝势时返回(None, None)
+    """
+    indexfile=findindex(PSEUDO_DIR)
+    if not indexfile:
+        return None,None
+    try:
+        index,bypath=loadindex(indexfile)
+    except (OSError,ValueError):
+        return None,None
+    root=os.path.dirname(indexfile)
+    Dir=os.path.join(os.path.abspath(PSEUDO_DIR),PTFile)
+    Key=os.path.relpath(Dir,root).replace(os.sep,'/')
+    Entry=index["datasets"].get(Key)
+    if Entry is None:
+        return None,None
+    #写进INCAR文件头的路径不能依赖仓库所在的位置，打开文件时才转成绝对路径
+    return os.path.join(PSEUDO_DIR,PTFile,Entry["potcar"] or Entry["compressed"]),Entry
+
+def info(PTPath):
+    #某个POTCAR文件的参数：优先用索引，没有索引时从(已缓存的)POTCAR内容中解析
+    for _,(stamp,index,bypath) in list(_INDEXES.items()):
+        Entry=bypath.get(os.path.abspath(PTPath))
+        if Entry is not None:
+            return Entry
+    if PTPath not in _HEADERS:
+        _HEADERS[PTPath]=parseheader(potcar.readpotcar(PTPath)[:HEADERBYTES].decode('latin-1'))
+    return _HEADERS[PTPath]
+
+if __name__=="__main__":
+    #python -m VASPTemplates.library.potindex VASPTemplates/potpaw54
+    for root in sys.argv[1:]:
+        index=buildindex(root)
+        print("%s: %d datasets indexed"%(os.path.join(root,INDEXNAME),len(index["datasets"])))
@@ -1,3 +1,6 @@
 vtlist=[
     
-]
\ No newline at end of file
+]
+#为True时，内容相同的POTCAR只在potcarcache目录中保存一份，各计算目录里的POTCAR是指向它的(只读)硬链接
+potcarhardlink=False
+potcarcache=None
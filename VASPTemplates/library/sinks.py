@@ -0,0 +1,89 @@
+import io
+import os
+import time
+import tarfile
+import hashlib
+import threading
+from . import generator
+
+#生成结果的输出目标，统一的接口是 write(计算目录, {文件名: 内容}) -> {文件名: 状态} 和 close()
+#  DirectorySink  写到真实的目录(可增量)
+#  MemorySink     保存在内存中的{路径: bytes}，便于测试
+#  TarSink        依次写入一个 .tar / .tar.gz 流，整批计算目录直接打成一个上传用的包
+
+def _tobytes(Content):
+    return Content.encode() if isinstance(Content,str) else bytes(Content)
+
+def _arcname(calcdir,Name):
+    return os.path.normpath(os.path.join(calcdir,Name)).replace(os.sep,'/').lstrip('/')
+
+class DirectorySink:
+    def __init__(self,incremental=False):
+        self.incremental=incremental
+
+    def write(self,calcdir,FILES):
+        return generator.writefiles(calcdir,FILES,self.incremental)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+class MemorySink(DirectorySink):
+    def __init__(self):
+        self.files={}
+        self._lock=threading.Lock()
+
+    def write(self,calcdir,FILES):
+        with self._lock:
+            for Name,Content in FILES.items():
+                self.files[_arcname(calcdir,Name)]=_tobytes(Content)
+        return {Name:"written" for Name in FILES}
+
+class TarSink(DirectorySink):
+    """
+    把计算目录写进一个tar流
+
+    Args:
+        target: 文件路径或可写的文件对象
+        compression (str): None 或 "gz"；target是以.gz/.tgz结尾的路径时默认为"gz"
+    """
+    def __init__(self,target,compression=None):
+        if compression is None and isinstance(target,str) and target.endswith((".gz",".tgz")):
+            compression="gz"
+        mode="w|"+(compression or "")
+        if isinstance(target,str):
+            self.tar=tarfile.open(target,mode)
+        else:
+            self.tar=tarfile.open(fileobj=target,mode=mode)
+        self.mtime=time.time()
+        #内容相同的文件(通常是POTCAR)只存一份，其余的作为包内硬链接
+        self._stored={}
+        self._lock=threading.Lock()
+
+    def write(self,calcdir,FILES):
+        with self._lock:
+            for Name,Content in FILES.items():
+                data=_tobytes(Content)
+                info=tarfile.TarInfo(_arcname(calcdir,Name))
+                info.mtime=self.mtime
+                info.mode=0o644
+                digest=hashlib.sha256(data).digest() if len(data)>65536 else None
+                if digest in self._stored:
+                    info.type=tarfile.LNKTYPE
+                    info.linkname=self._stored[digest]
+                    self.tar.addfile(info)
+                    continue
+                info.size=len(data)
+                self.tar.addfile(info,io.BytesIO(data))
+                if digest is not None:
+                    self._stored[digest]=info.name
+        return {Name:"written" for Name in FILES}
+
+    def close(self):
+        with self._lock:
+            self.tar.close()
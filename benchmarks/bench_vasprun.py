@@ -0,0 +1,265 @@
+"""
+vasprun.xml 解析性能测试
+
+用 synthetic_vasprun.py 生成给定规模的 vasprun.xml, 每个用例在独立的子进程中运行,
+记录耗时 (多次运行取中位数)、子进程的峰值内存 (ru_maxrss) 和吞吐量 (MB/s)。
+结果写成 JSON, 可以用 --compare 与之前保存的结果对比, 找出变慢的用例。
+
+用法:
+    python benchmarks/bench_vasprun.py --size medium
+    python benchmarks/bench_vasprun.py --size medium --compare benchmarks/results/vasprun-medium-<rev>.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_vasprun import write_vasprun  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+SIZES = {
+    "small": dict(natoms=16, nkpoints=8, nsteps=10, nedos=301),
+    "medium": dict(natoms=64, nkpoints=20, nsteps=50, nedos=2000),
+    "large": dict(natoms=200, nkpoints=40, nsteps=200, nedos=3000),
+}
+
+# analyze_vasprun_all 用例中 server/bench/tmp 下的计算目录数
+N_CALCDIRS = 4
+
+
+def _parser(path, **kwargs):
+    from utils import VasprunParser
+    return VasprunParser(path, **kwargs)
+
+
+def _clear_cache(ctx):
+    for name in glob.glob(os.path.join(ctx["workdir"], "**", "*.cache.h5"), recursive=True):
+        os.remove(name)
+
+
+def _analyze(ctx, **kwargs):
+    import vasp_function
+    cwd = os.getcwd()
+    os.chdir(ctx["workdir"])
+    try:
+        vasp_function.analyze_vasprun_all(**kwargs)
+    finally:
+        os.chdir(cwd)
+
+
+def _store_cache(ctx):
+    parser = _parser(ctx["xml"], cache=True)
+    parser.structure()
+    parser.calculation_arrays()
+    parser.save_cache()
+
+
+# 用例名 -> (准备函数, 计时函数, 处理的数据量是单个文件还是全部计算目录)
+CASES = {
+    "parse_tree": (None, lambda ctx: _parser(ctx["xml"]).get_root(), "file"),
+    "header_stream": (None, lambda ctx: (_parser(ctx["xml"], stream=True).incar(),
+                                         _parser(ctx["xml"], stream=True).species()), "file"),
+    "structure": (None, lambda ctx: _parser(ctx["xml"], stream=True).structure(), "file"),
+    "structure_arrays": (None, lambda ctx: _parser(ctx["xml"], stream=True).structure_arrays(), "file"),
+    "parameters": (None, lambda ctx: _parser(ctx["xml"], stream=True).parameters(), "file"),
+    "generator": (None, lambda ctx: _parser(ctx["xml"], stream=True).generator(), "file"),
+    "atoms_info": (None, lambda ctx: _parser(ctx["xml"], stream=True).atoms_info(), "file"),
+    "monkhorst_pack": (None, lambda ctx: _parser(ctx["xml"], stream=True).monkhorst_pack(), "file"),
+    "kpoints_list": (None, lambda ctx: _parser(ctx["xml"], stream=True).kpoints_list(), "file"),
+    "kpoints_weight": (None, lambda ctx: _parser(ctx["xml"], stream=True).kpoints_weight(), "file"),
+    "kpoints_array": (None, lambda ctx: _parser(ctx["xml"], stream=True).kpoints_array(), "file"),
+    "iter_calculation": (None, lambda ctx: sum(1 for _ in _parser(ctx["xml"], stream=True).iter_calculation()),
+                         "file"),
+    "iter_step_arrays": (None, lambda ctx: sum(1 for _ in _parser(ctx["xml"], stream=True).iter_step_arrays()),
+                         "file"),
+    "calculation": (None, lambda ctx: _parser(ctx["xml"], stream=True).calculation(), "file"),
+    "calculation_arrays": (None, lambda ctx: _parser(ctx["xml"], stream=True).calculation_arrays(), "file"),
+    "project_last": (None, lambda ctx: _parser(ctx["xml"], stream=True).project(("energy", "max_force"), steps=-1),
+                     "file"),
+    "eigenvalues": (None, lambda ctx: _parser(ctx["xml"], stream=True).eigenvalues(), "file"),
+    "dos": (None, lambda ctx: _parser(ctx["xml"], stream=True).dos(), "file"),
+    "projected_dos": (None, lambda ctx: _parser(ctx["xml"], stream=True).projected_dos(), "file"),
+    "projections": (None, lambda ctx: _parser(ctx["xml"], stream=True).projections(), "file"),
+    "band_gap": (None, lambda ctx: _parser(ctx["xml"], stream=True).band_gap(), "file"),
+    "cache_store": (_clear_cache, _store_cache, "file"),
+    "cache_load": (_store_cache, lambda ctx: _parser(ctx["xml"], cache=True).calculation_arrays(), "file"),
+    "analyze_vasprun_all_serial": (_clear_cache, lambda ctx: _analyze(ctx, use_cache=False, workers=1), "all"),
+    "analyze_vasprun_all_parallel": (_clear_cache, lambda ctx: _analyze(ctx, use_cache=False, workers=os.cpu_count()),
+                                     "all"),
+    "analyze_vasprun_all_cached": (lambda ctx: _analyze(ctx, use_cache=True, workers=1),
+                                   lambda ctx: _analyze(ctx, use_cache=True, workers=1), "all"),
+}
+
+
+def _maxrss_mb():
+    # 并行用例的解析在孙进程中进行, 取本进程与其子进程中较大的峰值
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 以 KiB 为单位, macOS 以字节为单位
+    return usage / (1 << 20) if sys.platform == "darwin" else usage / 1024
+
+
+def _run_case(name, ctx):
+    setup, run, _ = CASES[name]
+    if setup is not None:
+        setup(ctx)
+    # 导入放在计时之外, 只测量解析本身
+    import utils  # noqa: F401
+    if name.startswith("analyze"):
+        import vasp_function  # noqa: F401
+    baseline = _maxrss_mb()
+    start = time.perf_counter()
+    run(ctx)
+    wall = time.perf_counter() - start
+    peak = _maxrss_mb()
+    return {"wall_s": wall, "peak_rss_mb": peak, "rss_delta_mb": peak - baseline}
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _prepare(workdir, size):
+    calc_root = os.path.join(workdir, "server", "bench", "tmp")
+    first = os.path.join(calc_root, "calc0")
+    os.makedirs(first)
+    xml = os.path.join(first, "vasprun.xml")
+    start = time.perf_counter()
+    nbytes = write_vasprun(xml, **SIZES[size])
+    print(f"generated {nbytes / 1e6:.1f} MB vasprun.xml in {time.perf_counter() - start:.1f} s")
+    for i in range(1, N_CALCDIRS):
+        other = os.path.join(calc_root, f"calc{i}")
+        os.makedirs(other)
+        shutil.copyfile(xml, os.path.join(other, "vasprun.xml"))
+    return {"workdir": workdir, "xml": xml, "nbytes": nbytes}
+
+
+def run_benchmarks(size="small", repeat=3, cases=None, workdir=None):
+    """
+    运行所有 (或指定的) 用例
+
+    Returns:
+        dict: {"meta": ..., "cases": {用例名: {"wall_s", "runs", "peak_rss_mb", "rss_delta_mb", "mb_per_s"}}}
+    """
+    cases = cases or list(CASES)
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        raise ValueError(f"Unknown benchmark cases: {', '.join(unknown)}")
+
+    own_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="bench_vasprun_")
+    try:
+        ctx = _prepare(workdir, size)
+        results = {}
+        spawn = get_context("spawn")
+        for name in cases:
+            runs = []
+            for _ in range(repeat):
+                # 每次都用新的子进程, 峰值内存不受前一个用例影响
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    runs.append(pool.submit(_run_case, name, ctx).result())
+            wall = statistics.median(run["wall_s"] for run in runs)
+            nbytes = ctx["nbytes"] * (N_CALCDIRS if CASES[name][2] == "all" else 1)
+            results[name] = {
+                "wall_s": wall,
+                "runs": [run["wall_s"] for run in runs],
+                "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+                "rss_delta_mb": max(run["rss_delta_mb"] for run in runs),
+                "mb_per_s": nbytes / 1e6 / wall if wall > 0 else None,
+            }
+            print(f"{name:32s} {wall:9.3f} s {results[name]['peak_rss_mb']:9.1f} MB "
+                  f"{results[name]['mb_per_s'] or 0:9.1f} MB/s")
+    finally:
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "revision": _git_revision(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "size": size,
+            "params": SIZES[size],
+            "file_mb": ctx["nbytes"] / 1e6,
+            "n_calcdirs": N_CALCDIRS,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "cases": results,
+    }
+
+
+def compare(current, previous, threshold=1.2):
+    """
+    对比两次结果, 耗时或解析期间的内存增量 (rss_delta_mb, 不含导入 numpy/pymatgen 等的占用)
+    超过之前 threshold 倍的用例记为回归; 内存增量不足 1 MB 时按 1 MB 计, 避免噪声
+
+    Returns:
+        list: 回归的用例名
+    """
+    regressions = []
+    print(f"\n{'case':32s} {'old s':>9s} {'new s':>9s} {'ratio':>7s} {'old dMB':>9s} {'new dMB':>9s}")
+    for name, new in current["cases"].items():
+        old = previous["cases"].get(name)
+        if old is None:
+            continue
+        ratio = new["wall_s"] / old["wall_s"] if old["wall_s"] else float("inf")
+        mem_ratio = max(new["rss_delta_mb"], 1.0) / max(old["rss_delta_mb"], 1.0)
+        flag = ""
+        if ratio > threshold or mem_ratio > threshold:
+            flag = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:32s} {old['wall_s']:9.3f} {new['wall_s']:9.3f} {ratio:7.2f} "
+              f"{old['rss_delta_mb']:9.1f} {new['rss_delta_mb']:9.1f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vasprun.xml parsing")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cases", nargs="+", help=f"subset of: {', '.join(CASES)}")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/vasprun-<size>-<rev>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="slowdown / memory ratio reported as a regression")
+    args = parser.parse_args()
+
+    result = run_benchmarks(args.size, args.repeat, args.cases)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"vasprun-{args.size}-{result['meta']['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as fp:
+        json.dump(result, fp, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as fp:
+            previous = json.load(fp)
+        if compare(result, previous, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
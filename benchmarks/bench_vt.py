@@ -0,0 +1,99 @@
+"""
+VASPTemplates 参数替换性能测试
+
+生成不同行数的模板 (INCAR 参数行中带有多个 %{NAME} 引用、重复定义的参数、注释和 %{n} 位置参数),
+分别测量 %INCLUDE 展开和 pharseVTLines 的耗时, 并在双对数坐标下拟合耗时随行数增长的斜率,
+斜率接近 1 表示线性增长。
+
+用法:
+    python benchmarks/bench_vt.py
+    python benchmarks/bench_vt.py --lines 1000 10000 100000 --output vt.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from VASPTemplates.library import api, pharser  # noqa: E402
+
+
+def make_template(nlines, nparams=64):
+    """
+    生成约 nlines 行的模板文本, 其中引用 nparams 个不同的参数
+    """
+    lines = [f"%P{i}={i * 10}" for i in range(nparams)]
+    lines += ["%START KPOINTS", "Automatic mesh", "0", "Gamma", "%{1} %{2} %{3}", "0 0 0", "%END KPOINTS"]
+    body = max(nlines - len(lines), 0)
+    for i in range(body):
+        kind = i % 8
+        if kind == 0:
+            lines.append(f"#---- block {i} ----#")
+        elif kind == 1:
+            lines.append("## template comment")
+        elif kind == 2:
+            # 同名参数重复出现, 后面的覆盖前面的
+            lines.append(f"TAG{i % 97} = %{{P{i % nparams}}} # overridden")
+        elif kind == 3:
+            lines.append(f"%P{i % nparams}={i}")
+        else:
+            a, b, c = i % nparams, (i * 7) % nparams, (i * 13) % nparams
+            lines.append(f"TAG{i} = %{{P{a}}} %{{P{b}}} %{{P{c}}} %{{UNDEFINED}} # line {i}")
+    return "\n".join(lines) + "\n"
+
+
+def _best(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(sizes, repeat=3):
+    rows = []
+    for nlines in sizes:
+        text = make_template(nlines)
+        args = ("4", "4", "2")
+        # 每次都清掉编译缓存, 测量的是完整的切分与展开
+        expand = _best(lambda: (api.compilevt.cache_clear(), api.expandvt(text, *args)), repeat)
+        vtlines = api.expandvt(text, *args)
+        parse = _best(lambda: pharser.pharseVTLines(vtlines), repeat)
+        rows.append({"lines": nlines, "expand_s": expand, "parse_s": parse,
+                     "parse_us_per_line": parse / nlines * 1e6})
+        print(f"{nlines:9d} lines  expand {expand * 1e3:9.2f} ms  parse {parse * 1e3:9.2f} ms"
+              f"  {parse / nlines * 1e6:6.2f} us/line")
+
+    lines = np.log([row["lines"] for row in rows])
+    slope = float(np.polyfit(lines, np.log([row["parse_s"] for row in rows]), 1)[0]) if len(rows) > 1 else None
+    if slope is not None:
+        print(f"pharseVTLines scaling exponent: {slope:.2f}")
+    return {"sizes": rows, "parse_scaling_exponent": slope}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VASPTemplates parameter substitution")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 4000, 16000, 64000, 256000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--max-exponent", type=float, default=1.2,
+                        help="exit non-zero when the fitted scaling exponent is larger")
+    args = parser.parse_args()
+
+    result = run_benchmarks(sorted(args.lines), args.repeat)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(result, fp, indent=2)
+    exponent = result["parse_scaling_exponent"]
+    if exponent is not None and exponent > args.max_exponent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
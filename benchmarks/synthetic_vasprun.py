@@ -0,0 +1,255 @@
+"""
+生成结构上与 VASP 输出一致的合成 vasprun.xml, 用于在没有 VASP 的机器上测试和评估解析速度
+
+包含 generator / incar / kpoints / parameters / atominfo / 初始结构 / 若干 <calculation>
+(电子步、结构、受力、应力、能量) / 最终结构, 最后一个离子步附带 eigenvalues、dos,
+lorbit=True 时还有 partial dos 与 projected 块。
+
+用法:
+    python benchmarks/synthetic_vasprun.py out.xml --atoms 200 --kpoints 20 --steps 50 --nedos 2000
+"""
+import argparse
+import os
+
+import numpy as np
+
+ELEMENTS = ("Sr", "Ca", "Fe", "O")
+ORBITALS = ("s", "py", "pz", "px", "dxy", "dyz", "dz2", "dxz", "dx2")
+
+
+def _rows(values, fmt):
+    return "".join(fmt % tuple(row) for row in values)
+
+
+def _varray(name, values, indent, fmt=" %16.8f %16.8f %16.8f "):
+    pad = " " * indent
+    rows = _rows(values, pad + " <v>" + fmt + "</v>\n")
+    return f'{pad}<varray name="{name}" >\n{rows}{pad}</varray>\n'
+
+
+def _structure(w, name, lattice, positions, indent=1):
+    pad = " " * indent
+    attr = f' name="{name}" ' if name else ""
+    w(f"{pad}<structure{attr}>\n{pad} <crystal>\n")
+    w(_varray("basis", lattice, indent + 2))
+    w(f'{pad}  <i name="volume">  {abs(np.linalg.det(lattice)):16.8f} </i>\n')
+    w(_varray("rec_basis", np.linalg.inv(lattice).T, indent + 2))
+    w(f"{pad} </crystal>\n")
+    w(_varray("positions", positions, indent + 1))
+    w(f"{pad}</structure>\n")
+
+
+def _array_header(w, pad, dimensions, fields):
+    w(f"{pad}<array>\n")
+    for n, dim in enumerate(dimensions, start=1):
+        w(f'{pad} <dimension dim="{n}">{dim}</dimension>\n')
+    for field in fields:
+        w(f"{pad} <field>{field}</field>\n")
+
+
+def write_vasprun(path, natoms=16, nkpoints=8, nsteps=5, nbands=None, nedos=301,
+                  nspin=1, lorbit=True, nscsteps=8, seed=0):
+    """
+    写出一个合成的 vasprun.xml
+
+    Args:
+        path (str): 输出文件
+        natoms (int): 原子数
+        nkpoints (int): 不可约 k 点数
+        nsteps (int): 离子步数
+        nbands (int): 能带数, 默认取 natoms * 4
+        nedos (int): DOS 能量格点数
+        nspin (int): 1 或 2
+        lorbit (bool): 是否写出 partial dos 与 projected 块
+        nscsteps (int): 每个离子步的电子步数
+
+    Returns:
+        int: 文件大小 (字节)
+    """
+    rng = np.random.default_rng(seed)
+    nbands = nbands or natoms * 4
+    species = [ELEMENTS[i % len(ELEMENTS)] for i in range(natoms)]
+    types = sorted(set(species), key=ELEMENTS.index)
+    a = 3.9 * max(1.0, round(natoms ** (1 / 3)))
+    lattice = np.diag([a, a, a])
+    positions = rng.random((natoms, 3))
+    kpoints = rng.random((nkpoints, 3)) - 0.5
+
+    with open(path, "w", encoding="ISO-8859-1") as fp:
+        w = fp.write
+        w('<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n')
+        w(' <generator>\n'
+          '  <i name="program" type="string">vasp </i>\n'
+          '  <i name="version" type="string">5.4.4.18Apr17-6-g9f103f2a35  </i>\n'
+          '  <i name="subversion" type="string">(build Jan 01 2024 00:00:00) complex            parallel </i>\n'
+          '  <i name="platform" type="string">LinuxIFC </i>\n'
+          ' </generator>\n')
+        w(' <incar>\n'
+          '  <i type="string" name="PREC">accurate</i>\n'
+          '  <i name="ENCUT">    520.00000000</i>\n'
+          f'  <i type="int" name="ISPIN">     {nspin}</i>\n'
+          f'  <i type="int" name="NSW">     {max(nsteps, 1) * 2}</i>\n'
+          '  <i type="int" name="IBRION">     2</i>\n'
+          '  <i name="EDIFFG">     -0.02000000</i>\n'
+          f'  <i type="int" name="LORBIT">     {11 if lorbit else 0}</i>\n'
+          ' </incar>\n')
+
+        w(' <kpoints>\n  <generation param="Gamma">\n'
+          '   <v type="int" name="divisions">       2        2        2 </v>\n'
+          '   <v name="usershift">      0.00000000       0.00000000       0.00000000 </v>\n'
+          '   <v name="genvec1">      0.50000000       0.00000000       0.00000000 </v>\n'
+          '   <v name="genvec2">      0.00000000       0.50000000       0.00000000 </v>\n'
+          '   <v name="genvec3">      0.00000000       0.00000000       0.50000000 </v>\n'
+          '   <v name="shift">      0.00000000       0.00000000       0.00000000 </v>\n'
+          '  </generation>\n')
+        w(_varray("kpointlist", kpoints, 2))
+        w(_varray("weights", np.full((nkpoints, 1), 1.0 / nkpoints), 2, fmt=" %16.8f "))
+        w(' </kpoints>\n')
+
+        w(' <parameters>\n  <separator name="general" >\n'
+          '   <i type="string" name="SYSTEM">synthetic</i>\n'
+          '  </separator>\n  <separator name="electronic" >\n'
+          '   <i type="string" name="PREC">accura</i>\n'
+          '   <i name="ENMAX">    520.00000000</i>\n'
+          f'   <i type="int" name="NBANDS">    {nbands}</i>\n'
+          f'   <i type="int" name="NEDOS">    {nedos}</i>\n'
+          '   <i type="int" name="NELM">     60</i>\n'
+          '   <v name="ROPT">     -0.00050000     -0.00050000 </v>\n'
+          '  </separator>\n </parameters>\n')
+
+        w(f' <atominfo>\n  <atoms>      {natoms} </atoms>\n  <types>       {len(types)} </types>\n'
+          '  <array name="atoms" >\n   <dimension dim="1">ion</dimension>\n'
+          '   <field type="string">element</field>\n   <field type="int">atomtype</field>\n   <set>\n')
+        w("".join(f"    <rc><c>{el:2s}</c><c>   {types.index(el) + 1}</c></rc>\n" for el in species))
+        w('   </set>\n  </array>\n  <array name="atomtypes" >\n   <dimension dim="1">type</dimension>\n'
+          '   <field type="int">atomspertype</field>\n   <field type="string">element</field>\n'
+          '   <field>mass</field>\n   <field>valence</field>\n'
+          '   <field type="string">pseudopotential</field>\n   <set>\n')
+        for el in types:
+            w(f"    <rc><c>   {species.count(el)}</c><c>{el:2s}</c><c>     10.00000000</c>"
+              f"<c>      6.00000000</c><c>  PAW_PBE {el} 06Sep2000                   </c></rc>\n")
+        w('   </set>\n  </array>\n </atominfo>\n')
+
+        _structure(w, "initialpos", lattice, positions)
+
+        for step in range(nsteps):
+            energy = -7.0 * natoms - step * 0.01
+            w(' <calculation>\n')
+            for sc in range(nscsteps):
+                w('  <scstep>\n   <time name="dav">    0.10    0.10</time>\n'
+                  '   <time name="total">    0.20    0.20</time>\n   <energy>\n'
+                  '    <i name="alphaZ">    100.00000000 </i>\n'
+                  '    <i name="ewald">  -2000.00000000 </i>\n'
+                  '    <i name="hartreedc">   -800.00000000 </i>\n'
+                  f'    <i name="e_fr_energy">  {energy + 1.0 / (sc + 1):16.8f} </i>\n'
+                  f'    <i name="e_wo_entrp">  {energy + 1.0 / (sc + 1):16.8f} </i>\n'
+                  f'    <i name="e_0_energy">  {energy + 1.0 / (sc + 1):16.8f} </i>\n'
+                  '   </energy>\n  </scstep>\n')
+            positions = (positions + rng.normal(0, 0.001, positions.shape)) % 1.0
+            _structure(w, None, lattice, positions, indent=2)
+            w(_varray("forces", rng.normal(0, 0.1, (natoms, 3)), 2))
+            w(_varray("stress", rng.normal(0, 1.0, (3, 3)), 2))
+            w('  <energy>\n'
+              f'   <i name="e_fr_energy">  {energy:16.8f} </i>\n'
+              f'   <i name="e_wo_entrp">  {energy:16.8f} </i>\n'
+              f'   <i name="e_0_energy">  {energy:16.8f} </i>\n'
+              '  </energy>\n  <time name="totalsc">    1.60    1.60</time>\n')
+            if step == nsteps - 1:
+                _electronic(w, rng, natoms, nkpoints, nbands, nedos, nspin, lorbit)
+            w(' </calculation>\n')
+
+        _structure(w, "finalpos", lattice, positions)
+        w('</modeling>\n')
+    return os.path.getsize(path)
+
+
+def _electronic(w, rng, natoms, nkpoints, nbands, nedos, nspin, lorbit):
+    efermi = 0.0
+    bands = np.sort(rng.normal(0, 5, nbands))
+    w('  <eigenvalues>\n')
+    _array_header(w, "   ", ("band", "kpoint", "spin"), ("eigene", "occ"))
+    w('    <set>\n')
+    for spin in range(nspin):
+        w(f'     <set comment="spin {spin + 1}">\n')
+        for k in range(nkpoints):
+            energies = bands + rng.normal(0, 0.05, nbands)
+            occ = (energies < efermi).astype(float)
+            w(f'      <set comment="kpoint {k + 1}">\n')
+            w(_rows(np.column_stack([energies, occ]), "       <r> %10.4f %8.4f </r>\n"))
+            w('      </set>\n')
+        w('     </set>\n')
+    w('    </set>\n   </array>\n  </eigenvalues>\n')
+
+    grid = np.linspace(-20, 10, nedos)
+    w(f'  <dos>\n   <i name="efermi">      {efermi:.8f} </i>\n   <total>\n')
+    _array_header(w, "    ", ("gridpoints", "spin"), ("energy", "total", "integrated"))
+    w('     <set>\n')
+    for spin in range(nspin):
+        total = rng.random(nedos)
+        w(f'      <set comment="spin {spin + 1}">\n')
+        w(_rows(np.column_stack([grid, total, np.cumsum(total)]), "       <r> %10.4f %10.4f %10.4f </r>\n"))
+        w('      </set>\n')
+    w('     </set>\n    </array>\n   </total>\n')
+    if lorbit:
+        fmt = "        <r> %10.4f" + " %8.4f" * len(ORBITALS) + " </r>\n"
+        w('   <partial>\n')
+        _array_header(w, "    ", ("gridpoints", "spin", "ion"), ("energy",) + ORBITALS)
+        w('     <set>\n')
+        for ion in range(natoms):
+            w(f'      <set comment="ion {ion + 1}">\n')
+            for spin in range(nspin):
+                w(f'       <set comment="spin {spin + 1}">\n')
+                w(_rows(np.column_stack([grid, rng.random((nedos, len(ORBITALS)))]), fmt))
+                w('       </set>\n')
+            w('      </set>\n')
+        w('     </set>\n    </array>\n   </partial>\n')
+    w('  </dos>\n')
+
+    if lorbit:
+        fmt = "        <r>" + " %6.3f" * len(ORBITALS) + " </r>\n"
+        w('  <projected>\n   <eigenvalues>\n')
+        _array_header(w, "    ", ("band", "kpoint", "spin"), ("eigene", "occ"))
+        w('     <set>\n')
+        for spin in range(nspin):
+            w(f'      <set comment="spin {spin + 1}">\n')
+            for k in range(nkpoints):
+                w(f'       <set comment="kpoint {k + 1}">\n')
+                w(_rows(np.column_stack([bands, bands < efermi]), "        <r> %10.4f %8.4f </r>\n"))
+                w('       </set>\n')
+            w('      </set>\n')
+        w('     </set>\n    </array>\n   </eigenvalues>\n')
+        _array_header(w, "   ", ("orbital", "band", "kpoint", "spin"), ORBITALS)
+        w('    <set>\n')
+        for spin in range(nspin):
+            w(f'     <set comment="spin{spin + 1}">\n')
+            for k in range(nkpoints):
+                w(f'      <set comment="kpoint {k + 1}">\n')
+                for band in range(nbands):
+                    w(f'       <set comment="band {band + 1}">\n')
+                    w(_rows(rng.random((natoms, len(ORBITALS))) * 0.1, fmt))
+                    w('       </set>\n')
+                w('      </set>\n')
+            w('     </set>\n')
+        w('    </set>\n   </array>\n  </projected>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic vasprun.xml")
+    parser.add_argument("path")
+    parser.add_argument("--atoms", type=int, default=16)
+    parser.add_argument("--kpoints", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--bands", type=int, default=None)
+    parser.add_argument("--nedos", type=int, default=301)
+    parser.add_argument("--spin", type=int, choices=(1, 2), default=1)
+    parser.add_argument("--no-lorbit", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    size = write_vasprun(args.path, natoms=args.atoms, nkpoints=args.kpoints, nsteps=args.steps,
+                         nbands=args.bands, nedos=args.nedos, nspin=args.spin,
+                         lorbit=not args.no_lorbit, seed=args.seed)
+    print(f"{args.path}: {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import json
+import operator
+import os
+import time
+from collections import Counter
+
+from sqlalchemy import (Boolean, Column, Float, ForeignKey, Index, Integer, String, Text,
+                        create_engine)
+from sqlalchemy.orm import aliased, declarative_base, relationship, sessionmaker
+
+from utils import VasprunParser
+
+Base = declarative_base()
+
+DEFAULT_CATALOG_PATH = os.path.join("server", "run_catalog.sqlite")
+
+_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+
+
+class Run(Base):
+    __tablename__ = "runs"
+
+    id = Column(Integer, primary_key=True)
+    path = Column(String, unique=True, nullable=False)
+    campaign = Column(String, index=True)
+    formula = Column(String)
+    # "-Ca-Fe-O-Sr-" 形式, 便于用 LIKE '%-Fe-%' 查询包含某元素的计算
+    elements = Column(String, index=True)
+    chemsys = Column(String, index=True)
+    natoms = Column(Integer)
+    incar = Column(Text)
+    final_energy = Column(Float)
+    max_force = Column(Float)
+    nsteps = Column(Integer)
+    converged = Column(Boolean, index=True)
+    status = Column(String)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    scanned_at = Column(Float)
+
+    tags = relationship("IncarTag", cascade="all, delete-orphan", back_populates="run")
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "campaign": self.campaign,
+            "formula": self.formula,
+            "chemsys": self.chemsys,
+            "natoms": self.natoms,
+            "incar": json.loads(self.incar) if self.incar else {},
+            "final_energy": self.final_energy,
+            "max_force": self.max_force,
+            "nsteps": self.nsteps,
+            "converged": self.converged,
+            "status": self.status,
+        }
+
+
+class IncarTag(Base):
+    __tablename__ = "incar_tags"
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey("runs.id"), index=True, nullable=False)
+    name = Column(String, nullable=False)
+    value = Column(String)
+    number = Column(Float)
+
+    run = relationship("Run", back_populates="tags")
+
+    __table_args__ = (
+        Index("ix_incar_tags_name_number", "name", "number"),
+        Index("ix_incar_tags_name_value", "name", "value"),
+    )
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _formula(species):
+    counts = Counter(species)
+    return "".join(f"{el}{n if n > 1 else ''}" for el, n in counts.items())
+
+
+def summarize_run(xml_path):
+    """
+    读取一个 vasprun.xml, 返回写入目录所需的字段
+
+    收敛判据: 最后一个离子步的电子步数小于 NELM; 对于离子弛豫 (NSW > 0, IBRION 1/2/3),
+    EDIFFG < 0 时要求最大受力不超过 |EDIFFG|, 否则要求离子步数小于 NSW。
+    """
+    parser = VasprunParser(xml_path, stream=True)
+    incar = {name: value.strip() for name, value in parser.incar()}
+    params = {}
+    for name, value in parser.parameters():
+        if isinstance(value, str):
+            params[name] = value
+
+    def setting(name, default):
+        number = _to_number(incar.get(name, params.get(name)))
+        return default if number is None else number
+
+    species = parser.species()
+
+    last = {}
+    status = "complete"
+    try:
+        steps = parser.project(("energy", "max_force", "nscsteps"), steps=-1)
+    except Exception:
+        # 文件被截断 (计算仍在进行或异常退出), 退回到逐步读取已经完成的部分
+        status = "incomplete"
+        steps = []
+        try:
+            for index, step in enumerate(parser.iter_step_arrays()):
+                steps = [dict(step, step=index)]
+        except Exception:
+            pass
+    if steps:
+        last = steps[-1]
+    nsteps = last["step"] + 1 if last else 0
+
+    nelm = setting("NELM", 60)
+    nsw = setting("NSW", 0)
+    ibrion = setting("IBRION", -1)
+    ediffg = setting("EDIFFG", setting("EDIFF", 1e-4) * 10)
+
+    converged = status == "complete" and nsteps > 0 and last.get("nscsteps", 0) < nelm
+    if converged and nsw > 0 and ibrion in (1, 2, 3):
+        if ediffg < 0:
+            converged = last.get("max_force", float("inf")) <= abs(ediffg)
+        else:
+            converged = nsteps < nsw
+
+    elements = sorted(set(species))
+    return {
+        "formula": _formula(species),
+        "elements": "-" + "-".join(elements) + "-",
+        "chemsys": "-".join(elements),
+        "natoms": len(species),
+        "incar": incar,
+        "final_energy": last.get("energy"),
+        "max_force": last.get("max_force"),
+        "nsteps": nsteps,
+        "converged": bool(converged),
+        "status": status,
+    }
+
+
+class RunCatalog:
+    """
+    VASP 计算结果目录, 保存在 SQLite 文件中
+
+    scan() 遍历结果目录下所有的 vasprun.xml, 只重新解析大小或 mtime 发生变化的文件,
+    并删除已经不存在的记录。query() 按元素、收敛状态和 INCAR 参数查询。
+    """
+
+    def __init__(self, db_path=DEFAULT_CATALOG_PATH):
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def scan(self, base_path="server/"):
+        """
+        增量更新目录
+
+        Returns:
+            dict: added/updated/removed/unchanged/failed 各自的计算目录数
+        """
+        found = {}
+        for campaign in sorted(os.listdir(base_path)):
+            campaign_path = os.path.join(base_path, campaign)
+            if not os.path.isdir(campaign_path):
+                continue
+            for dirpath, dirnames, filenames in os.walk(campaign_path):
+                dirnames.sort()
+                if "vasprun.xml" in filenames:
+                    found[os.path.abspath(dirpath)] = campaign
+
+        report = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        with self.Session() as session:
+            known = {run.path: run for run in session.query(Run)}
+            for path, run in known.items():
+                if path not in found:
+                    session.delete(run)
+                    report["removed"] += 1
+
+            for path, campaign in found.items():
+                xml_path = os.path.join(path, "vasprun.xml")
+                stat = os.stat(xml_path)
+                run = known.get(path)
+                if run is not None and run.size == stat.st_size and run.mtime_ns == stat.st_mtime_ns:
+                    report["unchanged"] += 1
+                    continue
+                try:
+                    summary = summarize_run(xml_path)
+                except Exception:
+                    report["failed"] += 1
+                    continue
+
+                if run is None:
+                    run = Run(path=path)
+                    session.add(run)
+                    report["added"] += 1
+                else:
+                    report["updated"] += 1
+                run.campaign = campaign
+                run.size = stat.st_size
+                run.mtime_ns = stat.st_mtime_ns
+                run.scanned_at = time.time()
+                incar = summary.pop("incar")
+                for name, value in summary.items():
+                    setattr(run, name, value)
+                run.incar = json.dumps(incar)
+                run.tags = [IncarTag(name=name.upper(), value=value, number=_to_number(value))
+                            for name, value in incar.items()]
+            session.commit()
+        return report
+
+    def query(self, elements=None, exact=False, converged=None, incar=None, campaign=None):
+        """
+        查询计算记录
+
+        Args:
+            elements (list): 必须包含的元素, 例如 ["Sr", "Ca", "Fe", "O"]
+            exact (bool): 为 True 时要求化学体系与 elements 完全一致
+            converged (bool): 只返回收敛 / 未收敛的计算, None 表示不限
+            incar (dict): INCAR 条件, 值可以是具体取值或 (运算符, 数值),
+                          例如 {"ENCUT": (">=", 520), "ISPIN": 2}
+            campaign (str): server/ 下的结果文件夹名
+
+        Returns:
+            list: 每个计算一个 dict
+        """
+        with self.Session() as session:
+            q = session.query(Run)
+            if elements:
+                if exact:
+                    q = q.filter(Run.chemsys == "-".join(sorted(set(elements))))
+                else:
+                    for element in elements:
+                        q = q.filter(Run.elements.like(f"%-{element}-%"))
+            if converged is not None:
+                q = q.filter(Run.converged == bool(converged))
+            if campaign is not None:
+                q = q.filter(Run.campaign == campaign)
+            for name, condition in (incar or {}).items():
+                tag = aliased(IncarTag)
+                if isinstance(condition, (tuple, list)):
+                    op, value = condition
+                else:
+                    op, value = "==", condition
+                if op not in _OPERATORS:
+                    raise ValueError(f"Unsupported operator {op!r} for INCAR tag {name}")
+                number = _to_number(value)
+                column = tag.number if number is not None else tag.value
+                target = number if number is not None else str(value)
+                q = q.join(tag, tag.run_id == Run.id).filter(
+                    tag.name == name.upper(), _OPERATORS[op](column, target))
+            return [run.to_dict() for run in q.order_by(Run.path)]
@@ -0,0 +1,205 @@
+import itertools
+import warnings
+
+import numpy as np
+from pymatgen.core import Structure
+from scipy.spatial import cKDTree
+
+from symmetry import get_symmetry_cache
+
+
+def supercell_matrix(n, lattice=None):
+    """
+    体积为 n 倍的对角超胞, 在 a*b*c == n 的所有分解中取超胞晶格最接近各向同性的一个
+
+    Args:
+        n (int): 超胞大小
+        lattice: 原胞的 Lattice, 不给出时按立方晶胞处理
+
+    Returns:
+        tuple: (a, b, c)
+    """
+    n = int(n)
+    if n < 1:
+        raise ValueError(f"Invalid supercell size {n}")
+    abc = np.array(lattice.abc if lattice is not None else (1.0, 1.0, 1.0))
+    best = None
+    for a in range(1, n + 1):
+        if n % a:
+            continue
+        for b in range(1, n // a + 1):
+            if (n // a) % b:
+                continue
+            c = n // a // b
+            lengths = abc * (a, b, c)
+            # 超胞最长边与最短边之比越小越好, 相同时优先沿 a, b 方向扩胞
+            score = (lengths.max() / lengths.min(), -a, -b)
+            if best is None or score < best[0]:
+                best = (score, (a, b, c))
+    return best[1]
+
+
+def site_permutations(structure, sites=None, symprec=0.01, angle_tolerance=5.0, tol=1e-3):
+    """
+    把结构的每个对称操作表示成位点的置换数组
+
+    Args:
+        structure: 结构 (通常是超胞, 对称操作中包含超胞内的平移)
+        sites: 只保留这些位点上的置换, 返回的数组中的值是 sites 内的下标
+        tol (float): 分数坐标的匹配容差
+
+    Returns:
+        np.ndarray: (对称操作数, 位点数) 的置换数组, 第 k 行表示第 k 个操作把位点 i 变到位点 perm[k, i]
+    """
+    rotations, translations = get_symmetry_cache().symmetry_operations(structure, symprec, angle_tolerance)
+    frac = np.mod(structure.frac_coords, 1.0)
+    frac[frac >= 1.0] = 0.0
+    numbers = np.array([site.specie.Z for site in structure])
+    tree = cKDTree(frac, boxsize=1.0)
+    perms = []
+    for rotation, translation in zip(rotations, translations):
+        image = np.mod(frac @ rotation.T + translation, 1.0)
+        image[image >= 1.0] = 0.0
+        dist, perm = tree.query(image, distance_upper_bound=tol)
+        if np.isinf(dist).any() or (numbers[perm] != numbers).any():
+            warnings.warn("Warning: a symmetry operation does not map the structure onto itself, skipped.")
+            continue
+        perms.append(perm)
+    perms = np.unique(np.array(perms, dtype=np.int64).reshape(-1, len(structure)), axis=0)
+    if sites is not None:
+        sites = np.asarray(sites, dtype=np.int64)
+        lookup = np.full(len(structure), -1, dtype=np.int64)
+        lookup[sites] = np.arange(len(sites))
+        perms = np.unique(lookup[perms[:, sites]], axis=0)
+        if (perms < 0).any():
+            raise ValueError("The selected sites are not closed under the symmetry operations.")
+    return perms
+
+
+def _assignments(nsites, counts):
+    """把 counts 个不同元素依次放到 nsites 个位点上, 逐个给出标签数组 (值为元素在 counts 中的序号)"""
+    counts = list(counts)
+
+    def place(free, k, labels):
+        if k == len(counts) - 1:
+            labels[free] = k
+            yield labels
+            return
+        for chosen in itertools.combinations(free, counts[k]):
+            rest = [i for i in free if i not in set(chosen)]
+            labels[list(chosen)] = k
+            yield from place(rest, k + 1, labels)
+
+    yield from place(list(range(nsites)), 0, np.zeros(nsites, dtype=np.int64))
+
+
+def _is_canonical(labels, perms):
+    # labels 在所有对称操作下的像中字典序最小时才是该等价类的代表
+    images = labels[perms]
+    diff = images != labels
+    first = diff.argmax(axis=1)
+    smaller = images[np.arange(len(perms)), first] < labels[first]
+    return not (diff.any(axis=1) & smaller).any()
+
+
+class SubstitutionEnumerator:
+    """
+    枚举母体结构超胞中混合占位位点的、对称性不等价的有序构型
+
+    例如 SrFeO3 母体, occupancy={"Sr": {"Sr": 5, "Ca": 3}} 时自动取 8 倍 (2x2x2) 超胞,
+    在 8 个 A 位上放 5 个 Sr 和 3 个 Ca, 只给出超胞对称操作下互不等价的排列。
+
+    构型用标签数组表示, 每个对称操作预先转换为位点置换数组; 一个排列只有在它的所有像中
+    字典序最小时才输出, 因此不需要保存已经出现过的构型, 可以按需逐个生成。
+
+    Args:
+        structure: 母体结构
+        occupancy (dict): {母体中的元素: {元素: 超胞中的个数}}
+        supercell: 超胞大小 (int) 或扩胞矩阵, 默认由 occupancy 中的个数推算
+        symprec, angle_tolerance: 对称性分析的容差
+    """
+
+    def __init__(self, structure, occupancy, supercell=None, symprec=0.01, angle_tolerance=5.0):
+        self.parent = structure
+        self.occupancy = {host: {el: int(n) for el, n in counts.items() if n}
+                          for host, counts in occupancy.items()}
+        if supercell is None:
+            supercell = self._infer_size()
+        if isinstance(supercell, (int, np.integer)):
+            supercell = supercell_matrix(supercell, structure.lattice)
+        self.supercell = supercell
+        self.structure = structure.copy()
+        self.structure.make_supercell(supercell)
+        self.species = np.array([site.specie.symbol for site in self.structure], dtype=object)
+
+        self.sites = []
+        self.counts = []
+        self.labels = []
+        for host, counts in self.occupancy.items():
+            sites = np.flatnonzero(self.species == host)
+            if sum(counts.values()) != len(sites):
+                raise ValueError(f"{host} occupies {len(sites)} sites in the supercell, "
+                                 f"but the occupancy {counts} has {sum(counts.values())} atoms.")
+            self.sites.append(sites)
+            self.counts.append(list(counts.values()))
+            self.labels.append(list(counts.keys()))
+        self.mixed = np.concatenate(self.sites) if self.sites else np.zeros(0, dtype=np.int64)
+        self.perms = (site_permutations(self.structure, self.mixed, symprec, angle_tolerance)
+                      if len(self.mixed) else np.zeros((1, 0), dtype=np.int64))
+
+    def _infer_size(self):
+        species = [site.specie.symbol for site in self.parent]
+        sizes = set()
+        for host, counts in self.occupancy.items():
+            nhost = species.count(host)
+            if nhost == 0:
+                raise ValueError(f"{host} is not in the parent structure.")
+            total = sum(counts.values())
+            if total % nhost:
+                raise ValueError(f"{total} atoms cannot be placed on a supercell of {nhost} {host} sites.")
+            sizes.add(total // nhost)
+        if len(sizes) != 1:
+            raise ValueError(f"Inconsistent supercell sizes {sorted(sizes)} for occupancy {self.occupancy}.")
+        return sizes.pop()
+
+    def iter_labels(self):
+        """逐个给出不等价构型的标签数组 (对应 self.mixed 中的位点, 各位点的值为元素在全部元素中的序号)"""
+        offsets = np.cumsum([0] + [len(labels) for labels in self.labels])[:-1]
+        starts = np.cumsum([0] + [len(sites) for sites in self.sites])
+        labels = np.zeros(len(self.mixed), dtype=np.int64)
+
+        # 各个子晶格的排列逐层组合, 内层的生成器每次重新创建, 不会把全部排列放进内存
+        def fill(k):
+            if k == len(self.sites):
+                if _is_canonical(labels, self.perms):
+                    yield labels.copy()
+                return
+            for part in _assignments(len(self.sites[k]), self.counts[k]):
+                labels[starts[k]:starts[k + 1]] = part + offsets[k]
+                yield from fill(k + 1)
+
+        yield from fill(0)
+
+    def degeneracy(self, labels):
+        """该构型在对称操作下的等价构型个数"""
+        return len(np.unique(labels[self.perms], axis=0))
+
+    def to_structure(self, labels):
+        names = np.array([el for labels_ in self.labels for el in labels_], dtype=object)
+        species = self.species.copy()
+        species[self.mixed] = names[labels]
+        return Structure(self.structure.lattice, list(species), self.structure.frac_coords)
+
+    def __iter__(self):
+        for labels in self.iter_labels():
+            yield self.to_structure(labels)
+
+    def count(self):
+        return sum(1 for _ in self.iter_labels())
+
+
+def enumerate_substitutions(structure, occupancy, supercell=None, limit=None, **kwargs):
+    """
+    按需生成不等价的替换构型, 参数同 SubstitutionEnumerator; limit 给出时最多生成 limit 个
+    """
+    return itertools.islice(SubstitutionEnumerator(structure, occupancy, supercell, **kwargs), limit)
@@ -0,0 +1,305 @@
+import itertools
+import warnings
+
+import numpy as np
+from pymatgen.core import Element
+from scipy.spatial import Delaunay, cKDTree
+
+# 判断为真空层 (表面结构) 的最小间隙, 单位 Å
+VACUUM_GAP = 5.0
+# 距离最外层原子不超过该值的原子视为表面原子, 单位 Å
+SURFACE_DEPTH = 1.0
+# 合并距离小于该值的候选位点, 单位 Å
+MERGE_RADIUS = 0.5
+# 默认最小原子间距为两者原子半径之和乘以该系数
+MIN_DISTANCE_FACTOR = 0.75
+# 新放置的原子之间的最小距离, 单位 Å
+MIN_SPACING = 1.5
+# 寻找间隙位点时在晶胞边界外补充的原子范围, 单位 Å
+INTERSTITIAL_SKIN = 4.0
+
+SURFACE_KINDS = ("hollow", "bridge", "top")
+BULK_KINDS = ("interstitial",)
+
+
+def atomic_radius(symbol):
+    radius = Element(symbol).atomic_radius
+    return float(radius) if radius is not None else 1.0
+
+
+def _pad(frac, lattice, skin, periodic=(True, True, True)):
+    """
+    把跨过晶胞边界 skin (Å) 以内的周期像补充进来, periodic 为 False 的方向不补充
+
+    Returns:
+        tuple: (补充后的分数坐标, 对应的原始下标)
+    """
+    matrix = lattice.matrix
+    volume = abs(np.linalg.det(matrix))
+    # 晶胞在三个方向上的面间距
+    heights = volume / np.linalg.norm(np.cross(matrix[[1, 2, 0]], matrix[[2, 0, 1]]), axis=1)
+    margin = np.minimum(skin / heights, 1.0)
+    coords = [frac]
+    index = [np.arange(len(frac))]
+    for shift in itertools.product(*[(-1, 0, 1) if p else (0,) for p in periodic]):
+        if shift == (0, 0, 0):
+            continue
+        image = frac + shift
+        keep = np.all((image >= -margin) & (image < 1 + margin), axis=1)
+        coords.append(image[keep])
+        index.append(np.flatnonzero(keep))
+    return np.concatenate(coords), np.concatenate(index)
+
+
+def _wrap(frac):
+    frac = np.mod(frac, 1.0)
+    frac[frac >= 1.0] = 0.0
+    return frac
+
+
+class SiteFinder:
+    """
+    在结构中寻找吸附 / 掺杂原子的候选位置
+
+    原子的周期像 (只补充晶胞边界附近的) 放进一棵 cKDTree 做近邻查询。有真空层的表面结构在
+    最外层原子的 Delaunay 三角剖分上给出 hollow (三角形中心)、bridge (边中点) 和 top (原子上方)
+    位点, 高度按原子半径之和确定; 体相结构用所有原子的三维 Delaunay 四面体外接球心作为
+    interstitial 位点。距离过近的候选位点合并, 每个位点记录到最近原子的距离 (clearance)。
+
+    耗时大致与原子数成线性: 表面结构 3840 个原子约 30 ms; 体相结构主要花在 (含周期像的)
+    三维 Delaunay 剖分上, 2560 个原子约 0.25 s, 8640 个原子约 0.8 s。
+    """
+
+    def __init__(self, structure, surface_depth=SURFACE_DEPTH, vacuum_gap=VACUUM_GAP):
+        self.structure = structure
+        self.lattice = structure.lattice
+        self.frac = _wrap(structure.frac_coords)
+        self.symbols = [site.specie.symbol for site in structure]
+        self._radius = {symbol: atomic_radius(symbol) for symbol in set(self.symbols)}
+        self.skin = 2 * max(self._radius.values()) + 3.0
+        padded, self.padded_index = _pad(self.frac, self.lattice, self.skin)
+        self.padded_cart = self.lattice.get_cartesian_coords(padded)
+        self.tree = cKDTree(self.padded_cart)
+
+        matrix = self.lattice.matrix
+        self.normal = np.cross(matrix[0], matrix[1])
+        self.normal /= np.linalg.norm(self.normal)
+        self.surface = self._find_surface(surface_depth, vacuum_gap)
+
+    @property
+    def is_slab(self):
+        return self.surface is not None
+
+    def _find_surface(self, surface_depth, vacuum_gap):
+        # 沿 c 方向找最大的空隙, 大于 vacuum_gap 时认为是表面结构, 返回表面原子的下标
+        c = self.frac[:, 2]
+        order = np.sort(c)
+        gaps = np.diff(np.concatenate([order, [order[0] + 1.0]]))
+        k = int(np.argmax(gaps))
+        height = abs(np.dot(self.lattice.matrix[2], self.normal))
+        if gaps[k] * height < vacuum_gap:
+            return None
+        # 真空层下方的一侧为上表面, 把坐标平移使真空层位于 c=1 附近
+        top = order[k]
+        shifted = np.mod(c - top, 1.0)
+        shifted[shifted > 0.5] -= 1.0
+        self.top_frac = top
+        return np.flatnonzero(shifted * height >= -surface_depth)
+
+    def clearance(self, cart):
+        dist, _ = self.tree.query(np.atleast_2d(cart))
+        return dist
+
+    def _lift(self, member_cart, member_symbols, symbol, site_lateral=None):
+        # 位点 (默认取所属表面原子在面内的中心) 沿法向抬高, 使到这些原子的距离约为原子半径之和
+        bond = atomic_radius(symbol) + np.vectorize(self._radius.get)(member_symbols)
+        base = member_cart @ self.normal
+        lateral = member_cart - base[..., None] * self.normal
+        if site_lateral is None:
+            site_lateral = lateral.mean(axis=1)
+        r = np.linalg.norm(lateral - site_lateral[:, None, :], axis=2)
+        h = np.sqrt(np.maximum(bond ** 2 - r ** 2, (0.5 * bond) ** 2)).min(axis=1)
+        return site_lateral + (base.max(axis=1) + h)[:, None] * self.normal
+
+    def _surface_sites(self, kinds, symbol):
+        # 表面原子只在面内补充周期像
+        frac, index = _pad(self.frac[self.surface], self.lattice, self.skin, periodic=(True, True, False))
+        cart = self.lattice.get_cartesian_coords(frac)
+        symbols = np.array([self.symbols[i] for i in self.surface[index]], dtype=object)
+        # 表面内的正交坐标
+        e1 = self.lattice.matrix[0] / np.linalg.norm(self.lattice.matrix[0])
+        e2 = np.cross(self.normal, e1)
+        plane = cart @ np.column_stack([e1, e2])
+
+        groups = {"top": np.arange(len(plane))[:, None]}
+        centers = {}
+        if len(plane) >= 3 and ("bridge" in kinds or "hollow" in kinds):
+            tri = Delaunay(plane)
+            # hollow 取三角形的外接圆心, 正方形网格被剖分出的两个三角形给出同一个位点
+            p = plane[tri.simplices]
+            ab, ac = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]
+            d = 2 * (ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0])
+            ok = np.abs(d) > 1e-8
+            ab2, ac2 = (ab ** 2).sum(axis=1), (ac ** 2).sum(axis=1)
+            u = p[:, 0, 0] + (ac[:, 1] * ab2 - ab[:, 1] * ac2) / np.where(ok, d, 1)
+            v = p[:, 0, 1] + (ab[:, 0] * ac2 - ac[:, 0] * ab2) / np.where(ok, d, 1)
+            groups["hollow"] = tri.simplices[ok]
+            centers["hollow"] = np.outer(u[ok], e1) + np.outer(v[ok], e2)
+            # bridge 只取最近邻之间的边 (不超过两端原子最近邻距离的 1.2 倍)
+            edges = np.unique(np.sort(tri.simplices[:, [0, 1, 1, 2, 0, 2]].reshape(-1, 2), axis=1), axis=0)
+            length = np.linalg.norm(plane[edges[:, 0]] - plane[edges[:, 1]], axis=1)
+            nearest = np.full(len(plane), np.inf)
+            np.minimum.at(nearest, edges[:, 0], length)
+            np.minimum.at(nearest, edges[:, 1], length)
+            groups["bridge"] = edges[length <= 1.2 * np.minimum(nearest[edges[:, 0]], nearest[edges[:, 1]])]
+
+        sites = []
+        for kind in kinds:
+            rows = groups.get(kind)
+            if rows is None:
+                continue
+            base = cart[rows] @ self.normal
+            lateral = centers.get(kind)
+            if lateral is None:
+                lateral = (cart[rows] - base[..., None] * self.normal).mean(axis=1)
+            # 只保留面内分数坐标落在 [0, 1) 的位点, 晶胞边界上的位点取靠近原点的一侧
+            center = self.lattice.get_fractional_coords(lateral + base.mean(axis=1)[:, None] * self.normal)[:, :2]
+            inside = np.all((center >= -1e-6) & (center < 1 - 1e-6), axis=1)
+            if not inside.any():
+                continue
+            sites.append((kind, self._lift(cart[rows[inside]], symbols[rows[inside]], symbol, lateral[inside])))
+        return sites
+
+    def _interstitial_sites(self):
+        # 晶胞内的四面体只需要边界附近 INTERSTITIAL_SKIN 以内的周期像
+        frac, _ = _pad(self.frac, self.lattice, INTERSTITIAL_SKIN)
+        points = self.lattice.get_cartesian_coords(frac)
+        tri = Delaunay(points)
+        simplices = points[tri.simplices]
+        # 四面体外接球心: 解 2 (p_i - p_0) · x = |p_i|^2 - |p_0|^2
+        p0 = simplices[:, 0]
+        a = 2 * (simplices[:, 1:] - p0[:, None, :])
+        b = (simplices[:, 1:] ** 2).sum(axis=2) - (p0 ** 2).sum(axis=1)[:, None]
+        ok = np.abs(np.linalg.det(a)) > 1e-8
+        centers = np.linalg.solve(a[ok], b[ok][..., None])[..., 0]
+        frac = self.lattice.get_fractional_coords(centers)
+        inside = np.all((frac >= 0) & (frac < 1), axis=1)
+        return [("interstitial", centers[inside])]
+
+    def find(self, symbol="H", kinds=None, min_distance=None, limit=None):
+        """
+        给出按优先级排序的候选位点
+
+        Args:
+            symbol (str): 要放置的元素, 用于确定高度和最小距离
+            kinds: 位点类型, 默认表面结构为 ("hollow", "bridge", "top"), 体相为 ("interstitial",);
+                   排在前面的类型优先, 同类位点按 clearance 从大到小排列
+            min_distance (float): 到已有原子的最小距离 (Å), 默认按原子半径估计
+            limit (int): 最多返回的位点数
+
+        Returns:
+            list: [{"kind", "frac_coords", "coords", "clearance"}, ...]
+        """
+        if kinds is None:
+            kinds = SURFACE_KINDS if self.is_slab else BULK_KINDS
+        if min_distance is None:
+            min_distance = MIN_DISTANCE_FACTOR * (atomic_radius(symbol) + min(self._radius.values()))
+
+        groups = []
+        surface_kinds = [kind for kind in kinds if kind in SURFACE_KINDS]
+        if surface_kinds:
+            if not self.is_slab:
+                warnings.warn("Warning: no vacuum layer found, surface sites are not available.")
+            else:
+                groups.extend(self._surface_sites(surface_kinds, symbol))
+        if "interstitial" in kinds:
+            groups.extend(self._interstitial_sites())
+
+        result = []
+        for kind in kinds:
+            cart = np.concatenate([c for k, c in groups if k == kind] or [np.zeros((0, 3))])
+            if not len(cart):
+                continue
+            clearance = self.clearance(cart)
+            keep = clearance >= min_distance
+            cart, clearance = cart[keep], clearance[keep]
+            kept = self._suppress(cart, clearance)
+            if limit is not None:
+                kept = kept[:limit - len(result)]
+            frac = _wrap(self.lattice.get_fractional_coords(cart[kept]))
+            result.extend({"kind": kind, "frac_coords": f, "coords": c, "clearance": d}
+                          for f, c, d in zip(frac.tolist(), cart[kept].tolist(), clearance[kept].tolist()))
+            if limit is not None and len(result) >= limit:
+                return result
+        return result
+
+    def _suppress(self, cart, clearance):
+        # 按 clearance 从大到小保留位点, 去掉与已保留位点 (含周期像) 距离小于 MERGE_RADIUS 的
+        if not len(cart):
+            return []
+        frac = _wrap(self.lattice.get_fractional_coords(cart))
+        padded, index = _pad(frac, self.lattice, MERGE_RADIUS)
+        tree = cKDTree(self.lattice.get_cartesian_coords(padded))
+        cart = self.lattice.get_cartesian_coords(frac)
+        order = np.argsort(-clearance, kind="stable")
+        # 坐标 (0.01 Å 以内) 相同的候选位点先去重, 高对称结构中很多四面体共用一个外接球心
+        _, first = np.unique(np.round(cart[order] / 0.01).astype(np.int64), axis=0, return_index=True)
+        candidates = order[np.sort(first)]
+        rank = np.full(len(cart), -1, dtype=np.int64)
+        rank[candidates] = np.arange(len(candidates))
+
+        # 一次查询所有候选位点的近邻, 只有和优先级更高的候选位点相距过近的才需要逐个判断
+        neighbors = tree.query_ball_point(cart[candidates], MERGE_RADIUS, return_sorted=False)
+        counts = np.fromiter(map(len, neighbors), dtype=np.int64, count=len(candidates))
+        other = index[np.concatenate(neighbors).astype(np.int64)]
+        owner = np.repeat(np.arange(len(candidates)), counts)
+        conflict = rank[other] >= 0
+        conflict &= rank[other] < owner
+        owner, other = owner[conflict], rank[other[conflict]]
+
+        keep = np.ones(len(candidates), dtype=bool)
+        if len(owner):
+            split = np.flatnonzero(np.diff(owner)) + 1
+            for i, higher in zip(owner[np.r_[0, split]], np.split(other, split)):
+                keep[i] = not keep[higher].any()
+        return candidates[keep].tolist()
+
+
+def place_species(structure, species, kinds=None, min_distance=None):
+    """
+    依次把 species 中的原子放到候选位点上, 新放的原子之间同样满足最小距离
+
+    Args:
+        structure: 基底结构
+        species (dict): {元素: 个数}, 例如 {"O": 2, "H": 1}
+
+    Returns:
+        Structure: 添加了原子的新结构; 位点不够时给出警告, 只放置能放下的原子
+    """
+    structure = structure.copy()
+    finder = SiteFinder(structure)
+    placed = []
+    for symbol, number in species.items():
+        number = int(number)
+        if number <= 0:
+            continue
+        count = 0
+        for site in finder.find(symbol, kinds=kinds, min_distance=min_distance):
+            if count >= number:
+                break
+            if placed:
+                dist = structure.lattice.get_all_distances([site["frac_coords"]], [frac for frac, _ in placed])[0]
+                if min_distance is not None:
+                    limit = min_distance
+                else:
+                    limit = np.maximum(MIN_SPACING, MIN_DISTANCE_FACTOR * (
+                        atomic_radius(symbol) + np.array([atomic_radius(other) for _, other in placed])))
+                if np.any(dist < limit):
+                    continue
+            placed.append((site["frac_coords"], symbol))
+            count += 1
+        if count < number:
+            warnings.warn(f"Warning: only {count} of {number} {symbol} atoms could be placed.")
+    for frac, symbol in placed:
+        structure.append(symbol, frac)
+    return structure
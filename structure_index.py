@@ -0,0 +1,297 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pymatgen.core import Composition, Element, Lattice, Structure
+
+from symmetry import get_space_group_info
+
+INDEX_NAME = "structure_index.npz"
+INDEX_VERSION = 2
+# 与 symmetry.get_space_group_info / utils.check_structure 的默认容差一致, 否则按空间群筛选时会漏掉结构
+SYMPREC = 0.01
+
+# 数组字段; species 以 species_offsets 分段的原子序数保存
+_STRING_FIELDS = ("material_id", "reduced_formula", "anonymous_formula", "spacegroup_symbol")
+_NUMBER_FIELDS = ("spacegroup_number", "nsites", "size", "mtime_ns")
+
+
+def default_index_path(root=None):
+    root = root or os.getenv("MP_ROOT_DIR")
+    if not root:
+        raise ValueError("MP_ROOT_DIR is not set.")
+    return os.path.join(root, INDEX_NAME)
+
+
+def summarize_cif(path, symprec=SYMPREC):
+    """
+    解析一个 CIF, 返回写入索引所需的字段
+    """
+    structure = Structure.from_file(path)
+    stat = os.stat(path)
+    composition = structure.composition
+    symbol, number = get_space_group_info(structure, symprec=symprec)
+    return {
+        "material_id": os.path.splitext(os.path.basename(path))[0],
+        "reduced_formula": composition.reduced_formula,
+        "anonymous_formula": composition.anonymized_formula,
+        "spacegroup_symbol": symbol,
+        "spacegroup_number": number,
+        "nsites": len(structure),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "lattice": structure.lattice.matrix,
+        "species": [site.specie.Z for site in structure],
+    }
+
+
+def _summarize(args):
+    path, symprec = args
+    try:
+        return summarize_cif(path, symprec)
+    except Exception:
+        return None
+
+
+class IndexEntry:
+    """
+    索引中的一条记录, 结构只在访问 structure 时才从 CIF 读取
+    """
+
+    __slots__ = ("index", "row", "_structure")
+
+    def __init__(self, index, row):
+        self.index = index
+        self.row = row
+        self._structure = None
+
+    def __getattr__(self, name):
+        if name in _STRING_FIELDS or name in _NUMBER_FIELDS:
+            return self.index.arrays[name][self.row].item()
+        raise AttributeError(name)
+
+    @property
+    def lattice(self):
+        return Lattice(self.index.arrays["lattice"][self.row])
+
+    @property
+    def species(self):
+        offsets = self.index.arrays["species_offsets"]
+        return [Element.from_Z(int(z)).symbol
+                for z in self.index.arrays["species"][offsets[self.row]:offsets[self.row + 1]]]
+
+    @property
+    def path(self):
+        return os.path.join(self.index.root, f"{self.material_id}.cif")
+
+    @property
+    def structure(self):
+        if self._structure is None:
+            self._structure = Structure.from_file(self.path)
+        return self._structure
+
+    def to_dict(self):
+        return {
+            "formula": self.reduced_formula,
+            "material_id": self.material_id,
+            "space_group": (self.spacegroup_symbol, self.spacegroup_number),
+            "structure": self.structure,
+        }
+
+
+class StructureIndex:
+    """
+    MP_ROOT_DIR 下所有 CIF 的本地索引, 保存在 <MP_ROOT_DIR>/structure_index.npz
+
+    build() 并行解析全部 CIF (只重新解析大小或 mtime 发生变化的文件), 记录约化化学式、
+    匿名化学式、空间群、晶格和元素; search() 只在这些数组上筛选, 命中的结构按需读取。
+    """
+
+    def __init__(self, root=None, path=None):
+        self.root = root or os.getenv("MP_ROOT_DIR")
+        self.path = path or default_index_path(self.root)
+        self.arrays = None
+        self._stamp = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        """读取索引文件, 文件没有变化时不重复读取"""
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self.arrays is not None and self._stamp == stamp:
+            return self
+        with np.load(self.path, allow_pickle=False) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"Unsupported structure index version in {self.path}")
+            self.arrays = {name: data[name] for name in data.files}
+        self._stamp = stamp
+        return self
+
+    @property
+    def symprec(self):
+        """建立索引时空间群分析所用的 symprec"""
+        return float(self.arrays["symprec"])
+
+    def __len__(self):
+        return 0 if self.arrays is None else len(self.arrays["material_id"])
+
+    def build(self, workers=None, symprec=SYMPREC, chunksize=16):
+        """
+        建立或增量更新索引; 已有索引的 symprec 与本次不同时全部重新解析
+
+        Returns:
+            dict: added/updated/removed/unchanged/failed 各自的 CIF 数
+        """
+        known = {}
+        reuse = False
+        if self.exists():
+            try:
+                self.load()
+                known = {mid: i for i, mid in enumerate(self.arrays["material_id"].tolist())}
+                reuse = self.symprec == symprec
+            except (OSError, ValueError, KeyError):
+                known = {}
+
+        report = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        rows = []
+        pending = []
+        found = set()
+        for name in sorted(os.listdir(self.root)):
+            if not name.endswith(".cif"):
+                continue
+            path = os.path.join(self.root, name)
+            material_id = name[:-4]
+            found.add(material_id)
+            stat = os.stat(path)
+            row = known.get(material_id)
+            if (reuse and row is not None and self.arrays["size"][row] == stat.st_size
+                    and self.arrays["mtime_ns"][row] == stat.st_mtime_ns):
+                rows.append(self._row(row))
+                report["unchanged"] += 1
+            else:
+                pending.append(path)
+                report["updated" if row is not None else "added"] += 1
+        report["removed"] = sum(1 for mid in known if mid not in found)
+
+        if pending:
+            tasks = [(path, symprec) for path in pending]
+            if workers == 1 or len(pending) < 2 * chunksize:
+                rows.extend(map(_summarize, tasks))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    rows.extend(pool.map(_summarize, tasks, chunksize=chunksize))
+        # 解析失败的 CIF 不写入索引, 下次 build 时重试
+        report["failed"] = sum(1 for row in rows if row is None)
+        self._write([row for row in rows if row is not None], symprec)
+        self.load()
+        return report
+
+    def _row(self, i):
+        offsets = self.arrays["species_offsets"]
+        row = {name: self.arrays[name][i].item() for name in _STRING_FIELDS + _NUMBER_FIELDS}
+        row["lattice"] = self.arrays["lattice"][i]
+        row["species"] = self.arrays["species"][offsets[i]:offsets[i + 1]]
+        return row
+
+    def _write(self, rows, symprec):
+        rows.sort(key=lambda row: row["material_id"])
+        arrays = {"version": np.array(INDEX_VERSION), "symprec": np.array(symprec, dtype=np.float64)}
+        for name in _STRING_FIELDS:
+            arrays[name] = np.array([row[name] for row in rows], dtype=str)
+        for name in _NUMBER_FIELDS:
+            arrays[name] = np.array([row[name] for row in rows], dtype=np.int64)
+        arrays["lattice"] = np.array([row["lattice"] for row in rows], dtype=np.float64).reshape(-1, 3, 3)
+        arrays["species_offsets"] = np.cumsum([0] + [len(row["species"]) for row in rows], dtype=np.int64)
+        arrays["species"] = (np.concatenate([np.asarray(row["species"], dtype=np.uint8) for row in rows])
+                             if rows else np.zeros(0, dtype=np.uint8))
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def search(self, formula=None, anonymous_formula=None, elements=None, space_group=None, limit=None):
+        """
+        在索引中查找结构模板, 按原子数从少到多排序
+
+        Args:
+            formula (str): 化学式, 按约化化学式匹配, 例如 "SrTiO3" 与 "Sr2Ti2O6" 等价
+            anonymous_formula (str): 匿名化学式 (如 "ABC3") 或任意化学式, 匹配同一类结构原型
+            elements (list): 必须包含的元素
+            space_group: 空间群符号 (str) 或空间群号 (int)
+            limit (int): 最多返回的条数
+
+        Returns:
+            list: IndexEntry 列表
+        """
+        self.load()
+        arrays = self.arrays
+        mask = np.ones(len(self), dtype=bool)
+        if formula:
+            mask &= arrays["reduced_formula"] == Composition(formula).reduced_formula
+        if anonymous_formula:
+            try:
+                anonymous_formula = Composition(anonymous_formula).anonymized_formula
+            except ValueError:
+                # 本身已经是 "ABC3" 这样的匿名化学式
+                pass
+            mask &= arrays["anonymous_formula"] == anonymous_formula
+        if space_group is not None:
+            if isinstance(space_group, str):
+                mask &= arrays["spacegroup_symbol"] == space_group
+            else:
+                mask &= arrays["spacegroup_number"] == int(space_group)
+        rows = np.flatnonzero(mask)
+        if elements:
+            wanted = {Element(el).Z for el in elements}
+            offsets = arrays["species_offsets"]
+            species = arrays["species"]
+            rows = [i for i in rows if wanted <= set(species[offsets[i]:offsets[i + 1]].tolist())]
+        rows = sorted(rows, key=lambda i: (arrays["nsites"][i], arrays["material_id"][i]))
+        if limit is not None:
+            rows = rows[:limit]
+        return [IndexEntry(self, int(i)) for i in rows]
+
+
+_INDEXES = {}
+
+
+def get_structure_local_index(formula, space_group=None, limit=3, root=None):
+    """
+    从本地索引查询化学式对应的晶体结构, 返回格式与 utils.get_structure_dp_database 相同;
+    没有索引文件时返回 None
+    """
+    root = root or os.getenv("MP_ROOT_DIR")
+    if not root:
+        return None
+    index = _INDEXES.get(root)
+    if index is None:
+        index = _INDEXES[root] = StructureIndex(root)
+    if not index.exists():
+        return None
+    # 用其他 symprec 建立的索引, 空间群可能与 check_structure 的判断不同, 交给远程数据库查询
+    if index.load().symprec != SYMPREC:
+        return None
+    res_data = []
+    for entry in index.search(formula=formula, space_group=space_group, limit=limit):
+        try:
+            res_data.append(entry.to_dict())
+        except (OSError, ValueError):
+            continue
+    return res_data
+
+
+if __name__ == "__main__":
+    # python structure_index.py [MP_ROOT_DIR] [--workers N]
+    argv = sys.argv[1:]
+    workers = None
+    if "--workers" in argv:
+        i = argv.index("--workers")
+        workers = int(argv[i + 1])
+        del argv[i:i + 2]
+    start = time.time()
+    index = StructureIndex(argv[0] if argv else None)
+    report = index.build(workers=workers)
+    print(f"{index.path}: {len(index)} structures ({report}) in {time.time() - start:.1f} s")
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from pymatgen.core import Structure
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+
+def fingerprint(structure, decimals=4):
+    """
+    结构指纹: 晶格矩阵、元素和取整后的分数坐标的摘要, 与原子顺序和坐标的周期平移 (x 与 x+1) 无关
+    """
+    lattice = np.round(structure.lattice.matrix, decimals) + 0.0
+    frac = np.round(np.mod(structure.frac_coords, 1.0), decimals) % 1.0 + 0.0
+    numbers = np.array([site.specie.Z for site in structure], dtype=np.int64)
+    # 带有氧化态、占位等信息的结构按字符串区分
+    labels = [str(site.species) for site in structure]
+    order = np.lexsort((frac[:, 2], frac[:, 1], frac[:, 0], numbers))
+    digest = hashlib.sha1()
+    digest.update(lattice.tobytes())
+    digest.update(numbers[order].tobytes())
+    digest.update(frac[order].tobytes())
+    digest.update("|".join(labels[i] for i in order).encode())
+    return digest.hexdigest()
+
+
+class SymmetryCache:
+    """
+    按结构指纹缓存的对称性分析结果 (空间群、对称操作、原胞)
+
+    各项结果在第一次被请求时才计算, 只查询空间群时不会去找原胞。内存中最多保留 maxsize 个结构,
+    按最近使用淘汰; 给出 path 时结果同时写入 SQLite 文件, 新的进程可以直接复用, 文件中的条目数
+    超过 max_entries 时按最近访问时间淘汰。symprec/angle_tolerance 不同的分析结果分开缓存。
+    """
+
+    def __init__(self, maxsize=4096, path=None, decimals=4, max_entries=100000):
+        self.maxsize = maxsize
+        self.path = path
+        self.decimals = decimals
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            cache_dir = os.path.dirname(path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            with self._connect() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS symmetry ("
+                             "key TEXT PRIMARY KEY, data TEXT NOT NULL, accessed REAL NOT NULL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_symmetry_accessed ON symmetry (accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+        if self.path:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM symmetry")
+
+    def _entry(self, structure, symprec, angle_tolerance):
+        key = f"{fingerprint(structure, self.decimals)}:{symprec:g}:{angle_tolerance:g}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return key, entry
+        entry = self._load(key) or {}
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return key, entry
+
+    def _field(self, structure, symprec, angle_tolerance, name, compute):
+        # entry 中按需补充 name 对应的结果, 新算出的结果连同已有的一起写回 SQLite
+        key, entry = self._entry(structure, symprec, angle_tolerance)
+        if name in entry:
+            with self._lock:
+                self.hits += 1
+            return entry
+        entry.update(compute(SpacegroupAnalyzer(structure, symprec=symprec, angle_tolerance=angle_tolerance)))
+        self._store(key, entry)
+        with self._lock:
+            self.misses += 1
+        return entry
+
+    def _load(self, key):
+        if not self.path:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT data FROM symmetry WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE symmetry SET accessed = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def _store(self, key, entry):
+        if not self.path:
+            return
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO symmetry (key, data, accessed) VALUES (?, ?, ?)",
+                         (key, json.dumps(entry), time.time()))
+            conn.execute("DELETE FROM symmetry WHERE key NOT IN "
+                         "(SELECT key FROM symmetry ORDER BY accessed DESC LIMIT ?)", (self.max_entries,))
+
+    def space_group_info(self, structure, symprec=0.01, angle_tolerance=5.0):
+        """与 Structure.get_space_group_info 相同, 返回 (空间群符号, 空间群号)"""
+        entry = self._field(structure, symprec, angle_tolerance, "symbol", lambda analyzer: {
+            "symbol": analyzer.get_space_group_symbol(),
+            "number": analyzer.get_space_group_number(),
+        })
+        return entry["symbol"], entry["number"]
+
+    def symmetry_operations(self, structure, symprec=0.01, angle_tolerance=5.0):
+        """返回 (rotations, translations), 分数坐标下的整数旋转矩阵 (n, 3, 3) 和平移 (n, 3)"""
+        def compute(analyzer):
+            dataset = analyzer.get_symmetry_dataset()
+            return {
+                "rotations": np.asarray(dataset.rotations).tolist(),
+                "translations": np.asarray(dataset.translations).tolist(),
+            }
+
+        entry = self._field(structure, symprec, angle_tolerance, "rotations", compute)
+        return np.array(entry["rotations"], dtype=int), np.array(entry["translations"], dtype=float)
+
+    def primitive(self, structure, symprec=0.01, angle_tolerance=5.0):
+        """返回原胞 (每次返回新的 Structure, 可以直接修改)"""
+        entry = self._field(structure, symprec, angle_tolerance, "primitive",
+                            lambda analyzer: {"primitive": analyzer.find_primitive().as_dict()})
+        return Structure.from_dict(entry["primitive"])
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def get_symmetry_cache():
+    """
+    进程内共用的 SymmetryCache, 环境变量 SYMMETRY_CACHE_PATH 指定持久化的 SQLite 文件
+    """
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = SymmetryCache(path=os.environ.get("SYMMETRY_CACHE_PATH") or None)
+        return _default_cache
+
+
+def get_space_group_info(structure, symprec=0.01, angle_tolerance=5.0):
+    return get_symmetry_cache().space_group_info(structure, symprec, angle_tolerance)
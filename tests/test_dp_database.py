@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from pymatgen.core import Lattice, Structure
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+DELAY = 0.3
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 才能保持长连接, 每个 handler 实例对应一条客户端连接
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.append(self.client_address)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.queries.append(payload["text"])
+        time.sleep(DELAY)
+        body = json.dumps({"data": [{"formula": "SrTiO3", "material_id": "mp-5229"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    structure = Structure(Lattice.cubic(3.9), ["Sr", "Ti", "O", "O", "O"],
+                          [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+    structure.to(filename=str(tmp_path / "mp-5229.cif"))
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.connections = []
+    httpd.queries = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("DP_DATABASE_URL", f"http://127.0.0.1:{httpd.server_address[1]}/query/openai")
+    monkeypatch.setenv("MP_ROOT_DIR", str(tmp_path))
+    # 每个测试使用新的连接池
+    monkeypatch.setattr(utils, "_dp_session", None)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    if utils._dp_session is not None:
+        utils._dp_session.close()
+
+
+def test_queries_run_concurrently_and_reuse_connections(server):
+    formulas = [f"Sr{i}TiO3" for i in range(1, 9)]
+    workers = 4
+    for _ in range(3):
+        start = time.time()
+        results = utils.get_structures_dp_database(formulas, max_workers=workers)
+        elapsed = time.time() - start
+        # 8 个查询分两批并发完成, 顺序执行需要 8 * DELAY
+        assert elapsed < 4 * DELAY
+        assert list(results) == formulas
+        assert all(len(res) == 1 and res[0]["material_id"] == "mp-5229" for res in results.values())
+        assert results[formulas[0]][0]["structure"].composition.reduced_formula == "SrTiO3"
+
+    assert len(server.queries) == 3 * len(formulas)
+    # 多轮查询共用连接池, 每个线程最多一条连接
+    assert len(server.connections) <= workers
+
+
+def test_failed_query_gives_empty_result(server, monkeypatch):
+    monkeypatch.setenv("MP_ROOT_DIR", os.path.join(os.environ["MP_ROOT_DIR"], "missing"))
+    with pytest.warns(UserWarning):
+        results = utils.get_structures_dp_database(["SrTiO3"])
+    assert results == {"SrTiO3": []}
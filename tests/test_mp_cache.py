@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+from pymatgen.core import Lattice, Structure
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils
+
+
+def _perovskite(c):
+    return Structure(Lattice.tetragonal(3.9, c), ["Sr", "Ti", "O", "O", "O"],
+                     [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+
+
+# 按 energy_above_hull 排好序的录制数据: 前 12 个是四方相 (P4/mmm), 之后是立方相 (Pm-3m)
+DOCS = [{"material_id": f"mp-{i}", "formula_pretty": "SrTiO3", "energy_above_hull": i * 0.01,
+         "spacegroup_number": 123 if i < 12 else 221,
+         "structure": _perovskite(4.2 if i < 12 else 3.9).as_dict()} for i in range(25)]
+
+
+class _Response:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return {"data": self.data}
+
+
+class FakeSession:
+    def __init__(self, docs):
+        self.docs = docs
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        assert url.endswith("/materials/summary/")
+        assert params["_sort_fields"] == "energy_above_hull"
+        self.requests.append(params)
+        # 服务器端按空间群筛选
+        docs = [doc for doc in self.docs
+                if "spacegroup_number" not in params or doc["spacegroup_number"] == params["spacegroup_number"]]
+        skip, limit = params["_skip"], params["_limit"]
+        return _Response(docs[skip:skip + limit])
+
+
+def test_stops_after_first_page(tmp_path):
+    session = FakeSession(DOCS)
+    cache = utils.MPSummaryCache(path=str(tmp_path), session=session)
+    res = utils.get_structure_mp_database("SrTiO3", limit=3, cache=cache)
+    assert [r["material_id"] for r in res] == ["mp-0", "mp-1", "mp-2"]
+    assert [p["_skip"] for p in session.requests] == [0]
+    assert session.requests[0]["_fields"] == ",".join(utils.MP_FIELDS)
+
+
+def test_space_group_is_filtered_by_the_server(tmp_path):
+    session = FakeSession(DOCS)
+    cache = utils.MPSummaryCache(path=str(tmp_path), session=session)
+    res = utils.get_structure_mp_database("SrTiO3", space_group=221, limit=3, cache=cache)
+    assert [r["material_id"] for r in res] == ["mp-12", "mp-13", "mp-14"]
+    # 只请求一页, 不在客户端翻页筛选
+    assert [(p["_skip"], p["spacegroup_number"]) for p in session.requests] == [(0, 221)]
+
+    again = utils.get_structure_mp_database("SrTiO3", space_group=221, limit=3, cache=cache)
+    assert [r["material_id"] for r in again] == ["mp-12", "mp-13", "mp-14"]
+    assert len(session.requests) == 1
+
+    # 不同空间群的结果分开缓存
+    utils.get_structure_mp_database("SrTiO3", limit=3, cache=cache)
+    assert len(session.requests) == 2 and "spacegroup_number" not in session.requests[1]
+    utils.get_structure_mp_database("SrTiO3", space_group="Pm-3m", limit=3, cache=cache)
+    assert session.requests[2]["spacegroup_symbol"] == "Pm-3m"
+
+
+def test_complete_record_needs_no_requests(tmp_path):
+    session = FakeSession(DOCS)
+    cache = utils.MPSummaryCache(path=str(tmp_path), session=session)
+    res = utils.get_structure_mp_database("SrTiO3", limit=100, cache=cache)
+    assert len(res) == len(DOCS)
+    # 最后一页不满一页, 记录标记为已全部取回
+    assert [p["_skip"] for p in session.requests] == [0, 10, 20]
+    assert cache.load("SrTiO3")["complete"]
+
+    utils.get_structure_mp_database("SrTiO3", limit=100, cache=cache)
+    assert len(session.requests) == 3
+
+
+def test_offline_reads_recorded_data_only(tmp_path):
+    utils.get_structure_mp_database("SrTiO3", limit=13,
+                                    cache=utils.MPSummaryCache(path=str(tmp_path), session=FakeSession(DOCS)))
+
+    session = FakeSession(DOCS)
+    offline = utils.MPSummaryCache(path=str(tmp_path), offline=True, session=session)
+    res = utils.get_structure_mp_database("SrTiO3", limit=100, cache=offline)
+    # 只返回录制时取回的两页
+    assert [r["material_id"] for r in res] == [f"mp-{i}" for i in range(20)]
+    with pytest.raises(FileNotFoundError):
+        utils.get_structure_mp_database("BaTiO3", cache=offline)
+    assert session.requests == []
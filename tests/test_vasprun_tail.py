@@ -0,0 +1,68 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import VasprunTail
+
+
+def _vasprun(nsteps, time="10:00:00", finished=True):
+    lines = ['<?xml version="1.0" encoding="ISO-8859-1"?>\n<modeling>\n',
+             ' <generator>\n  <i name="program" type="string">vasp </i>\n',
+             f'  <i name="date" type="string">2026 10 17 </i>\n  <i name="time" type="string">{time} </i>\n',
+             ' </generator>\n <incar>\n  <i type="int" name="NSW">     10</i>\n </incar>\n']
+    for step in range(nsteps):
+        lines.append(' <calculation>\n  <scstep>\n  </scstep>\n  <varray name="forces" >\n')
+        lines.append(f'   <v> {0.1 * (step + 1):.8f} 0.00000000 0.00000000 </v>\n  </varray>\n')
+        lines.append(f'  <energy>\n   <i name="e_fr_energy">  {-10.0 - step:f} </i>\n  </energy>\n </calculation>\n')
+    if finished:
+        lines.append('</modeling>\n')
+    return "".join(lines)
+
+
+def _write(path, text):
+    # 原地改写, inode 不变
+    with open(path, "w") as fp:
+        fp.write(text)
+
+
+def test_reads_appended_steps(tmp_path):
+    path = str(tmp_path / "vasprun.xml")
+    _write(path, _vasprun(2, finished=False))
+    tail = VasprunTail(path, chunk_size=64)
+    assert [step["step"] for step in tail.poll()] == [0, 1]
+    assert not tail.finished
+    _write(path, _vasprun(3))
+    steps = tail.poll()
+    assert [step["step"] for step in steps] == [2]
+    assert steps[0]["energy"] == -12.0
+    assert tail.finished and tail.nsteps == 3
+    assert tail.poll() == []
+
+
+def test_rewritten_with_larger_file(tmp_path):
+    path = str(tmp_path / "vasprun.xml")
+    _write(path, _vasprun(2))
+    tail = VasprunTail(path)
+    assert len(tail.poll()) == 2 and tail.finished
+
+    # 重新提交的计算, 头部的开始时间不同, 文件比已读的偏移更长
+    _write(path, _vasprun(4, time="11:00:00", finished=False))
+    steps = tail.poll()
+    assert [step["step"] for step in steps] == [0, 1, 2, 3]
+    assert tail.nsteps == 4 and not tail.finished
+
+
+def test_rewritten_with_same_header(tmp_path):
+    path = str(tmp_path / "vasprun.xml")
+    _write(path, _vasprun(1))
+    tail = VasprunTail(path)
+    assert len(tail.poll()) == 1 and tail.finished
+
+    # 头部完全相同时, 新内容接在已结束的文档之后会解析出错, 同样从头重新读取
+    _write(path, _vasprun(3, finished=False))
+    assert [step["step"] for step in tail.poll()] == [0, 1, 2]
+    assert tail.nsteps == 3 and not tail.finished
+    _write(path, _vasprun(3))
+    assert tail.poll() == []
+    assert tail.finished
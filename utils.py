@@ -1,12 +1,23 @@
+import hashlib
 import json
+import mmap
 import os
+import sqlite3
+import threading
 import time
+import warnings
 import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
 import re
 import openai
 from pymatgen.core import Lattice, Structure,Element
 from pymatgen.io.vasp.inputs import Poscar
+from symmetry import get_space_group_info
+from enumeration import SubstitutionEnumerator, supercell_matrix
+from site_finder import place_species
 
 def edit_job_json(project_id: int, image_address: str = "registry.dp.tech/dptech/vasp:5.4.4", output_file: str = "job.json") -> dict:
     """
@@ -59,130 +70,1220 @@ def edit_job_json(project_id: int, image_address: str = "registry.dp.tech/dptech
         return {}
     
 
+class _StepSelection:
+    """
+    project() 的离子步选择
+
+    非负索引在流式读取时即可判断; 负索引 (以及 slice(-n, None)) 需要知道总步数,
+    因此只缓冲最后 tail 步, 读完后再解析。
+    """
+
+    def __init__(self, steps):
+        self.tail = 0
+        self.stop = None
+        self._positive = None
+        self._negative = ()
+        self._slice = None
+
+        if steps is None:
+            self._positive = lambda index: True
+        elif isinstance(steps, slice):
+            start, stop, step = steps.start, steps.stop, steps.step or 1
+            if step <= 0:
+                raise ValueError("step slices must have a positive step")
+            if start is not None and start < 0:
+                if stop is not None:
+                    raise ValueError("a negative step slice must not have a stop, e.g. slice(-5, None)")
+                self.tail = -start
+                self._slice = steps
+                self._positive = lambda index: False
+            else:
+                if stop is not None and stop < 0:
+                    raise ValueError("a step slice with a non-negative start needs a non-negative stop")
+                start = start or 0
+                self.stop = stop
+                self._positive = lambda index: (index >= start and (index - start) % step == 0
+                                                and (stop is None or index < stop))
+        else:
+            indices = [steps] if isinstance(steps, (int, np.integer)) else list(steps)
+            positive = {int(i) for i in indices if i >= 0}
+            self._negative = sorted({int(i) for i in indices if i < 0})
+            self._positive = positive.__contains__
+            if self._negative:
+                self.tail = -self._negative[0]
+            else:
+                self.stop = max(positive) + 1 if positive else 0
+
+    def wanted(self, index):
+        return self._positive(index)
+
+    def resolve(self, n):
+        """总步数为 n 时, 需要从末尾缓冲中取出的步号"""
+        if self._slice is not None:
+            return list(range(n)[self._slice])
+        return [n + i for i in self._negative if n + i >= 0]
+
+    def indices(self, n):
+        return sorted({i for i in range(n) if self.wanted(i)} | set(self.resolve(n)))
+
+
+class _SetCollector:
+    """
+    把 <array> 中嵌套的 <set> 层级解码为 ndarray
+
+    每个最内层 <set> 的 <r> 文本拼接后一次性转换; 各层 <set> 的个数用来恢复
+    (spin, kpoint, ...) 等外层维度, 不为每个 <r> 建立 Python 列表。
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.blocks = []
+        self.counts = {}
+
+    def add_row(self, text):
+        self.rows.append(text)
+
+    def end_set(self, depth):
+        self.counts[depth] = self.counts.get(depth, 0) + 1
+        if self.rows:
+            values = np.array(" ".join(self.rows).split(), dtype=np.float64)
+            self.blocks.append(values.reshape(len(self.rows), -1))
+            self.rows = []
+
+    def feed_tree(self, set_elem, depth=0):
+        for child in set_elem:
+            if child.tag == 'set':
+                self.feed_tree(child, depth + 1)
+            elif child.tag == 'r':
+                self.add_row(child.text)
+        self.end_set(depth)
+
+    def result(self):
+        if not self.blocks:
+            return None
+        depths = sorted(self.counts)
+        shape = [self.counts[d] // self.counts[d - 1] for d in depths[1:]]
+        data = np.stack(self.blocks)
+        return data.reshape(*shape, *data.shape[1:])
+
+
+# 电子结构相关的 <array> 在 <calculation> 中的位置
+_ELECTRONIC_BLOCKS = {
+    ('calculation', 'eigenvalues', 'array'): 'eigenvalues',
+    ('calculation', 'dos', 'total', 'array'): 'dos_total',
+    ('calculation', 'dos', 'partial', 'array'): 'dos_partial',
+    ('calculation', 'projected', 'array'): 'projected',
+}
+
+
+_EFERMI_PATTERN = re.compile(rb'<i name="efermi">\s*([^<\s]+)\s*</i>')
+_FIELD_PATTERN = re.compile(rb'<field[^>]*>([^<]*)</field>')
+_SET_PATTERN = re.compile(rb'<set[^>]*>|</set>')
+
+
+def _last_block(mm, tag, end=None, start=0):
+    # 返回最后一个完整的 <tag>...</tag> 的字节范围, 文件被截断时返回 None
+    end = len(mm) if end is None else end
+    begin = mm.rfind(b'<' + tag + b'>', start, end)
+    if begin < 0:
+        return None
+    close = mm.find(b'</' + tag + b'>', begin, end)
+    if close < 0:
+        return None
+    return begin, close
+
+
+def _decode_array_block(mm, start, end):
+    # 把 [start, end) 中第一个 <array> 解码为 (fields, ndarray),
+    # 外层维度由各层 <set> 的个数恢复, 最后两维为 (行, 列)
+    begin = mm.find(b'<array', start, end)
+    if begin < 0:
+        return None
+    first_set = mm.find(b'<set', begin, end)
+    if first_set < 0:
+        return None
+    fields = [f.decode().strip() for f in _FIELD_PATTERN.findall(mm, begin, first_set)]
+
+    counts = {}
+    depth = -1
+    pieces = []
+    position = first_set
+    for match in _SET_PATTERN.finditer(mm, first_set, end):
+        if match.group().startswith(b'</'):
+            depth -= 1
+        else:
+            depth += 1
+            counts[depth] = counts.get(depth, 0) + 1
+        # <set> 标签之间只有 <r> 行, 去掉 <set> 标签 (注释里有数字) 后拼成一段
+        pieces.append(mm[position:match.start()])
+        position = match.end()
+        if depth < 0:
+            break
+
+    # 整段数据只经过一次 translate 删掉 <r></r> 的字符, 再由 numpy 一次性转换,
+    # 不为每个 <r> 或每个数字建立 bytes 对象
+    body = b"".join(pieces)
+    nrows = body.count(b'<r>')
+    if not nrows:
+        return None
+    values = np.fromstring(body.translate(None, b'<>/r'), dtype=np.float64, sep=' ')
+    depths = sorted(counts)
+    shape = [counts[d] // counts[d - 1] for d in depths[1:]]
+    return fields, values.reshape(*shape, nrows // counts[depths[-1]], -1)
+
+
+def _varray_to_array(varray, ncols=3):
+    # 整个 varray 拼成一个字符串后一次性转换, 避免逐个 <v> 建立 Python 列表
+    values = np.array(" ".join([v.text for v in varray]).split(), dtype=np.float64)
+    return values.reshape(-1, ncols)
+
+
+class VasprunCache:
+    """
+    VasprunParser 解析结果的 HDF5 旁路缓存, 默认存放在 <vasprun.xml>.cache.h5
+
+    缓存键为 文件路径 + 大小 + mtime + 内容哈希, 任何一项对不上都视为过期并删除。
+    内容哈希只覆盖文件开头和末尾各 1 MiB (不超过 2 MiB 的文件即为全文), 中间部分被改写
+    而大小和 mtime 都不变的情况检测不到。数组分区以不压缩的连续数据集保存,
+    读取时用 np.memmap 直接映射, 元数据分区以 JSON 字符串保存。
+    """
+
+    VERSION = 1
+    HASH_BLOCK = 1 << 20
+    # 以 (name, value) 元组列表形式返回的分区, JSON 往返后需要还原成元组
+    PAIR_SECTIONS = ('generator', 'incar', 'monkhorst_pack', 'parameters', 'atoms_info', 'structure')
+    JSON_SECTIONS = PAIR_SECTIONS + ('kpoints_list', 'kpoints_weight', 'species', 'calculation',
+                                     'projected_steps')
+    ARRAY_SECTIONS = ('kpoints_array', 'kpoints_weight_array')
+    GROUP_SECTIONS = ('structure_arrays', 'calculation_arrays', 'eigenvalues', 'dos',
+                      'projected_dos', 'projections')
+
+    def __init__(self, path, cache_path=None):
+        self.path = os.path.abspath(path)
+        self.cache_path = cache_path or self.path + ".cache.h5"
+
+    def fingerprint(self):
+        stat = os.stat(self.path)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.path, 'rb') as fp:
+            digest.update(fp.read(self.HASH_BLOCK))
+            if stat.st_size > self.HASH_BLOCK:
+                fp.seek(max(self.HASH_BLOCK, stat.st_size - self.HASH_BLOCK))
+                digest.update(fp.read(self.HASH_BLOCK))
+        return {
+            'version': self.VERSION,
+            'source': self.path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'digest': digest.hexdigest(),
+        }
+
+    def invalidate(self):
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def load(self):
+        """命中时返回 {分区名: 数据}, 未命中或过期时返回 None"""
+        import h5py
+
+        if not os.path.isfile(self.cache_path):
+            return None
+        key = self.fingerprint()
+        with h5py.File(self.cache_path, 'r') as h5:
+            stored = {name: h5.attrs.get(name) for name in key}
+            stored = {name: value.decode() if isinstance(value, bytes) else value
+                      for name, value in stored.items()}
+            if any(stored[name] != key[name] for name in key):
+                stale = True
+            else:
+                stale = False
+                sections = {}
+                for name, dset in h5.get('json', {}).items():
+                    sections[name] = self._from_json(name, json.loads(dset.asstr()[()]))
+                for name, dset in h5.get('arrays', {}).items():
+                    sections[name] = self._map_dataset(dset)
+                for name, group in h5.get('groups', {}).items():
+                    sections[name] = {k: self._map_dataset(v) for k, v in group.items()}
+        if stale:
+            self.invalidate()
+            return None
+        return sections
+
+    def store(self, sections):
+        import h5py
+
+        key = self.fingerprint()
+        tmp_path = self.cache_path + ".tmp"
+        with h5py.File(tmp_path, 'w') as h5:
+            for name, value in key.items():
+                h5.attrs[name] = value
+            for name in self.JSON_SECTIONS:
+                if name in sections:
+                    h5.require_group('json').create_dataset(
+                        name, data=json.dumps(sections[name]), dtype=h5py.string_dtype())
+            for name in self.ARRAY_SECTIONS:
+                if name in sections:
+                    h5.require_group('arrays').create_dataset(name, data=np.asarray(sections[name]))
+            for name in self.GROUP_SECTIONS:
+                if sections.get(name) is not None:
+                    group = h5.require_group('groups').create_group(name)
+                    for k, v in sections[name].items():
+                        if v is None:
+                            continue
+                        if isinstance(v, list):
+                            group.create_dataset(k, data=v, dtype=h5py.string_dtype())
+                        else:
+                            group.create_dataset(k, data=np.asarray(v))
+        os.replace(tmp_path, self.cache_path)
+
+    def _map_dataset(self, dset):
+        if dset.dtype.kind == 'O':
+            return list(dset.asstr()[()])
+        if dset.shape == ():
+            return dset[()].item()
+        # 连续存储的数据集直接 memmap, 不把数据读进内存
+        offset = dset.id.get_offset()
+        if offset is None or dset.chunks is not None or dset.compression is not None:
+            return dset[()]
+        return np.memmap(self.cache_path, mode='r', dtype=dset.dtype, shape=dset.shape, offset=offset)
+
+    def _from_json(self, name, value):
+        if name in self.PAIR_SECTIONS:
+            return [tuple(item) if isinstance(item, list) else item for item in value]
+        if name == 'calculation':
+            calc_res, calc_positions, calc_forces = value
+            calc_res = [[tuple(item) for item in tag_list] for tag_list in calc_res]
+            return calc_res, calc_positions, calc_forces
+        return value
+
+
 class VasprunParser:
-    def __init__(self, path):
+    """
+    vasprun.xml 解析器
+
+    文件只在第一次访问时解析一次, 之后复用同一棵树; 各个分区按标签名查找,
+    并在第一次被请求时才构建, 结果缓存在 self._sections 中。
+
+    stream=True 时只解析第一个 <calculation> 之前的头部信息, 离子步通过
+    iter_calculation() 用 iterparse 逐步读取, 内存只与单个离子步的大小相关。
+
+    cache=True 时已构建的分区会通过 save_cache() 写入 HDF5 旁路文件
+    (见 VasprunCache), 下次打开同一个未改动的文件时直接读出; project() 的结果
+    只缓存投影出的字段, 不会为了缓存而解码全部离子步。
+    """
+
+    def __init__(self, path, stream=False, cache=False):
         self.path = path
+        self.stream = stream
+        self._root = None
+        self._sections = {}
+        self._cache = VasprunCache(path) if cache else None
+        self._cache_loaded = False
+        self._cache_dirty = False
+        self._electronic_raw = None
 
     def get_root(self):
-        tree = ET.parse(self.path)
-        return tree.getroot()
+        if self._root is None:
+            if self.stream:
+                self._root = self._parse_header()
+            else:
+                self._root = ET.parse(self.path).getroot()
+        return self._root
+
+    def _parse_header(self):
+        # 读到第一个 <calculation> 开始就停止, 头部各块此时都已完整;
+        # iterparse 按块预读, 把已经读进来的离子步一并去掉
+        root = None
+        with open(self.path, 'rb') as fp:
+            for event, elem in ET.iterparse(fp, events=('start',)):
+                if root is None:
+                    root = elem
+                elif elem.tag == 'calculation':
+                    del root[list(root).index(elem):]
+                    break
+        return root
+
+    def _section(self, name, builder):
+        # 每个分区只构建一次
+        if self._cache is not None and not self._cache_loaded:
+            self._load_cache()
+        if name not in self._sections:
+            self._sections[name] = builder()
+            self._cache_dirty = True
+        return self._sections[name]
+
+    def _load_cache(self):
+        self._cache_loaded = True
+        try:
+            cached = self._cache.load()
+        except Exception as e:
+            warnings.warn(f"Ignoring unreadable vasprun cache {self._cache.cache_path}: {e}")
+            return
+        if cached:
+            cached.update(self._sections)
+            self._sections = cached
+
+    def save_cache(self):
+        """把已经构建的分区写入 HDF5 缓存, 没有新分区时不写"""
+        if self._cache is None or not self._cache_dirty:
+            return
+        try:
+            self._cache.store(self._sections)
+            self._cache_dirty = False
+        except Exception as e:
+            warnings.warn(f"Failed to write vasprun cache {self._cache.cache_path}: {e}")
+
+    def _find(self, tag):
+        node = self.get_root().find(tag)
+        if node is None:
+            raise ValueError(f"<{tag}> block not found in {self.path}")
+        return node
+
+    def _find_varray(self, node, name):
+        for varray in node.findall('varray'):
+            if varray.attrib.get('name') == name:
+                return varray
+        return None
 
     def generator(self):
-        gen_node = list(self.get_root())[0]
-        return [(item.attrib['name'], item.text) for item in gen_node.iter('i')]
+        def build():
+            gen_node = self._find('generator')
+            return [(item.attrib['name'], item.text) for item in gen_node.iter('i')]
+        return self._section('generator', build)
 
     def incar(self):
-        inc_node = list(self.get_root())[1]
-        return [(item.attrib['name'], item.text) for item in inc_node.iter('i')]
+        def build():
+            inc_node = self._find('incar')
+            return [(item.attrib['name'], item.text) for item in inc_node.iter('i')]
+        return self._section('incar', build)
 
     def monkhorst_pack(self):
-        kpoints = list(self.get_root())[2]
-        first_block = list(kpoints)[0]
-        return [(item.attrib['name'], item.text.split()) for item in list(first_block)]
+        def build():
+            first_block = self._find('kpoints').find('generation')
+            if first_block is None:
+                return []  # 显式给出的 k 点列表没有 generation 块
+            return [(item.attrib['name'], item.text.split()) for item in list(first_block)]
+        return self._section('monkhorst_pack', build)
 
     def kpoints_list(self):
-        kpoints = list(self.get_root())[2]
-        coord_block = list(kpoints)[1]
-        return [v.text.split() for v in coord_block.findall('v')]
+        def build():
+            coord_block = self._find_varray(self._find('kpoints'), 'kpointlist')
+            if coord_block is None:
+                return []
+            return [v.text.split() for v in coord_block.findall('v')]
+        return self._section('kpoints_list', build)
 
     def kpoints_weight(self):
-        kpoints = list(self.get_root())[2]
-        children = list(kpoints)
-        if len(children) >= 3:
-            weight_block = children[2]
-            return [v.text.strip() for v in weight_block.findall('v')]
-        else:
-            return []  # 或者 return ['1.0']*len(self.kpoints_list()) 默认均匀权重
+        def build():
+            weight_block = self._find_varray(self._find('kpoints'), 'weights')
+            if weight_block is not None:
+                return [v.text.strip() for v in weight_block.findall('v')]
+            else:
+                return []  # 或者 return ['1.0']*len(self.kpoints_list()) 默认均匀权重
+        return self._section('kpoints_weight', build)
 
     def parameters(self):
-        param = list(self.get_root())[3]
-        result = []
+        def build():
+            param = self._find('parameters')
+            result = []
 
-        for item in param.iter('i'):
-            result.append((item.attrib.get('name'), item.text.strip()))
+            for item in param.iter('i'):
+                result.append((item.attrib.get('name'), item.text.strip()))
 
-        for item in param.iter('v'):
-            name = item.attrib.get('name')  # 安全访问
-            if name is not None:
-                result.append((name, item.text.split()))
-            else:
-                result.append(("unnamed_v", item.text.split()))
-        
-        return result
+            for item in param.iter('v'):
+                name = item.attrib.get('name')  # 安全访问
+                if name is not None:
+                    result.append((name, item.text.split()))
+                else:
+                    result.append(("unnamed_v", item.text.split()))
+
+            return result
+        return self._section('parameters', build)
 
     def atoms_info(self):
-        atinfo = list(self.get_root())[4]
-        children = list(atinfo)
-        info = [
-            ('No. of atoms', children[0].text.strip()),
-            ('atom types', children[1].text.strip())
-        ]
-        for c in atinfo.iter('c'):
-            info.append(c.text.strip())
-        return info
+        def build():
+            atinfo = self._find('atominfo')
+            info = [
+                ('No. of atoms', atinfo.find('atoms').text.strip()),
+                ('atom types', atinfo.find('types').text.strip())
+            ]
+            for c in atinfo.iter('c'):
+                info.append(c.text.strip())
+            return info
+        return self._section('atoms_info', build)
+
+    def species(self):
+        """每个原子的元素符号, 与 positions 的顺序一致"""
+        def build():
+            atinfo = self._find('atominfo')
+            for array in atinfo.findall('array'):
+                if array.attrib.get('name') == 'atoms':
+                    return [rc.find('c').text.strip() for rc in array.iter('rc')]
+            return []
+        return self._section('species', build)
+
+    def _initial_structure(self):
+        root = self.get_root()
+        atom_struct = root.find("structure[@name='initialpos']")
+        if atom_struct is None:
+            atom_struct = self._find('structure')
+        return atom_struct
 
     def structure(self):
-        cstruct = []
-        atom_struct = list(self.get_root())[5]
-        crystal = atom_struct.find('crystal')
+        def build():
+            cstruct = []
+            atom_struct = self._initial_structure()
+            crystal = atom_struct.find('crystal')
+
+            if crystal is not None:
+                elem_varrays = crystal.findall('varray')
+                elemi = crystal.find('i')
 
-        if crystal is not None:
-            elem_varrays = crystal.findall('varray')
-            elemi = crystal.find('i')
+                for varray in elem_varrays:
+                    vectors = [v.text.split() for v in varray.findall('v')]
+                    cstruct.append((varray.attrib['name'], vectors))
 
-            for varray in elem_varrays:
+                if elemi is not None:
+                    cstruct.append((elemi.attrib['name'], elemi.text.strip()))
+            else:
+                cstruct.append(("crystal", "Not found"))
+
+            for varray in atom_struct.findall('varray'):
                 vectors = [v.text.split() for v in varray.findall('v')]
                 cstruct.append((varray.attrib['name'], vectors))
 
-            if elemi is not None:
-                cstruct.append((elemi.attrib['name'], elemi.text.strip()))
+            return cstruct
+        return self._section('structure', build)
+
+    def lattice(self):
+        """初始结构的晶格矢量, (3, 3) float64"""
+        return self.structure_arrays()["basis"]
+
+    def structure_arrays(self):
+        """
+        初始结构的数值形式
+
+        Returns:
+            dict: basis/rec_basis 为 (3, 3), positions 为 (natoms, 3), 均为 float64
+        """
+        def build():
+            atom_struct = self._initial_structure()
+            crystal = atom_struct.find('crystal')
+            arrays = {}
+            if crystal is not None:
+                for name in ('basis', 'rec_basis'):
+                    varray = self._find_varray(crystal, name)
+                    if varray is not None:
+                        arrays[name] = _varray_to_array(varray)
+            varray = self._find_varray(atom_struct, 'positions')
+            if varray is not None:
+                arrays['positions'] = _varray_to_array(varray)
+            return arrays
+        return self._section('structure_arrays', build)
+
+    def kpoints_array(self):
+        """k 点坐标 (nk, 3) float64"""
+        def build():
+            coord_block = self._find_varray(self._find('kpoints'), 'kpointlist')
+            if coord_block is None:
+                return np.zeros((0, 3))
+            return _varray_to_array(coord_block)
+        return self._section('kpoints_array', build)
+
+    def kpoints_weight_array(self):
+        """k 点权重 (nk,) float64, 没有权重信息时为空数组"""
+        def build():
+            weight_block = self._find_varray(self._find('kpoints'), 'weights')
+            if weight_block is None:
+                return np.zeros(0)
+            return _varray_to_array(weight_block, ncols=1)[:, 0]
+        return self._section('kpoints_weight_array', build)
+
+    def _parse_step(self, step):
+        tag_list = []
+        cpos = []
+        cforces = []
+
+        for itag in step.iter('i'):
+            tag_list.append((itag.attrib['name'], itag.text.strip()))
+        for timetag in step.iter('time'):
+            tag_list.append((timetag.attrib['name'], timetag.text.split()))
+
+        structure = step.find('structure')
+        if structure is not None:
+            pos_varray = self._find_varray(structure, 'positions')
+            if pos_varray is not None:
+                for v in pos_varray.iter('v'):
+                    cpos.append(v.text.split())
+
+        force_varray = self._find_varray(step, 'forces')
+        if force_varray is not None:
+            for v in force_varray.iter('v'):
+                cforces.append(v.text.split())
+
+        return tag_list, cpos, cforces
+
+    def _iter_step_elements(self, max_steps=None, stride=1):
+        if stride < 1:
+            raise ValueError(f"stride must be >= 1, got {stride}")
+        if max_steps is not None and max_steps <= 0:
+            return
+
+        # 非流式模式下复用已经解析好的整棵树
+        if not self.stream:
+            steps = self.get_root().findall('calculation')[::stride]
+            if max_steps is not None:
+                steps = steps[:max_steps]
+            yield from steps
+            return
+
+        root = None
+        depth = 0
+        index = 0
+        yielded = 0
+        with open(self.path, 'rb') as fp:
+            for event, elem in ET.iterparse(fp, events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                # 根节点的直接子节点读完后立即从树上摘掉, 保证内存不随步数增长
+                if elem.tag == 'calculation':
+                    if index % stride == 0:
+                        yield elem
+                        yielded += 1
+                    index += 1
+                # 只从树上摘掉, 不 clear: 调用者如果还持有该步 (例如 project 缓冲
+                # 最后几步) 仍然可以读取, 不再引用后即被回收
+                root.remove(elem)
+                if max_steps is not None and yielded >= max_steps:
+                    return
+
+    def iter_calculation(self, max_steps=None, stride=1):
+        """
+        逐个离子步返回 (tag_list, positions, forces), 与 calculation() 的单步格式一致
+
+        Args:
+            max_steps (int): 最多返回的离子步数, None 表示不限制
+            stride (int): 每隔 stride 步取一步, 1 表示全部保留
+        """
+        if 'calculation' in self._sections:
+            # 已经整体构建过 (或从缓存读出) 时直接切片
+            if stride < 1:
+                raise ValueError(f"stride must be >= 1, got {stride}")
+            calc_res, calc_positions, calc_forces = self._sections['calculation']
+            yield from zip(calc_res[::stride][:max_steps],
+                           calc_positions[::stride][:max_steps],
+                           calc_forces[::stride][:max_steps])
+            return
+        for step in self._iter_step_elements(max_steps=max_steps, stride=stride):
+            yield self._parse_step(step)
+
+    def _parse_step_arrays(self, step):
+        arrays = {}
+        structure = step.find('structure')
+        if structure is not None:
+            crystal = structure.find('crystal')
+            if crystal is not None:
+                basis = self._find_varray(crystal, 'basis')
+                if basis is not None:
+                    arrays['lattice'] = _varray_to_array(basis)
+            positions = self._find_varray(structure, 'positions')
+            if positions is not None:
+                arrays['positions'] = _varray_to_array(positions)
+        forces = self._find_varray(step, 'forces')
+        if forces is not None:
+            arrays['forces'] = _varray_to_array(forces)
+        energy = step.find('energy')
+        if energy is not None:
+            for item in energy.findall('i'):
+                if item.attrib.get('name') == 'e_fr_energy':
+                    arrays['energy'] = float(item.text)
+        return arrays
+
+    def _step_summary(self, step):
+        summary = self._parse_step_arrays(step)
+        summary['nscsteps'] = len(step.findall('scstep'))
+        if 'forces' in summary:
+            summary['max_force'] = float(np.linalg.norm(summary['forces'], axis=1).max())
+        return summary
+
+    def iter_step_arrays(self, max_steps=None, stride=1):
+        """
+        逐个离子步返回数值形式的 dict, 包含 lattice/positions/forces/energy 中存在的项,
+        以及 nscsteps (电子步数) 和 max_force (最大原子受力)
+        """
+        for step in self._iter_step_elements(max_steps=max_steps, stride=stride):
+            yield self._step_summary(step)
+
+    def calculation_arrays(self, max_steps=None, stride=1):
+        """
+        离子步的数值形式, 每个量沿第一维按步堆叠成连续的 float64 数组
+
+        Args:
+            max_steps (int): 最多读取的离子步数, None 表示不限制
+            stride (int): 每隔 stride 步取一步
+
+        Returns:
+            dict: positions/forces 为 (nsteps, natoms, 3), lattices 为 (nsteps, 3, 3),
+                  energies 为 (nsteps,); 某一项在所有步中都缺失时不出现在结果里
+        """
+        if max_steps is None and stride == 1:
+            return self._section('calculation_arrays', self._build_calculation_arrays)
+        if 'calculation_arrays' in self._sections:
+            if stride < 1:
+                raise ValueError(f"stride must be >= 1, got {stride}")
+            return {key: value[::stride][:max_steps]
+                    for key, value in self._sections['calculation_arrays'].items()}
+        return self._build_calculation_arrays(max_steps=max_steps, stride=stride)
+
+    def _build_calculation_arrays(self, max_steps=None, stride=1):
+        collected = {'lattice': [], 'positions': [], 'forces': [], 'energy': []}
+        for step in self._iter_step_elements(max_steps=max_steps, stride=stride):
+            for name, value in self._parse_step_arrays(step).items():
+                collected[name].append(value)
+
+        result = {}
+        for name, key in (('positions', 'positions'), ('forces', 'forces'),
+                          ('lattice', 'lattices'), ('energy', 'energies')):
+            if collected[name]:
+                result[key] = np.ascontiguousarray(np.stack(collected[name]), dtype=np.float64)
+        return result
+
+    PROJECTION_FIELDS = ('energy', 'energies', 'max_force', 'forces', 'positions',
+                         'lattice', 'stress', 'nscsteps', 'properties')
+    _ARRAY_PROJECTION = {'energy': 'energies', 'forces': 'forces', 'positions': 'positions',
+                         'lattice': 'lattices', 'max_force': 'forces'}
+
+    def project(self, fields, steps=None, atoms=None, n_properties=None):
+        """
+        只解码调用者需要的字段、离子步和原子, 其余内容只被 XML 解析器扫过而不转换
+
+        Args:
+            fields (iterable): 需要的字段:
+                energy (e_fr_energy), energies (该步全部能量项), max_force (最大原子受力),
+                forces, positions, lattice, stress, nscsteps (电子步数),
+                properties (与 calculation() 相同的 (name, value) 列表)
+            steps: None 表示全部; 整数或整数列表, 可以为负 (-1 为最后一步);
+                   或 slice, 例如 slice(0, 100, 10), 以及表示最后 n 步的 slice(-n, None)
+            atoms: None 表示全部原子, 否则为整数列表或 slice, 只作用于 forces/positions
+            n_properties (int): properties 最多保留的条目数
+
+        Returns:
+            list: 按步序排列的 dict, 包含 step 以及请求的字段
+        """
+        fields = tuple(fields)
+        unknown = set(fields) - set(self.PROJECTION_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown projection fields: {sorted(unknown)}")
+
+        if self._cache is None:
+            return self._project(fields, steps, atoms, n_properties)
+        # 启用缓存时只保存投影出的字段, 以调用参数为键
+        key = json.dumps([fields, repr(steps), repr(atoms), n_properties])
+        cached = self._section('projected_steps', dict)
+        if key not in cached:
+            results = self._project(fields, steps, atoms, n_properties)
+            cached[key] = [{name: value.tolist() if isinstance(value, np.ndarray) else value
+                            for name, value in result.items()} for result in results]
+            self._cache_dirty = True
+            return results
+        return [{name: self._projected_value(name, value) for name, value in result.items()}
+                for result in cached[key]]
+
+    _PROJECTED_ARRAYS = ('forces', 'positions', 'lattice', 'stress')
+
+    def _projected_value(self, name, value):
+        if value is None:
+            return None
+        if name in self._PROJECTED_ARRAYS:
+            return np.array(value, dtype=np.float64)
+        if name == 'properties':
+            return [tuple(item) for item in value]
+        return value
+
+    def _project(self, fields, steps, atoms, n_properties):
+        selection = _StepSelection(steps)
+
+        # 数值数组已经构建过 (或从缓存读出) 时直接切片
+        arrays = self._sections.get('calculation_arrays')
+        if arrays is not None and all(self._ARRAY_PROJECTION.get(f) in arrays for f in fields):
+            return self._project_arrays(arrays, fields, selection, atoms)
+
+        results = []
+        buffer = deque(maxlen=selection.tail) if selection.tail else None
+        nsteps = 0
+        for index, step in enumerate(self._iter_step_elements()):
+            nsteps = index + 1
+            if selection.wanted(index):
+                results.append(self._project_step(step, index, fields, atoms, n_properties))
+            if buffer is not None:
+                buffer.append((index, step))
+            if selection.stop is not None and nsteps >= selection.stop:
+                break
+
+        if buffer:
+            done = {result['step'] for result in results}
+            tail_indices = set(selection.resolve(nsteps)) - done
+            for index, step in buffer:
+                if index in tail_indices:
+                    results.append(self._project_step(step, index, fields, atoms, n_properties))
+            results.sort(key=lambda result: result['step'])
+        return results
+
+    def _project_arrays(self, arrays, fields, selection, atoms):
+        nsteps = len(next(iter(arrays.values())))
+        atom_index = slice(None) if atoms is None else atoms
+        results = []
+        for index in selection.indices(nsteps):
+            result = {'step': index}
+            for field in fields:
+                if field == 'energy':
+                    result[field] = float(arrays['energies'][index])
+                elif field == 'max_force':
+                    result[field] = float(np.linalg.norm(arrays['forces'][index], axis=1).max())
+                elif field in ('forces', 'positions'):
+                    result[field] = np.array(arrays[field][index][atom_index])
+                else:
+                    result[field] = np.array(arrays['lattices'][index])
+            results.append(result)
+        return results
+
+    def _select_rows(self, varray, atoms):
+        if atoms is None:
+            return _varray_to_array(varray)
+        rows = list(varray)
+        rows = rows[atoms] if isinstance(atoms, slice) else [rows[i] for i in atoms]
+        return _varray_to_array(rows)
+
+    def _project_step(self, step, index, fields, atoms, n_properties):
+        result = {'step': index}
+        structure = step.find('structure')
+        forces = None
+        for field in fields:
+            if field in ('energy', 'energies'):
+                energy = step.find('energy')
+                values = {} if energy is None else {
+                    item.attrib.get('name'): float(item.text) for item in energy.findall('i')}
+                if field == 'energy':
+                    result[field] = values.get('e_fr_energy')
+                else:
+                    result[field] = values
+            elif field in ('forces', 'max_force'):
+                varray = self._find_varray(step, 'forces')
+                if varray is None:
+                    result[field] = None
+                elif field == 'forces':
+                    result[field] = self._select_rows(varray, atoms)
+                else:
+                    if forces is None:
+                        forces = _varray_to_array(varray)
+                    result[field] = float(np.linalg.norm(forces, axis=1).max())
+            elif field == 'positions':
+                varray = None if structure is None else self._find_varray(structure, 'positions')
+                result[field] = None if varray is None else self._select_rows(varray, atoms)
+            elif field == 'lattice':
+                crystal = None if structure is None else structure.find('crystal')
+                varray = None if crystal is None else self._find_varray(crystal, 'basis')
+                result[field] = None if varray is None else _varray_to_array(varray)
+            elif field == 'stress':
+                varray = self._find_varray(step, 'stress')
+                result[field] = None if varray is None else _varray_to_array(varray)
+            elif field == 'nscsteps':
+                result[field] = len(step.findall('scstep'))
+            elif field == 'properties':
+                result[field] = self._step_properties(step, n_properties)
+        return result
+
+    def _step_properties(self, step, limit):
+        tag_list = []
+        for itag in step.iter('i'):
+            if limit is not None and len(tag_list) >= limit:
+                return tag_list
+            tag_list.append((itag.attrib['name'], itag.text.strip()))
+        for timetag in step.iter('time'):
+            if limit is not None and len(tag_list) >= limit:
+                return tag_list
+            tag_list.append((timetag.attrib['name'], timetag.text.split()))
+        return tag_list
+
+    def _electronic_blocks(self):
+        # eigenvalues / dos / projected 四个块, 取文件中最后出现的一组;
+        # 结果为 {name: (fields, ndarray)} 以及 efermi
+        if self._electronic_raw is not None:
+            return self._electronic_raw
+        if self._root is not None and not self.stream:
+            raw = {'efermi': None}
+            for step in self.get_root().findall('calculation'):
+                for path, name in _ELECTRONIC_BLOCKS.items():
+                    array = step.find('/'.join(path[1:]))
+                    if array is None or array.find('set') is None:
+                        continue
+                    collector = _SetCollector()
+                    collector.feed_tree(array.find('set'))
+                    raw[name] = ([f.text.strip() for f in array.findall('field')], collector.result())
+                for item in step.findall('dos/i'):
+                    if item.attrib.get('name') == 'efermi':
+                        raw['efermi'] = float(item.text)
         else:
-            cstruct.append(("crystal", "Not found"))
+            raw = self._scan_electronic_blocks()
+        self._electronic_raw = raw
+        return raw
+
+    def _scan_electronic_blocks(self):
+        # 这几个块占了 vasprun.xml 的绝大部分, 不经过 XML 解析器,
+        # 直接在 mmap 上定位块的字节范围, 用正则一次取出全部 <r> 再整体转换
+        raw = {'efermi': None}
+        with open(self.path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return raw
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                projected = _last_block(mm, b'projected')
+                if projected is not None:
+                    # <projected> 里面还有一份 <eigenvalues>, 投影数组在它之后
+                    inner = mm.find(b'</eigenvalues>', *projected)
+                    start = projected[0] if inner < 0 else inner
+                    raw['projected'] = _decode_array_block(mm, start, projected[1])
+
+                eigen = _last_block(mm, b'eigenvalues')
+                if eigen is not None and projected is not None and projected[0] < eigen[0] < projected[1]:
+                    eigen = _last_block(mm, b'eigenvalues', projected[0])
+                if eigen is not None:
+                    raw['eigenvalues'] = _decode_array_block(mm, *eigen)
+
+                dos = _last_block(mm, b'dos')
+                if dos is not None:
+                    match = _EFERMI_PATTERN.search(mm, *dos)
+                    if match:
+                        raw['efermi'] = float(match.group(1))
+                    for tag, name in ((b'total', 'dos_total'), (b'partial', 'dos_partial')):
+                        block = _last_block(mm, tag, dos[1], dos[0])
+                        if block is not None:
+                            raw[name] = _decode_array_block(mm, *block)
+        return {name: value for name, value in raw.items() if value is not None}
 
-        for varray in atom_struct.findall('varray'):
-            vectors = [v.text.split() for v in varray.findall('v')]
-            cstruct.append((varray.attrib['name'], vectors))
+    def eigenvalues(self):
+        """
+        本征值与占据数
 
-        return cstruct
+        Returns:
+            dict: eigenvalues/occupations 均为 (nspin, nkpoints, nbands) float64;
+                  文件中没有 <eigenvalues> 时返回 None
+        """
+        def build():
+            block = self._electronic_blocks().get('eigenvalues')
+            if block is None:
+                return None
+            fields, data = block
+            return {
+                'eigenvalues': np.ascontiguousarray(data[..., 0]),
+                'occupations': np.ascontiguousarray(data[..., 1]),
+            }
+        return self._section('eigenvalues', build)
+
+    def dos(self):
+        """
+        总态密度
+
+        Returns:
+            dict: efermi, energies (nedos,), total/integrated (nspin, nedos);
+                  没有 <dos> 时返回 None
+        """
+        def build():
+            raw = self._electronic_blocks()
+            block = raw.get('dos_total')
+            if block is None:
+                return None
+            fields, data = block
+            return {
+                'efermi': raw.get('efermi'),
+                'energies': np.ascontiguousarray(data[0, :, 0]),
+                'total': np.ascontiguousarray(data[..., 1]),
+                'integrated': np.ascontiguousarray(data[..., 2]),
+            }
+        return self._section('dos', build)
+
+    def projected_dos(self):
+        """
+        分波态密度 (LORBIT 设置时才有)
+
+        Returns:
+            dict: efermi, energies (nedos,), orbitals (轨道名列表),
+                  pdos (nspin, nions, norbitals, nedos); 没有 <partial> 时返回 None
+        """
+        def build():
+            raw = self._electronic_blocks()
+            block = raw.get('dos_partial')
+            if block is None:
+                return None
+            fields, data = block
+            # 文件中的顺序为 (ion, spin, energy, [energy, 轨道...])
+            return {
+                'efermi': raw.get('efermi'),
+                'energies': np.ascontiguousarray(data[0, 0, :, 0]),
+                'orbitals': fields[1:],
+                'pdos': np.ascontiguousarray(data[..., 1:].transpose(1, 0, 3, 2)),
+            }
+        return self._section('projected_dos', build)
+
+    def projections(self):
+        """
+        本征态在各原子轨道上的投影 (LORBIT 设置时才有)
+
+        Returns:
+            dict: orbitals (轨道名列表), projections (nspin, nkpoints, nbands, nions, norbitals);
+                  没有 <projected> 时返回 None
+        """
+        def build():
+            block = self._electronic_blocks().get('projected')
+            if block is None:
+                return None
+            fields, data = block
+            return {
+                'orbitals': fields,
+                'projections': np.ascontiguousarray(data),
+            }
+        return self._section('projections', build)
+
+    def band_gap(self, occupation_cutoff=0.5):
+        """
+        由本征值和占据数计算带隙
+
+        Returns:
+            dict: band_gap, vbm, cbm (eV), direct (价带顶与导带底是否在同一自旋通道的同一 k 点),
+                  vbm_kpoint/cbm_kpoint; 没有本征值时返回 None
+        """
+        eig = self.eigenvalues()
+        if eig is None:
+            return None
+        energies = eig['eigenvalues']
+        occupied = eig['occupations'] > occupation_cutoff
+        if occupied.all() or not occupied.any():
+            return None
+        vbm_index = np.unravel_index(np.where(occupied, energies, -np.inf).argmax(), energies.shape)
+        cbm_index = np.unravel_index(np.where(occupied, np.inf, energies).argmin(), energies.shape)
+        vbm = float(energies[vbm_index])
+        cbm = float(energies[cbm_index])
+        return {
+            'band_gap': max(0.0, cbm - vbm),
+            'vbm': vbm,
+            'cbm': cbm,
+            # 下标为 (自旋, k 点, 能带), 自旋极化时不同自旋通道之间的跃迁不算直接带隙
+            'direct': bool(vbm_index[:2] == cbm_index[:2]),
+            'vbm_kpoint': int(vbm_index[1]),
+            'cbm_kpoint': int(cbm_index[1]),
+        }
 
     def calculation(self):
-        calc_res = []
-        calc_forces = []
-        calc_positions = []
-
-        all_steps = list(self.get_root())[6:]  # skip first 6 blocks (header info)
-
-        for step in all_steps:
-            tag_list = []
-            cpos = []
-            cforces = []
-
-            for itag in step.iter('i'):
-                tag_list.append((itag.attrib['name'], itag.text.strip()))
-            for timetag in step.iter('time'):
-                tag_list.append((timetag.attrib['name'], timetag.text.split()))
-
-            structure = step.find('structure')
-            if structure is not None:
-                varrays = structure.findall('varray')
-                if varrays:
-                    for v in varrays[0].iter('v'):
-                        cpos.append(v.text.split())
-
-            force_varray = step.findall('varray')
-            if force_varray:
-                for v in force_varray[0].iter('v'):
-                    cforces.append(v.text.split())
-
-            calc_res.append(tag_list)
-            calc_positions.append(cpos)
-            calc_forces.append(cforces)
-
-        return calc_res, calc_positions, calc_forces
+        def build():
+            calc_res = []
+            calc_forces = []
+            calc_positions = []
+
+            for tag_list, cpos, cforces in self.iter_calculation():
+                calc_res.append(tag_list)
+                calc_positions.append(cpos)
+                calc_forces.append(cforces)
+
+            return calc_res, calc_positions, calc_forces
+        return self._section('calculation', build)
     
+class VasprunTail(VasprunParser):
+    """
+    正在运行的计算的 vasprun.xml 增量读取器
+
+    记录已经读过的字节偏移, 每次 poll() 只把新追加的内容喂给 XMLPullParser,
+    返回这段时间内新完成的离子步。头部信息 (incar, parameters 等) 读完之后
+    可以像 VasprunParser 一样访问。
+
+    文件被重写 (重新提交计算) 时自动从头开始: 每次 poll() 先比较 inode、mtime 和
+    已读部分的开头 HEAD_SIZE 字节 (头部含有计算开始的日期和时间), 任一项不同、文件变小
+    或者新内容接在已结束的文档之后导致解析出错, 都会丢弃已读的内容重新解析。
+    """
+
+    HEAD_SIZE = 4096
+
+    def __init__(self, path, chunk_size=1 << 20):
+        super().__init__(path, stream=True)
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.nsteps = 0
+        self.finished = False
+        self.header_complete = False
+        self._root = None
+        self._sections = {}
+        self._electronic_raw = None
+        self._depth = 0
+        self._pull = ET.XMLPullParser(events=('start', 'end'))
+        self._inode = None
+        self._mtime_ns = None
+        self._head = b''
+
+    def get_root(self):
+        if self._root is None:
+            raise ValueError(f"No data has been read from {self.path} yet")
+        return self._root
+
+    def _section(self, name, builder):
+        # 头部没读完之前不缓存, 避免缓存到不完整的分区
+        if not self.header_complete:
+            return builder()
+        return super()._section(name, builder)
+
+    def poll(self):
+        """
+        读取上次调用之后追加的内容
+
+        Returns:
+            list: 新完成的离子步, 每步为 dict, 包含 step, nscsteps 以及
+                  lattice/positions/forces/energy/max_force 中存在的项
+        """
+        if not os.path.isfile(self.path):
+            return []
+        with open(self.path, 'rb') as fp:
+            if self._rewritten(fp):
+                self.reset()
+            try:
+                return self._read(fp)
+            except ET.ParseError:
+                if not self.offset:
+                    raise
+            # 已读的内容之后接上了另一个文档, 说明文件被重写过
+            self.reset()
+            return self._read(fp)
+
+    def _rewritten(self, fp):
+        if not self.offset:
+            return False
+        stat = os.fstat(fp.fileno())
+        if (stat.st_ino != self._inode or stat.st_size < self.offset
+                or stat.st_mtime_ns < self._mtime_ns):
+            return True
+        fp.seek(0)
+        return fp.read(len(self._head)) != self._head
+
+    def _read(self, fp):
+        stat = os.fstat(fp.fileno())
+        self._inode = stat.st_ino
+        self._mtime_ns = stat.st_mtime_ns
+        steps = []
+        fp.seek(self.offset)
+        while True:
+            chunk = fp.read(self.chunk_size)
+            if not chunk:
+                break
+            self._pull.feed(chunk)
+            steps.extend(self._drain())
+            if len(self._head) < self.HEAD_SIZE:
+                self._head += chunk[:self.HEAD_SIZE - len(self._head)]
+            self.offset += len(chunk)
+        return steps
+
+    def _drain(self):
+        steps = []
+        for event, elem in self._pull.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = elem
+                elif self._depth == 1 and elem.tag == 'calculation':
+                    self.header_complete = True
+                self._depth += 1
+                continue
+            self._depth -= 1
+            if self._depth == 0:
+                self.finished = True
+            if self._depth != 1 or elem.tag != 'calculation':
+                continue
+            step = self._step_summary(elem)
+            step['step'] = self.nsteps
+            steps.append(step)
+            self.nsteps += 1
+            self._root.remove(elem)
+        return steps
+
+
+class ChatResponseCache:
+    """
+    SimPleChat 的回答缓存, 保存在 SQLite 文件中
+
+    键由模型名、规范化后的 messages 和 response_format 计算得到。超过 ttl 秒的回答视为过期,
+    条目数超过 max_entries 时按最近使用时间淘汰。
+    """
+
+    DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "material-agent", "chat_cache.sqlite")
+
+    def __init__(self, path=None, ttl=7 * 24 * 3600, max_entries=2000):
+        self.path = path or os.environ.get("SIMPLECHAT_CACHE_PATH") or self.DEFAULT_PATH
+        self.ttl = ttl
+        self.max_entries = max_entries
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses ("
+                         "key TEXT PRIMARY KEY, answer TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def key(model, messages, response_format):
+        canonical = {
+            "model": model,
+            "messages": [{"role": str(m.get("role")), "content": str(m.get("content"))} for m in messages],
+            "response_format": response_format,
+        }
+        text = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT answer, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, answer):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, answer, created, accessed) VALUES (?, ?, ?, ?)",
+                         (key, answer, now, now))
+            if self.ttl is not None:
+                conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            conn.execute("DELETE FROM responses WHERE key NOT IN "
+                         "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)", (self.max_entries,))
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+
 class SimPleChat:
     
-    def __init__(self, system="你是一个在晶体结构领域的专家"):
+    def __init__(self, system="你是一个在晶体结构领域的专家", cache=None):
+        """
+        Args:
+            system (str): 系统提示词
+            cache: 回答缓存。None 表示使用默认的 ChatResponseCache (环境变量 SIMPLECHAT_CACHE=0 时不使用),
+                   False 表示不使用缓存, 也可以传入一个 ChatResponseCache 实例
+        """
         self.system =system
         self.refresh()
         
@@ -199,22 +1300,50 @@ class SimPleChat:
             api_key=key_dict.get("DEEP_SEEK_API_KEY"),
             base_url=key_dict.get("DEEP_SEEK_BASE_URL"),
         )
-        self.model = key_dict.get("DEEP_SEEK_MODEL_NAME","deepseek-chat")
+        self.model = key_dict.get("DEEP_SEEK_MODEL_NAME") or "deepseek-chat"
+
+        if cache is None:
+            cache = os.environ.get("SIMPLECHAT_CACHE", "1").lower() not in ("0", "false", "no", "off")
+        if cache is True:
+            cache = ChatResponseCache()
+        self.cache = cache or None
 
     def refresh(self):
         self.messages = [{"role": "system", "content": self.system}]
 
-    def _ask(self,msg):
+    def _ask(self,msg,validate=None):
+        """
+        Args:
+            msg: 完整的对话
+            validate: 检查回答的函数, 抛出异常表示回答不可用; 只有通过检查的回答才会写入缓存,
+                      缓存中不能通过检查的回答会被删除并重新请求
+        """
+        response_format = {"type": "text"}
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.model, msg, response_format)
+            answer = self.cache.get(key)
+            if answer is not None:
+                try:
+                    if validate is not None:
+                        validate(answer)
+                    return answer
+                except Exception:
+                    self.cache.delete(key)
         chat_completion = self.client.chat.completions.create(model=self.model,
                                                                 messages=msg,
-                                                                response_format = {"type": "text"})
+                                                                response_format = response_format)
         answer = chat_completion.choices[0].message.content
+        if validate is not None:
+            validate(answer)
+        if key is not None and answer is not None:
+            self.cache.put(key, answer)
         return answer
 
 
-    def Q(self,question):
+    def Q(self,question,validate=None):
         self.messages.append({"role": "user", "content": str(question)})
-        answer = self._ask(self.messages)
+        answer = self._ask(self.messages, validate)
         self.messages.append({"role": "assistant", "content": str(answer)})
         return answer
     
@@ -237,50 +1366,166 @@ def map_local_cif(material_id):
         raise FileNotFoundError(f"File {exact_path} not found.")
 
 
-def get_structure_mp_database(formula,space_group=None):
-    from pymatgen.ext.matproj import MPRester
-    API_KEY = "msZce01AjFltxEu97whgD2TBdQYwdxhQ"
+MP_API_ENDPOINT = "https://api.materialsproject.org"
+MP_API_KEY = "msZce01AjFltxEu97whgD2TBdQYwdxhQ"
+MP_FIELDS = ("material_id", "formula_pretty", "energy_above_hull", "structure")
+MP_PAGE_SIZE = 10
+MP_TIMEOUT = (5, 60)
+MP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "material-agent", "mp")
+
+_mp_cache_lock = threading.Lock()
+
+
+class MPSummaryCache:
+    """
+    Materials Project summary 查询结果的本地缓存, 每个化学式一个 JSON 文件
+
+    文件内容为 {"formula", "space_group", "docs", "complete"}: docs 是按 energy_above_hull 排序、
+    已经取回的文档, complete 表示该化学式的结果已经全部取回。指定空间群的查询由服务器筛选,
+    按 (化学式, 空间群) 分开缓存。offline 为 True 时只读缓存 (例如指向录制好的测试数据),
+    不访问网络。
+    """
+
+    def __init__(self, path=None, offline=False, api_key=None, endpoint=None, session=None):
+        self.path = path or os.environ.get("MP_CACHE_DIR") or MP_CACHE_DIR
+        self.offline = offline
+        self.api_key = api_key or os.environ.get("MP_API_KEY") or MP_API_KEY
+        self.endpoint = (endpoint or os.environ.get("MP_API_ENDPOINT") or MP_API_ENDPOINT).rstrip("/")
+        self.session = session
+
+    def filename(self, formula, space_group=None):
+        name = formula if space_group is None else f"{formula}@{space_group}"
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:16]
+        safe = re.sub(r"[^A-Za-z0-9()._-]", "_", name)
+        return os.path.join(self.path, f"{safe}-{digest}.json")
+
+    def load(self, formula, space_group=None):
+        try:
+            with open(self.filename(formula, space_group), "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {"formula": formula, "space_group": space_group, "docs": [], "complete": False}
+
+    def save(self, record):
+        filename = self.filename(record["formula"], record.get("space_group"))
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump(record, fp)
+        os.replace(tmp, filename)
+
+    def fetch(self, formula, skip, limit, space_group=None):
+        if self.session is None:
+            self.session = requests.Session()
+        params = {
+            "formula": formula,
+            "_fields": ",".join(MP_FIELDS),
+            "_sort_fields": "energy_above_hull",
+            "_skip": skip,
+            "_limit": limit,
+        }
+        if isinstance(space_group, str):
+            params["spacegroup_symbol"] = space_group
+        elif space_group is not None:
+            params["spacegroup_number"] = int(space_group)
+        response = self.session.get(
+            f"{self.endpoint}/materials/summary/",
+            params=params,
+            headers={"X-API-KEY": self.api_key, "accept": "application/json"},
+            timeout=MP_TIMEOUT,
+        )
+        if response.status_code != 200:
+            raise Exception(f"Request failed with status code {response.status_code}")
+        return response.json().get("data", [])
+
+    def iter_docs(self, formula, page_size=MP_PAGE_SIZE, space_group=None):
+        """
+        按 energy_above_hull 从低到高逐个给出文档, 先读缓存, 不够时再按页请求; 调用方停止迭代后不再请求
+
+        space_group 为空间群符号 (str) 或空间群号 (int) 时只请求该空间群的结构
+        """
+        record = self.load(formula, space_group)
+        position = 0
+        while True:
+            while position < len(record["docs"]):
+                yield record["docs"][position]
+                position += 1
+            if record["complete"]:
+                return
+            if self.offline:
+                if not os.path.isfile(self.filename(formula, space_group)):
+                    raise FileNotFoundError(f"No cached Materials Project data for {formula} in {self.path}")
+                return
+            page = self.fetch(formula, len(record["docs"]), page_size, space_group)
+            with _mp_cache_lock:
+                record["docs"].extend(page)
+                record["complete"] = len(page) < page_size
+                self.save(record)
+
 
-    # 下载结构并保存为 POSCAR 和 CIF 文件
-    with MPRester(API_KEY) as mpr:
-        results = mpr.get_entries(formula, sort_by_e_above_hull=True)
+def get_structure_mp_database(formula,space_group=None,limit=3,cache=None):
+    """
+    从 Materials Project 查询化学式对应的晶体结构, 按 energy_above_hull 排序, 最多返回 limit 个
+
+    只请求 material_id/formula/energy_above_hull/structure 字段, 空间群由服务器筛选,
+    分页获取并在得到足够的结果后停止; 结果缓存在 MP_CACHE_DIR 下。环境变量 MP_OFFLINE=1 时只使用缓存 (录制的测试数据)。
+    """
+    if cache is None:
+        cache = MPSummaryCache(offline=os.environ.get("MP_OFFLINE", "0").lower() in ("1", "true", "yes", "on"))
 
     res_data = []
-    for n,entry in enumerate(results):
+    for doc in cache.iter_docs(formula, space_group=space_group or None):
         res = {}
-        
-        entry_id = entry.entry_id  # e.g., "mp-22474"
 
         # 获取结构信息
-        structure = entry.structure
-        
-        res["formula"] =  entry.composition.formula
-        res["material_id"] =  entry.data.get("material_id","")
-        res["entry_id"] =  entry_id
+        structure = Structure.from_dict(doc["structure"])
+
+        res["formula"] =  structure.composition.formula
+        res["material_id"] =  doc.get("material_id","")
+        res["entry_id"] =  doc.get("material_id","")  # e.g., "mp-22474"
         res["structure"] = structure
-        
-        if space_group:
-            sg,sgn = structure.get_space_group_info()
-            if isinstance(space_group, str) and space_group == sg:
-                res_data.append(res)
-            elif isinstance(space_group, int) and space_group == sgn:
-                res_data.append(res)
-        else:
-            res_data.append(res)
-                
-        if len(res_data) >= 3:
+        res_data.append(res)
+
+        if len(res_data) >= limit:
             break
         
     return res_data
     
 
-def get_structure_dp_database(formula,space_group=None):
-    
-    url = "https://materials-db-agent.mlops.dp.tech/query/openai"
-    headers = {
-        "accept": "application/json",
-        "Content-Type": "application/json"
-    }
+DP_DATABASE_URL = "https://materials-db-agent.mlops.dp.tech/query/openai"
+# (连接超时, 读取超时), 单位秒
+DP_DATABASE_TIMEOUT = (5, 60)
+DP_DATABASE_WORKERS = 8
+
+_dp_session = None
+_dp_session_lock = threading.Lock()
+
+
+def _get_dp_session():
+    """
+    进程内共用的 requests.Session, 连接池大小与并发数一致, 保持长连接
+    """
+    global _dp_session
+    with _dp_session_lock:
+        if _dp_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=DP_DATABASE_WORKERS,
+                                                    pool_maxsize=DP_DATABASE_WORKERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"accept": "application/json", "Content-Type": "application/json"})
+            _dp_session = session
+        return _dp_session
+
+
+def get_structure_dp_database(formula,space_group=None,session=None,timeout=DP_DATABASE_TIMEOUT):
+    """
+    通过结构数据库查询化学式对应的晶体结构, 结构从 MP_ROOT_DIR 下的本地 CIF 读取
+
+    查询地址可以用环境变量 DP_DATABASE_URL 覆盖 (例如指向本地的测试服务)。
+    """
+    url = os.environ.get("DP_DATABASE_URL") or DP_DATABASE_URL
+    session = session or _get_dp_session()
     if space_group:
         text = f"请给出空间群号为 {space_group} ,化学式为 {formula} ,的晶体结构。"
     else:
@@ -291,14 +1536,11 @@ def get_structure_dp_database(formula,space_group=None):
         "limit": 3        # You can adjust the limit as needed
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = session.post(url, json=payload, timeout=timeout)
 
     if response.status_code == 200:
         data = response.json()  # Get the JSON response data
-        # print("Response data:", data)
     else:
-        # print(f"Request failed with status code {response.status_code}")
-        # print("Response:", response.text)
         raise Exception(f"Request failed with status code {response.status_code}")
     
     data = data.get("data", [])
@@ -320,6 +1562,36 @@ def get_structure_dp_database(formula,space_group=None):
 
     return res_data
 
+
+def get_structures_dp_database(formulas,space_group=None,max_workers=DP_DATABASE_WORKERS,timeout=DP_DATABASE_TIMEOUT):
+    """
+    并发查询多个化学式, 总耗时约为一次查询的耗时
+
+    Args:
+        formulas: 化学式列表
+        space_group: 空间群, 对所有化学式相同
+        max_workers (int): 同时进行的查询数
+        timeout: 每次请求的超时, 同 requests 的 timeout 参数
+
+    Returns:
+        dict: {化学式: 查询结果列表}, 顺序与 formulas 一致。查询失败的化学式给出警告, 结果为空列表
+    """
+    formulas = list(dict.fromkeys(formulas))
+    if not formulas:
+        return {}
+    session = _get_dp_session()
+
+    def query(formula):
+        try:
+            return get_structure_dp_database(formula, space_group=space_group, session=session, timeout=timeout)
+        except Exception as e:
+            warnings.warn(f"Warning: structure query for {formula} failed: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(formulas)))) as pool:
+        results = list(pool.map(query, formulas))
+    return dict(zip(formulas, results))
+
 def rep_string(string):
     if "```json" in string:
         json_pattern = r"```json(.*?)```"
@@ -338,7 +1610,7 @@ def rep_string(string):
 def check_structure(structure,space_group=None):
     # score = []
     if space_group:
-        sg,sgn = structure.get_space_group_info()
+        sg,sgn = get_space_group_info(structure)
         if isinstance(space_group, str) and space_group == sg:
             return True
         elif isinstance(space_group, int) and space_group == sgn:
@@ -412,7 +1684,8 @@ def search_poscar_template_tool(formula: str):
     res = ba.Q(prompt3)
     # print(res)
     prompt4 = "重新上述过程,检查两次结果一致性,只返回可以直接被json解析的结果字典,不要任何其他解释性信息。"
-    res  = ba.Q(prompt4)
+    # 解析失败的回答不写入缓存, 重试时会重新请求
+    res  = ba.Q(prompt4, validate=lambda answer: json.loads(rep_string(answer)))
     res = rep_string(res)
     res = json.loads(res)
     
@@ -423,79 +1696,62 @@ def search_poscar_template_tool(formula: str):
     
     msgs = []
 
+    # 优先使用 MP_ROOT_DIR 下的本地结构索引, 其余的模板化学式一次并发查询远程数据库
+    from structure_index import get_structure_local_index
+    queried = {}
+    for k in ri:
+        local = get_structure_local_index(k, space_group=None)
+        if local:
+            queried[k] = local
+    queried.update(get_structures_dp_database([k for k in ri if k not in queried], space_group=None))
+
     for k,v in ri.items():
         formula = k # 化学式
         v = int(v) # 超胞大小
-        sup = {1:(1,1,1),2:(2,1,1),3:(3,1,1),4:(2,2,1),5:(5,1,1),6:(2,3,1),
-                7:(7,1,1),8:(2,2,2),9:(3,3,1),10:(5,2,1),11:(11,1,1),12:(3,2,2),}
-        msg = get_structure_dp_database(formula,space_group=None)
+        msg = queried.get(formula, [])
         
         if len(msg) == 0:
             pass
         else:
             for mi in msg:
                 structure:Structure = mi.get("structure")
+                supercell = supercell_matrix(v, structure.lattice)
                 structure2 = structure.copy()
-                structure2 = structure2.make_supercell(sup.get(v))
+                structure2.make_supercell(supercell)
                 mi["structure"] = structure2
-                mi["space_group"] = structure2.get_space_group_info()
+                mi["space_group"] = get_space_group_info(structure2)
                 
                 if v==1:
                     pass
                 else:
+                    # 混合占位的位点 {模板结构中的元素: {元素: 个数}}, 取对称性不等价构型中的第一个
+                    occupancy = {}
                     for bk,bv in base.items():
-                        if len(bv)==2:
-                            bv.pop("all",None)
+                        counts = {name:number for name,number in bv.items() if name != "all"}
+                        if len(counts) < 2:
+                            continue
+                        for name,number in counts.items():
+                            if isinstance(number, float):
+                                warnings.warn(f"Warning: Can't deal with float ratios {bv}, the result could be wrong.")
+                        hosts = [name for name in counts if name in structure2.symbol_set]
+                        if len(hosts) == 1:
+                            occupancy[hosts[0]] = {name:int(number) for name,number in counts.items()}
+                    if occupancy:
+                        try:
+                            structure2 = next(iter(SubstitutionEnumerator(structure, occupancy, supercell=supercell)))
+                        except (ValueError, StopIteration):
                             pass
-                        else:
-                            bv.pop("all",None)
-                            names = list(bv.keys())
-                            namess = []
-                            for name,number in bv.items():
-                                if isinstance(number, float):
-                                    warnings.warn(f"Warning: Can't deal with float ratios {bv}, the result could be wrong.")
-
-                                namess.extend([name]*int(number))
-                                
-                            names_all = structure2.symbol_set
-                            
-                            indexes = [i for i, name in enumerate(names_all) if name in names]
-                            
-                            if len(indexes) != len(namess):
-                                pass
-                            else:
-                                for i in range(len(indexes)):
-                                    structure2.replace(indexes[i], namess[i])
                 
                 if len(adsorb) != 0:
-                    prompt5 = "吸附/掺杂元素种类及个数信息为："
-                    prompt5 += str(adsorb)
-                    prompt5 += f"请根据已有基底结构{structure2}, 估计合理的每个吸附/掺杂物原子的分数x,y,z坐标信息，各原子之间键长合理。"
-                    prompt5 += """例如 {"O":2,"H":1} 的返回格式如:
-                    {
-                    "O": [[0.5, 0.22, 0.48], [0.5, 0.23, 0.5]], 
-                    "H": [[0.5, 0.23, 0.52]]
-                    }
-                    """
-                    prompt5 += "注意：只返回吸附/掺杂位点的结果字典,不要任何其他解释性信息。"
-                    res = ba.Q(prompt5)
-                    # print(res)
-                    res = rep_string(res)
-                    res = json.loads(res)
-                    
+                    # 吸附/掺杂原子放在几何方法找到的位点上: 表面结构为 hollow/bridge/top 位, 体相为间隙位
                     res_add = {}
-                    for resk,resv in res.items():
-                        check = Element.is_valid_symbol(resk)
-                            
-                        if check and isinstance(resv, list):
-                            for resvi in resv:
-                                res_add[resk] = resvi
-                else:
-                    res_add = {}
-                
-                if len(res_add)>0:
-                    for res_kk,res_vv in res_add.items():
-                        structure2=structure2.append(res_kk,res_vv)
+                    for resk,resv in adsorb.items():
+                        if Element.is_valid_symbol(resk) and isinstance(resv, (int, float)):
+                            if isinstance(resv, float) and not resv.is_integer():
+                                warnings.warn(f"Warning: Can't deal with float ratios {adsorb}, the result could be wrong.")
+                            res_add[resk] = int(round(resv))
+                    if len(res_add)>0:
+                        structure2 = place_species(structure2, res_add)
                         
                 mi["adsorb"] = adsorb
                 mi["base"] = base
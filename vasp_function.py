@@ -1,4 +1,5 @@
-import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import re
 import os
 import json
@@ -10,31 +11,42 @@ from pymatgen.io.vasp.inputs import Poscar
 import openai
 from PyPDF2 import PdfReader
 from utils import *
+from VASPTemplates.library import api as vt_api
+from VASPTemplates.library import sinks as vt_sinks
 
 
-def generate_vasp_config(calcdir: str):
+def generate_vasp_config(calcdir: str, vt_config: str = None, incar: dict = None) -> str:
     """
-    Generate VASP input configuration files using an external script.
+    Generate VASP input configuration files from a VASPTemplates template.
 
-    This function calls the external Python script "VASPTemplates/vt.py"
-    with the input file "test.vt" and the calculation directory `calcdir`.
+    The template is expanded in-process with VASPTemplates.library.api, so no
+    interpreter is started and errors in the template are raised to the caller.
+    Files whose content did not change (ignoring the generation date in the INCAR
+    header) are left untouched, so their modification times stay the same.
 
     Args:
         calcdir (str): Path to the calculation directory where VASP inputs will be created.
+        vt_config (str, optional): Template text. Defaults to None, which reads "test.vt".
+        incar (dict, optional): INCAR tags overriding the ones in the template.
+
+    Returns:
+        str: The calculation directory the files were written to.
 
     Example:
-        generate_vasp_config("tmp/my_calc")
+        generate_vasp_config("tmp/my_calc", vt_text, incar={"ENCUT": 600})
     """
-    subprocess.run(["python", "VASPTemplates/vt.py", "test.vt", calcdir])
+    if vt_config is None:
+        with open("test.vt") as f:
+            vt_config = f.read()
+    return vt_api.generate(vt_config, calcdir, incar=incar, incremental=True)
 
 
 def write_vasp_config(vt_config: str, calcdir: str) -> str:
     """
     Extract and write VASP input configuration from a structured vt_config string.
 
-    This function parses the config content after the '---XX.VT---' tag,
-    writes it to "test.vt", and uses the external script to generate
-    VASP input files in a temporary subdirectory.
+    This function parses the config content after the '---XX.VT---' tag
+    and generates the VASP input files in a temporary subdirectory.
 
     Args:
         vt_config (str): Configuration content that includes a section marked with '---XX.VT---'.
@@ -65,22 +77,18 @@ def write_vasp_config(vt_config: str, calcdir: str) -> str:
     else:
         return "Failed to find xx.vt configuration content in the provided string."
 
-    # Clean and write configuration lines to "test.vt"
+    # Clean configuration lines
     lines = vt_content.split("\n")
     cleaned_lines = [line.strip() for line in lines if line.strip()]
     vt_config_cleaned = "\n".join(cleaned_lines)
 
-    with open("test.vt", "w") as f:
-        f.write(vt_config_cleaned)
-
     # Prepare temporary calculation directory
     os.makedirs("tmp", exist_ok=True)
     calcdir_path = os.path.join("tmp", calcdir)
 
-    # Generate VASP input files
-    generate_vasp_config(calcdir_path)
-
     try:
+        # Generate VASP input files
+        calcdir_path = generate_vasp_config(calcdir_path, vt_config_cleaned)
         status = check_vasp_input(calcdir_path)
         if not status["success"]:
             return "vasp input files generation failed"
@@ -90,6 +98,61 @@ def write_vasp_config(vt_config: str, calcdir: str) -> str:
     return f"VASP input files generated successfully. calcdir: {calcdir_path}"
 
 
+def sweep_vasp_config(vt_config: str, grid: str, calcdir: str, workers: int = None, archive: str = None) -> str:
+    """
+    Generate one calculation directory per point of a parameter grid from a single VT template.
+
+    The grid is the Cartesian product of all listed values. Keys are INCAR tags (e.g. "ENCUT"),
+    VT parameters prefixed with "%" (e.g. "%POT-Fe"), "KPOINTS" (complete KPOINTS blocks) or
+    "POSCAR" (paths to POSCAR files). Directories are written concurrently under
+    "tmp/<calcdir>/" together with a manifest.json listing every point.
+
+    Args:
+        vt_config (str): Template content, optionally after a '---XX.VT---' tag.
+        grid (str): JSON object mapping each key to a list of values.
+        calcdir (str): Name of the folder under "tmp/" that receives all generated directories.
+        workers (int, optional): Number of worker threads. Defaults to None (automatic).
+        archive (str, optional): Write all directories and the manifest into this .tar or
+            .tar.gz file (e.g. for upload) instead of "tmp/". Defaults to None.
+
+    Returns:
+        str: Summary with the number of generated directories, failures and the manifest path.
+
+    Example:
+        sweep_vasp_config(vt_data, '{"ENCUT": [400, 500, 600], "%POT-Fe": ["Fe", "Fe_pv"]}', "encut_test")
+    """
+    vt_match = re.search(r"---XX\.VT---\s*(.*)", vt_config, re.DOTALL)
+    vt_content = vt_match.group(1) if vt_match else vt_config
+    vt_content = "\n".join(line.strip() for line in vt_content.split("\n") if line.strip())
+
+    try:
+        grid = json.loads(grid) if isinstance(grid, str) else grid
+    except json.JSONDecodeError as e:
+        return f"Failed to parse the parameter grid as JSON: {e}"
+    if not isinstance(grid, dict) or not all(isinstance(v, list) and v for v in grid.values()):
+        return "The parameter grid must be a JSON object mapping each key to a non-empty list of values."
+    missing = [path for key, values in grid.items() if key.upper() == "POSCAR"
+               for path in values if "\n" not in str(path) and not os.path.isfile(path)]
+    if missing:
+        return f"POSCAR file(s) not found: {', '.join(map(str, missing))}"
+
+    basedir = os.path.join("tmp", calcdir)
+    if archive:
+        # Paths inside the archive start at <calcdir>/
+        with vt_sinks.TarSink(archive) as sink:
+            result = vt_api.sweep(vt_content, grid, calcdir, workers=workers, sink=sink)
+        location = f"in {archive}"
+    else:
+        result = vt_api.sweep(vt_content, grid, basedir, workers=workers, incremental=True)
+        location = f"under {basedir}"
+    failed = [p for p in result["points"] if "error" in p]
+    message = (f"Generated {len(result['points']) - len(failed)} of {len(result['points'])} calculation "
+               f"directories {location}, manifest: {os.path.join(result['basedir'], 'manifest.json')}")
+    if failed:
+        message += f". First failure in {failed[0]['calcdir']}: {failed[0]['error']}"
+    return message
+
+
 def read_vasp_pdf(pdf_path: str) -> str:
     """
     Read and extract text from a VASP-generated PDF file.
@@ -125,12 +188,113 @@ def read_vasp_pdf(pdf_path: str) -> str:
     return pdf_text
 
 
-def analyze_vasprun_all() -> list:
+# workers 未指定时, 只有待解析的 vasprun.xml 足够多或足够大才启动进程池,
+# 小文件的解析比启动进程 (spawn 时还要重新导入 utils/pymatgen) 快
+PARALLEL_MIN_DIRS = 16
+PARALLEL_MIN_BYTES = 64 << 20
+
+
+def _analyze_vasprun_dir(path: str, max_steps: int = None, stride: int = 1, use_cache: bool = True) -> dict:
+    """
+    Parse the vasprun.xml of one calculation directory for analyze_vasprun_all.
+
+    Kept at module level so it can be sent to worker processes.
+    """
+    xml_path = os.path.join(path, "vasprun.xml")
+
+    parser = VasprunParser(xml_path, stream=True, cache=use_cache)
+    result = {}
+
+    try:
+        result["generator"] = parser.generator()
+    except Exception as e:
+        result["generator"] = f"Failed to parse generator info: {e}"
+
+    try:
+        result["incar"] = parser.incar()
+    except Exception as e:
+        result["incar"] = f"Failed to parse INCAR: {e}"
+
+    try:
+        result["kpoints_grid"] = parser.monkhorst_pack()
+    except Exception as e:
+        result["kpoints_grid"] = f"Failed to parse K-points grid: {e}"
+
+    try:
+        result["kpoints_list"] = parser.kpoints_list()
+    except Exception as e:
+        result["kpoints_list"] = f"Failed to parse K-points list: {e}"
+
+    try:
+        weights = parser.kpoints_weight()
+        result["kpoints_weight"] = weights if weights else "No weight info (likely Gamma or auto K-points)"
+    except Exception as e:
+        result["kpoints_weight"] = f"Failed to parse K-points weight: {e}"
+
+    try:
+        result["parameters"] = parser.parameters()
+    except Exception as e:
+        result["parameters"] = f"Failed to parse parameters: {e}"
+
+    try:
+        result["atoms_info"] = parser.atoms_info()
+    except Exception as e:
+        result["atoms_info"] = f"Failed to parse atom info: {e}"
+
+    try:
+        result["structure"] = parser.structure()
+    except Exception as e:
+        result["structure"] = f"Failed to parse structure: {e}"
+
+    try:
+        stop = None if max_steps is None else max_steps * stride
+        steps = parser.project(
+            ("energy", "max_force", "positions", "forces"),
+            steps=slice(0, stop, stride),
+            atoms=slice(0, 2),          # Show only the first 2 atoms
+        )
+        calc_summary = []
+        for step in steps:
+            calc_summary.append({
+                "step": step["step"],
+                "energy": step["energy"],
+                "max_force": step["max_force"],
+                "first_2_positions": step["positions"].tolist(),
+                "first_2_forces": step["forces"].tolist()
+            })
+        result["calculation_steps"] = calc_summary
+    except Exception as e:
+        result["calculation_steps"] = f"Failed to parse calculation steps: {e}"
+
+    parser.save_cache()
+    return result
+
+
+def analyze_vasprun_all(max_steps: int = None, stride: int = 1, use_cache: bool = True,
+                        workers: int = None) -> list:
     """
-    Analyze all VASP calculation results in the server/tmp directory.
+    Analyze all VASP calculation results in the server/*/tmp directories.
 
-    For each subdirectory under "server/tmp", the function attempts to locate a
+    For each subdirectory under "server/<result folder>/tmp", the function attempts to locate a
     "vasprun.xml" file and parse various pieces of information using VasprunParser.
+    Directories are parsed in parallel and results are returned sorted by result folder
+    and directory name.
+    Ionic steps are streamed one at a time, so long MD or relaxation runs do not
+    have to be loaded into memory at once. For each step only the energy, the
+    maximum force and the positions and forces of the first two atoms are decoded.
+
+    Args:
+        max_steps (int, optional): Stop after this many ionic steps have been summarized.
+            Defaults to None (all steps).
+        stride (int, optional): Keep only every `stride`-th ionic step. Defaults to 1.
+        use_cache (bool, optional): Reuse parsed results stored next to each vasprun.xml
+            (vasprun.xml.cache.h5) and store new ones. Stale entries are discarded when
+            the file changes. Defaults to True.
+        workers (int, optional): Number of worker processes used to parse the calculation
+            directories in parallel; 1 parses them one after another in the calling process.
+            Defaults to None, which parses serially unless there are at least
+            PARALLEL_MIN_DIRS directories or PARALLEL_MIN_BYTES of vasprun.xml in total,
+            and then uses one process per CPU (at most one per directory).
 
     Returns:
         list: A list of dictionaries, each representing parsed results from one VASP run.
@@ -142,89 +306,207 @@ def analyze_vasprun_all() -> list:
     """
     
     base_path = "server/"
-    folders = [f for f in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, f))]
+    folders = sorted(f for f in os.listdir(base_path) if os.path.isdir(os.path.join(base_path, f)))
     if not folders:
         return f"No calculation results found, please check if the calculation is finished or you have submitted the calculation"
-    out_path = os.path.join(base_path, folders[0])
-    
-    out_path = os.path.join(out_path, "tmp")
-    try:
-        experiment_path = os.listdir(out_path)
-    except Exception as e:
-        return f"Failed to analyze VASP calculation results: {e}, please check if the calculation is finished or you have submitted the calculation"
-    
-    if not experiment_path:
+
+    paths = []
+    errors = []
+    for folder in folders:
+        out_path = os.path.join(base_path, folder, "tmp")
+        try:
+            experiment_path = os.listdir(out_path)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        paths.extend(os.path.join(out_path, path) for path in sorted(experiment_path))
+
+    if not paths:
+        if errors:
+            return f"Failed to analyze VASP calculation results: {'; '.join(errors)}, please check if the calculation is finished or you have submitted the calculation"
         return f"No calculation results found, please check if the calculation is finished or you have submitted the calculation"
-    
-    result_list = []
 
-    for path in experiment_path:
-        path = os.path.join(out_path, path)
-        if not os.path.exists(path):
-            return f"Calculation directory {path} does not exist, Please check if the calculation is finished or you have submitted the calculation"
-        xml_path = os.path.join(path, "vasprun.xml")
+    if workers is None:
+        workers = 1
+        if len(paths) >= PARALLEL_MIN_DIRS or _total_vasprun_size(paths) >= PARALLEL_MIN_BYTES:
+            workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(paths)))
 
-        parser = VasprunParser(xml_path)
-        result = {}
+    args = (repeat(max_steps), repeat(stride), repeat(use_cache))
+    if workers == 1:
+        result_list = list(map(_analyze_vasprun_dir, paths, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            result_list = list(executor.map(_analyze_vasprun_dir, paths, *args))
 
-        try:
-            result["generator"] = parser.generator()
-        except Exception as e:
-            result["generator"] = f"Failed to parse generator info: {e}"
+    return result_list
 
-        try:
-            result["incar"] = parser.incar()
-        except Exception as e:
-            result["incar"] = f"Failed to parse INCAR: {e}"
 
+def _total_vasprun_size(paths):
+    total = 0
+    for path in paths:
         try:
-            result["kpoints_grid"] = parser.monkhorst_pack()
-        except Exception as e:
-            result["kpoints_grid"] = f"Failed to parse K-points grid: {e}"
+            total += os.path.getsize(os.path.join(path, "vasprun.xml"))
+        except OSError:
+            pass
+    return total
 
-        try:
-            result["kpoints_list"] = parser.kpoints_list()
-        except Exception as e:
-            result["kpoints_list"] = f"Failed to parse K-points list: {e}"
 
-        try:
-            weights = parser.kpoints_weight()
-            result["kpoints_weight"] = weights if weights else "No weight info (likely Gamma or auto K-points)"
-        except Exception as e:
-            result["kpoints_weight"] = f"Failed to parse K-points weight: {e}"
+def analyze_band_structure(calcdir: str) -> dict:
+    """
+    Summarize the electronic structure stored in the vasprun.xml of a calculation.
 
-        try:
-            result["parameters"] = parser.parameters()
-        except Exception as e:
-            result["parameters"] = f"Failed to parse parameters: {e}"
+    The eigenvalue, DOS and projected blocks are decoded in bulk, so this also works
+    for large cells with LORBIT set.
 
-        try:
-            result["atoms_info"] = parser.atoms_info()
-        except Exception as e:
-            result["atoms_info"] = f"Failed to parse atom info: {e}"
+    Args:
+        calcdir (str): Path to the calculation directory, or a subpath under 'tmp/'.
 
-        try:
-            result["structure"] = parser.structure()
-        except Exception as e:
-            result["structure"] = f"Failed to parse structure: {e}"
+    Returns:
+        dict: Fermi energy, band gap (eV) with VBM/CBM and whether it is direct,
+              the numbers of spins, k-points and bands, and the orbitals available
+              in the projected DOS.
 
-        try:
-            calc_res, calc_pos, calc_forces = parser.calculation()
-            calc_summary = []
-            for step_id, (r, p, f) in enumerate(zip(calc_res, calc_pos, calc_forces)):
-                calc_summary.append({
-                    "step": step_id,
-                    "properties": r[:3],            # Show only first 3 properties
-                    "first_2_positions": p[:2],     # Show only first 2 atoms
-                    "first_2_forces": f[:2]         # Show only first 2 force vectors
-                })
-            result["calculation_steps"] = calc_summary
-        except Exception as e:
-            result["calculation_steps"] = f"Failed to parse calculation steps: {e}"
+    Example:
+        bands = analyze_band_structure("server/job/tmp/my_calc")
+        print(bands["band_gap"])
+    """
+    if not os.path.exists(calcdir):
+        calcdir = os.path.join("tmp", calcdir)
+        if not os.path.exists(calcdir):
+            return {"error": "Calculation directory does not exist."}
 
-        result_list.append(result)
+    xml_path = os.path.join(calcdir, "vasprun.xml")
+    if not os.path.isfile(xml_path):
+        return {"error": f"vasprun.xml not found in {calcdir}"}
 
-    return result_list
+    parser = VasprunParser(xml_path, stream=True, cache=True)
+    try:
+        eigen = parser.eigenvalues()
+        if eigen is None:
+            return {"error": f"No eigenvalues found in {xml_path}, the calculation may not be finished."}
+        dos = parser.dos()
+        pdos = parser.projected_dos()
+        result = {
+            "calcdir": calcdir,
+            "efermi": dos["efermi"] if dos else None,
+            "nspin": eigen["eigenvalues"].shape[0],
+            "nkpoints": eigen["eigenvalues"].shape[1],
+            "nbands": eigen["eigenvalues"].shape[2],
+            "projected_orbitals": pdos["orbitals"] if pdos else [],
+        }
+        gap = parser.band_gap()
+        if gap is None:
+            result["band_gap"] = "Could not determine a band gap from the occupations"
+        else:
+            result.update(gap)
+    except Exception as e:
+        return {"error": f"Failed to analyze band structure: {e}"}
+    finally:
+        parser.save_cache()
+    return result
+
+
+def query_vasp_runs(elements: str = "", converged: bool = None, incar_filters: str = "",
+                    exact: bool = False) -> list:
+    """
+    Query the catalog of finished VASP calculations under the server/ directory.
+
+    The catalog is updated incrementally before each query: only vasprun.xml files
+    that are new or have changed since the last call are parsed again.
+
+    Args:
+        elements (str, optional): Elements that must be present, separated by '-', e.g. "Sr-Ca-Fe-O".
+        converged (bool, optional): True for converged runs only, False for unconverged
+            runs only. Defaults to None (both).
+        incar_filters (str, optional): Comma separated INCAR conditions using one of
+            ==, !=, >=, <=, >, < or =, e.g. "ENCUT>=520,ISPIN=2".
+        exact (bool, optional): Require the chemical system to be exactly `elements`.
+
+    Returns:
+        list: One dictionary per matching run with its path, formula, INCAR tags,
+              final energy, max force, number of ionic steps and convergence status.
+
+    Example:
+        runs = query_vasp_runs("Sr-Ca-Fe-O", converged=True, incar_filters="ENCUT>=520")
+    """
+    from catalog import RunCatalog
+
+    incar = {}
+    for condition in filter(None, (c.strip() for c in incar_filters.split(","))):
+        match = re.match(r"^\s*(\w+)\s*(==|!=|>=|<=|>|<|=)\s*(\S+)\s*$", condition)
+        if not match:
+            return [{"error": f"Can not understand INCAR condition: {condition}"}]
+        name, op, value = match.groups()
+        incar[name] = ("==" if op == "=" else op, value)
+
+    try:
+        catalog = RunCatalog()
+        catalog.scan("server/")
+        return catalog.query(
+            elements=[e for e in elements.split("-") if e] or None,
+            exact=exact,
+            converged=converged,
+            incar=incar,
+        )
+    except Exception as e:
+        return [{"error": f"Failed to query VASP runs: {e}"}]
+
+
+_VASPRUN_TAILS = {}
+
+
+def check_vasp_progress(calcdir: str) -> dict:
+    """
+    Report the ionic steps a running VASP job has completed since the last check.
+
+    The vasprun.xml of the job is read incrementally: each call only decodes the
+    output appended since the previous call for the same directory, so it can be
+    polled cheaply while the calculation is still running.
+
+    Args:
+        calcdir (str): Path to the calculation directory, or a subpath under 'tmp/'.
+
+    Returns:
+        dict: The total number of completed steps, whether vasprun.xml is complete,
+              and the energy, max force and SCF step count of each new ionic step.
+
+    Example:
+        progress = check_vasp_progress("tmp/my_calc")
+        print(progress["new_steps"])
+    """
+    if not os.path.exists(calcdir):
+        calcdir = os.path.join("tmp", calcdir)
+        if not os.path.exists(calcdir):
+            return {"error": "Calculation directory does not exist."}
+
+    xml_path = os.path.abspath(os.path.join(calcdir, "vasprun.xml"))
+    if not os.path.isfile(xml_path):
+        return {"error": f"vasprun.xml not found in {calcdir}, the calculation may not have started yet."}
+
+    if xml_path not in _VASPRUN_TAILS:
+        _VASPRUN_TAILS[xml_path] = VasprunTail(xml_path)
+    tail = _VASPRUN_TAILS[xml_path]
+    try:
+        steps = tail.poll()
+    except Exception as e:
+        return {"error": f"Failed to read {xml_path}: {e}"}
+
+    new_steps = []
+    for step in steps:
+        new_steps.append({
+            "step": step["step"],
+            "energy": step.get("energy"),
+            "max_force": step.get("max_force"),
+            "scf_steps": step["nscsteps"],
+        })
+
+    return {
+        "calcdir": calcdir,
+        "completed_steps": tail.nsteps,
+        "finished": tail.finished,
+        "new_steps": new_steps,
+    }
 
 
 def write_vasp_report(xml_result: str) -> str:
@@ -355,8 +637,9 @@ def check_vasp_input(calcdir: str) -> dict:
         if not os.path.exists(calcdir):
             return {"error": "Calculation directory does not exist."}
         
-    os.remove("test.vt")
-    os.remove("POSCAR")
+    for leftover in ("test.vt", "POSCAR"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
     return {"success": True, "message": f"Calculation directory found at: {calcdir}"}
 
 